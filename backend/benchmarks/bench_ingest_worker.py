@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк очереди приема: стоимость enqueue в веб-запросе и пропускная способность воркера
+
+Запуск из каталога backend:
+    python benchmarks/bench_ingest_worker.py --events 20000 --clicks 5000 --batch-size 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask
+from src.database import db
+from src.models.user import User
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel
+from src.models.referral_step import ReferralStep
+from src.models.referral_link import ReferralLink
+from src.models.referral_tracking import ReferralTracking
+from src.models.analytics_event import AnalyticsEvent
+from src.models.project import Project
+from src.models.reference import Reference
+from src.services.ingest_queue import IngestQueue
+from src.tasks.ingest_worker import IngestWorker
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0',
+]
+
+LINKS_COUNT = 50
+
+def create_app(db_path):
+    """Создает минимальное приложение с таблицами и тестовыми ссылками"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        db.session.execute(User.__table__.insert(), [{
+            'id': 1, 'email': 'bench@example.com', 'password_hash': 'x',
+            'first_name': 'Bench', 'last_name': 'User', 'created_at': now
+        }])
+        db.session.execute(ReferralCampaign.__table__.insert(), [{
+            'id': 1, 'user_id': 1, 'title': 'Bench', 'campaign_type': 'promotion',
+            'campaign_code': 'BENCH1', 'created_at': now
+        }])
+        db.session.execute(ReferralLink.__table__.insert(), [
+            {
+                'id': link_id, 'campaign_id': 1, 'user_id': 1, 'link_name': f'link-{link_id}',
+                'short_code': f'bench{link_id}', 'full_url': f'/r/bench{link_id}',
+                'total_clicks': 0, 'unique_clicks': 0, 'created_at': now
+            }
+            for link_id in range(1, LINKS_COUNT + 1)
+        ])
+        db.session.commit()
+
+    return app
+
+def make_event(i):
+    return {
+        'user_id': None,
+        'session_id': f'session-{i // 20}',
+        'event_type': 'page_view' if i % 3 else 'custom',
+        'event_name': 'page_view' if i % 3 else 'button_click',
+        'page_url': f'/projects/{i % 20}',
+        'properties': {'index': i},
+        'user_agent': USER_AGENTS[i % len(USER_AGENTS)],
+        'ip_address': f'10.0.{i % 256}.{i % 97}',
+        'created_at': datetime.utcnow()
+    }
+
+def make_click(i):
+    link_id = i % LINKS_COUNT + 1
+    return {
+        'link_id': link_id,
+        'campaign_id': 1,
+        'channel_id': None,
+        'ip_address': f'10.1.{i % 256}.{i % 89}',
+        'user_agent': USER_AGENTS[i % len(USER_AGENTS)],
+        'referrer': 'https://t.me/',
+        'created_at': datetime.utcnow()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--clicks', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = create_app(os.path.join(tmp_dir, 'bench.db'))
+
+        queue = IngestQueue()
+        queue.configure(path=os.path.join(tmp_dir, 'queue.db'), enabled=True)
+
+        # Веб-сторона: одно событие - одна транзакция enqueue
+        started = time.perf_counter()
+        for i in range(args.events):
+            queue.enqueue('analytics', make_event(i))
+        for i in range(args.clicks):
+            queue.enqueue('referral_click', make_click(i))
+        enqueue_time = time.perf_counter() - started
+        total = args.events + args.clicks
+
+        worker = IngestWorker(queue)
+        worker.batch_size = args.batch_size
+
+        with app.app_context():
+            started = time.perf_counter()
+            while worker.run_once():
+                pass
+            worker_time = time.perf_counter() - started
+
+            clicks_written = db.session.execute(
+                db.select(db.func.sum(ReferralLink.__table__.c.total_clicks))
+            ).scalar() or 0
+
+        stats = queue.get_stats()
+
+    print(f"Событий аналитики:  {args.events}, кликов: {args.clicks}, пакет: {args.batch_size}")
+    print(f"enqueue:            {enqueue_time / total * 1e6:10.1f} мкс/событие")
+    print(f"воркер:             {total / worker_time:10.0f} событий/с ({worker_time:.2f} с)")
+    print(f"Записано кликов:    {clicks_written}, осталось в очереди: {stats['pending']}, ошибок: {worker.stats['failed']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк приема событий аналитики: /track (по одному) против /track/batch
+
+Запуск из каталога backend:
+    python benchmarks/bench_track_batch.py --events 2000 --batch-size 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask
+from src.database import db
+from src.routes.analytics import analytics_bp
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+)
+
+def create_app(db_path):
+    """Создает минимальное приложение с blueprint аналитики"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    
+    with app.app_context():
+        db.create_all()
+    
+    return app
+
+def make_event(i, session_id):
+    return {
+        'session_id': session_id,
+        'event_type': 'page_view' if i % 3 else 'custom',
+        'event_name': 'page_view' if i % 3 else 'button_click',
+        'page_url': f'/projects/{i % 20}',
+        'properties': {'index': i}
+    }
+
+def bench_single(client, total_events):
+    started = time.perf_counter()
+    for i in range(total_events):
+        response = client.post(
+            '/api/analytics/track',
+            json=make_event(i, f'single-{i // 25}'),
+            headers={'User-Agent': USER_AGENT}
+        )
+        assert response.status_code in (200, 202), response.get_data(as_text=True)
+    return time.perf_counter() - started
+
+def bench_batch(client, total_events, batch_size):
+    started = time.perf_counter()
+    for offset in range(0, total_events, batch_size):
+        events = [
+            make_event(i, f'batch-{i // 25}')
+            for i in range(offset, min(offset + batch_size, total_events))
+        ]
+        response = client.post(
+            '/api/analytics/track/batch',
+            json={'events': events},
+            headers={'User-Agent': USER_AGENT}
+        )
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = create_app(os.path.join(tmp_dir, 'bench.db'))
+        client = app.test_client()
+        
+        single_time = bench_single(client, args.events)
+        batch_time = bench_batch(client, args.events, args.batch_size)
+    
+    single_rate = args.events / single_time
+    batch_rate = args.events / batch_time
+    
+    print(f"События:            {args.events}")
+    print(f"/track:             {single_rate:10.0f} событий/с ({single_time:.2f} с)")
+    print(f"/track/batch ({args.batch_size:>3}): {batch_rate:10.0f} событий/с ({batch_time:.2f} с)")
+    print(f"Ускорение:          {batch_rate / single_rate:10.1f}x")
+
+if __name__ == '__main__':
+    main()
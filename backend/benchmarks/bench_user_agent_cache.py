@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк классификации User-Agent: кеш против разбора на каждый запрос
+
+Запуск из каталога backend:
+    python benchmarks/bench_user_agent_cache.py --requests 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.services import user_agent_service
+
+# Небольшой набор реальных строк: в живом трафике различных UA очень мало
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.6045.163 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
+    'Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36 YaBrowser/23.11.0.0',
+    'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'TelegramBot (like TwitterBot)',
+    'curl/8.4.0',
+]
+
+def sample_user_agents(count, seed=42):
+    """Выборка с распределением, близким к Zipf: популярные UA встречаются чаще"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(USER_AGENTS))]
+    return rng.choices(USER_AGENTS, weights=weights, k=count)
+
+def bench(func, corpus):
+    started = time.perf_counter()
+    for user_agent in corpus:
+        func(user_agent)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50000)
+    args = parser.parse_args()
+    
+    corpus = sample_user_agents(args.requests)
+    
+    for parser_name, uncached in user_agent_service._PARSERS.items():
+        user_agent_service.clear_cache()
+        uncached_time = bench(uncached, corpus)
+        cached_time = bench(
+            lambda ua: user_agent_service.classify_user_agent(ua, parser=parser_name),
+            corpus
+        )
+        stats = user_agent_service.get_cache_stats()
+        
+        print(f"[{parser_name}]")
+        print(f"  без кеша: {uncached_time / len(corpus) * 1e6:8.2f} мкс/запрос")
+        print(f"  с кешем:  {cached_time / len(corpus) * 1e6:8.2f} мкс/запрос")
+        print(f"  ускорение: {uncached_time / cached_time:.1f}x, hit rate: {stats['hit_rate']:.2%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк классификации реферальных User-Agent: прежние цепочки подстрок, правила и регулярные выражения по полям
+
+Запуск из каталога backend:
+    python benchmarks/bench_user_agent_rules.py --requests 200000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.services.user_agent_service import USER_AGENT_RULES_PATH, UserAgentInfo, UserAgentRules, referral_rules
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'user_agents.txt')
+
+LEGACY_BOT_INDICATORS = (
+    'bot', 'crawler', 'spider', 'scraper', 'curl', 'wget',
+    'googlebot', 'bingbot', 'yandexbot', 'facebookexternalhit',
+    'twitterbot', 'linkedinbot', 'whatsapp', 'telegram'
+)
+
+def legacy_classify(user_agent_string):
+    """Прежняя классификация: if/elif по подстрокам и any() по признакам ботов"""
+    user_agent = user_agent_string.lower()
+
+    if 'chrome' in user_agent:
+        browser = 'Chrome'
+    elif 'firefox' in user_agent:
+        browser = 'Firefox'
+    elif 'safari' in user_agent and 'chrome' not in user_agent:
+        browser = 'Safari'
+    elif 'edge' in user_agent:
+        browser = 'Edge'
+    elif 'opera' in user_agent:
+        browser = 'Opera'
+    else:
+        browser = 'Other'
+
+    if 'windows' in user_agent:
+        os_name = 'Windows'
+    elif 'mac' in user_agent:
+        os_name = 'macOS'
+    elif 'linux' in user_agent:
+        os_name = 'Linux'
+    elif 'android' in user_agent:
+        os_name = 'Android'
+    elif 'ios' in user_agent or 'iphone' in user_agent or 'ipad' in user_agent:
+        os_name = 'iOS'
+    else:
+        os_name = 'Other'
+
+    if 'mobile' in user_agent or 'android' in user_agent or 'iphone' in user_agent:
+        device_type = 'mobile'
+    elif 'tablet' in user_agent or 'ipad' in user_agent:
+        device_type = 'tablet'
+    else:
+        device_type = 'desktop'
+
+    is_bot = any(indicator in user_agent for indicator in LEGACY_BOT_INDICATORS)
+
+    return UserAgentInfo(device_type=device_type, browser=browser, os=os_name, is_bot=is_bot)
+
+class RegexRules:
+    """Те же правила регулярным выражением на каждое поле
+
+    Для поля - одна альтернатива всех его подстрок (длинные раньше
+    коротких), findall без перекрытий; из найденных подстрок берется
+    правило с наименьшим приоритетом. Подстрока, целиком вложенная в
+    более длинную найденную, учитывается вместе с ней.
+    """
+
+    def __init__(self, rules):
+        self.fields = []
+        for field in UserAgentRules.FIELDS:
+            priorities = {}
+            for priority, rule in enumerate(rules[field]['rules']):
+                for token in rule['match']:
+                    priorities.setdefault(token.lower(), priority)
+            tokens = sorted(priorities, key=len, reverse=True)
+            best = {
+                token: min(priorities[other] for other in tokens if other in token)
+                for token in tokens
+            }
+            pattern = re.compile('|'.join(map(re.escape, tokens)))
+            values = [rule['value'] for rule in rules[field]['rules']]
+            self.fields.append((pattern, best, values, rules[field]['default']))
+
+    def classify(self, user_agent_string):
+        user_agent = user_agent_string.lower()
+        values = []
+        for pattern, best, rule_values, default in self.fields:
+            found = pattern.findall(user_agent)
+            values.append(rule_values[min(best[token] for token in found)] if found else default)
+        return UserAgentInfo._make(values)
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as corpus_file:
+        return [line.rstrip('\n') for line in corpus_file if line.strip() and not line.startswith('#')]
+
+def bench(func, sample):
+    started = time.perf_counter()
+    for user_agent in sample:
+        func(user_agent)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--corpus', default=CORPUS_PATH)
+    parser.add_argument('--show-diff', action='store_true', help='вывести строки, где результаты различаются')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    # Без кеша: каждая строка разбирается заново, как при промахе LRU
+    sample = random.Random(42).choices(corpus, k=args.requests)
+
+    with open(USER_AGENT_RULES_PATH, encoding='utf-8') as rules_file:
+        regex_rules = RegexRules(json.load(rules_file))
+
+    legacy_time = bench(legacy_classify, sample)
+    rules_time = bench(referral_rules.classify, sample)
+    regex_time = bench(regex_rules.classify, sample)
+
+    print(f"Корпус: {len(corpus)} строк, запросов: {len(sample)}")
+    print(f"  прежние подстроки: {legacy_time / len(sample) * 1e6:8.2f} мкс/запрос")
+    print(f"  правила:           {rules_time / len(sample) * 1e6:8.2f} мкс/запрос")
+    print(f"  регулярки полей:   {regex_time / len(sample) * 1e6:8.2f} мкс/запрос")
+
+    mismatches = sum(regex_rules.classify(user_agent) != referral_rules.classify(user_agent) for user_agent in corpus)
+    print(f"  расхождений правил и регулярок: {mismatches}")
+
+    bots = sum(referral_rules.classify(user_agent).is_bot for user_agent in corpus)
+    print(f"  ботов в корпусе: {bots}")
+
+    differences = []
+    for user_agent in corpus:
+        legacy, rules = legacy_classify(user_agent), referral_rules.classify(user_agent)
+        fields = [field for field in UserAgentInfo._fields if getattr(legacy, field) != getattr(rules, field)]
+        if fields:
+            differences.append((user_agent, fields, legacy, rules))
+
+    print(f"  отличий от прежней классификации: {len(differences)} из {len(corpus)}")
+    if args.show_diff:
+        for user_agent, fields, legacy, rules in differences:
+            print(f"\n{user_agent}")
+            for field in fields:
+                print(f"  {field}: {getattr(legacy, field)} -> {getattr(rules, field)}")
+
+if __name__ == '__main__':
+    main()
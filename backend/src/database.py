@@ -14,6 +14,14 @@ def init_db(app):
     
     return db
 
+def dialect_insert(table):
+    """INSERT с поддержкой ON CONFLICT для текущего диалекта (SQLite/PostgreSQL)"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
 def get_db():
     """Получение экземпляра базы данных"""
     return db
@@ -1,11 +1,16 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Float, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from src.database import db
 
 class AnalyticsEvent(db.Model):
     """Модель для хранения событий аналитики"""
     __tablename__ = 'analytics_events'
+    __table_args__ = (
+        # Все rollup-задачи сканируют события за день по created_at
+        Index('ix_analytics_events_created_at', 'created_at'),
+        Index('ix_analytics_events_session_created', 'session_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Может быть анонимным
@@ -35,13 +40,85 @@ class AnalyticsEvent(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
-    user = relationship("User", back_populates="analytics_events")
-    project = relationship("Project", back_populates="analytics_events")
-    reference = relationship("Reference", back_populates="analytics_events")
+    user = relationship("User", backref="analytics_events")
+    project = relationship("Project", backref="analytics_events")
+    reference = relationship("Reference", backref="analytics_events")
+
+class AnalyticsHourlyCounter(db.Model):
+    """Почасовые счетчики событий, обновляемые инкрементально при приеме
+    
+    Пустые измерения хранятся как 0 / '' (а не NULL), чтобы уникальный
+    ключ работал для ON CONFLICT во всех СУБД.
+    """
+    __tablename__ = 'analytics_hourly_counters'
+    __table_args__ = (
+        UniqueConstraint(
+            'hour', 'event_name', 'project_id', 'device_type', 'browser', 'country',
+            name='uq_analytics_hourly_counters_bucket'
+        ),
+        Index('ix_analytics_hourly_counters_project', 'project_id', 'hour'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, nullable=False)  # Начало часа
+    event_name = Column(String(255), nullable=False)
+    project_id = Column(Integer, nullable=False, default=0)  # 0 - событие вне проекта
+    device_type = Column(String(50), nullable=False, default='')
+    browser = Column(String(100), nullable=False, default='')
+    country = Column(String(100), nullable=False, default='')
+    
+    count = Column(Integer, nullable=False, default=0)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AnalyticsSketch(db.Model):
+    """Дневные HyperLogLog-скетчи уникальных пользователей
+    
+    sketch_name: active_users (глобально, project_id = 0) или
+    project_viewers (по проектам). Скетчи сливаются за любой период.
+    """
+    __tablename__ = 'analytics_sketches'
+    __table_args__ = (
+        UniqueConstraint('sketch_name', 'date', 'project_id', name='uq_analytics_sketches_day'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    sketch_name = Column(String(100), nullable=False)
+    date = Column(DateTime, nullable=False)  # Начало дня
+    project_id = Column(Integer, nullable=False, default=0)  # 0 - глобальный скетч
+    
+    precision = Column(Integer, nullable=False)
+    registers = Column(LargeBinary, nullable=False)  # Сжатые регистры HyperLogLog
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AnalyticsTopKSketch(db.Model):
+    """Дневные Space-Saving скетчи самых частых значений
+    
+    sketch_name: referrers, countries, browsers или events - глобально
+    (project_id = 0) и по проектам. Скетчи сливаются за любой период.
+    """
+    __tablename__ = 'analytics_topk_sketches'
+    __table_args__ = (
+        UniqueConstraint('sketch_name', 'date', 'project_id', name='uq_analytics_topk_sketches_day'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    sketch_name = Column(String(100), nullable=False)
+    date = Column(DateTime, nullable=False)  # Начало дня
+    project_id = Column(Integer, nullable=False, default=0)  # 0 - глобальный скетч
+    
+    capacity = Column(Integer, nullable=False)
+    counters = Column(LargeBinary, nullable=False)  # Сжатые счетчики Space-Saving
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class AnalyticsMetric(db.Model):
     """Модель для агрегированных метрик"""
     __tablename__ = 'analytics_metrics'
+    __table_args__ = (
+        Index('ix_analytics_metrics_lookup', 'metric_type', 'date', 'metric_name'),
+    )
     
     id = Column(Integer, primary_key=True)
     metric_name = Column(String(255), nullable=False)  # Название метрики
@@ -67,8 +144,8 @@ class AnalyticsMetric(db.Model):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связи
-    user = relationship("User", back_populates="analytics_metrics")
-    project = relationship("Project", back_populates="analytics_metrics")
+    user = relationship("User", backref="analytics_metrics")
+    project = relationship("Project", backref="analytics_metrics")
 
 class UserSession(db.Model):
     """Модель для пользовательских сессий"""
@@ -103,7 +180,7 @@ class UserSession(db.Model):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связи
-    user = relationship("User", back_populates="sessions")
+    user = relationship("User", backref="sessions")
     events = relationship("AnalyticsEvent", foreign_keys=[session_id], 
                          primaryjoin="UserSession.session_id == AnalyticsEvent.session_id")
 
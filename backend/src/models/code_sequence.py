@@ -0,0 +1,17 @@
+from src.database import db
+from datetime import datetime
+
+class CodeSequence(db.Model):
+    """Счетчик распределителя кодов (src.services.code_allocator)
+    
+    Процессы резервируют из счетчика блоки значений атомарным UPDATE,
+    поэтому выданные разными процессами значения не пересекаются.
+    """
+    __tablename__ = 'code_sequences'
+    
+    name = db.Column(db.String(100), primary_key=True)  # referral_link, referral_campaign, project
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)  # Первое незарезервированное значение
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CodeSequence {self.name}: {self.next_value}>'
@@ -1,7 +1,6 @@
 from src.database import db
 from datetime import datetime
-import secrets
-import string
+from src.services.code_allocator import code_allocator, unique_slug
 
 class Project(db.Model):
     __tablename__ = 'projects'
@@ -33,23 +32,13 @@ class Project(db.Model):
             base_slug = ''.join(c.lower() if c.isalnum() else '-' for c in self.title)
             base_slug = base_slug.strip('-')[:30]
             
-            # Проверяем уникальность
-            counter = 1
-            slug = base_slug
-            while Project.query.filter_by(public_slug=slug).first():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            
-            self.public_slug = slug
+            # Уникальность - одним запросом по префиксу
+            self.public_slug = unique_slug(Project.public_slug, base_slug)
 
     def generate_short_code(self):
         """Генерирует короткий код для ссылки"""
         if not self.short_code:
-            while True:
-                code = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(8))
-                if not Project.query.filter_by(short_code=code).first():
-                    self.short_code = code
-                    break
+            self.short_code = code_allocator.next_code('project')
 
     def get_public_url(self, base_url=""):
         """Возвращает публичную ссылку на проект"""
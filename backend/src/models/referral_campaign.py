@@ -1,8 +1,7 @@
 from datetime import datetime
 from src.database import db
+from src.services.code_allocator import code_allocator, unique_slug
 import uuid
-import string
-import random
 
 class ReferralCampaign(db.Model):
     __tablename__ = 'referral_campaigns'
@@ -51,11 +50,8 @@ class ReferralCampaign(db.Model):
             self.public_slug = self.generate_slug(self.title)
     
     def generate_campaign_code(self):
-        """Генерирует уникальный код кампании"""
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            if not ReferralCampaign.query.filter_by(campaign_code=code).first():
-                return code
+        """Генерирует уникальный код кампании (без запросов к базе)"""
+        return code_allocator.next_code('referral_campaign')
     
     def generate_slug(self, title):
         """Генерирует уникальный slug из названия"""
@@ -65,14 +61,8 @@ class ReferralCampaign(db.Model):
         slug = re.sub(r'[-\s]+', '-', slug)
         slug = slug[:50]  # Ограничиваем длину
         
-        # Проверяем уникальность
-        original_slug = slug
-        counter = 1
-        while ReferralCampaign.query.filter_by(public_slug=slug).first():
-            slug = f"{original_slug}-{counter}"
-            counter += 1
-        
-        return slug
+        # Уникальность - одним запросом по префиксу
+        return unique_slug(ReferralCampaign.public_slug, slug)
     
     def calculate_conversion_rate(self):
         """Вычисляет коэффициент конверсии"""
@@ -1,9 +1,8 @@
 from datetime import datetime
 from src.database import db
+from src.services.code_allocator import code_allocator
+from urllib.parse import urlencode
 import uuid
-import string
-import random
-import hashlib
 
 class ReferralLink(db.Model):
     __tablename__ = 'referral_links'
@@ -55,34 +54,30 @@ class ReferralLink(db.Model):
             self.full_url = self.build_full_url()
     
     def generate_short_code(self):
-        """Генерирует уникальный короткий код"""
-        while True:
-            code = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-            if not ReferralLink.query.filter_by(short_code=code).first():
-                return code
+        """Генерирует уникальный короткий код (без запросов к базе)"""
+        return code_allocator.next_code('referral_link')
     
     def build_full_url(self):
         """Строит полную URL с UTM параметрами"""
         if not hasattr(self, 'campaign') or not self.campaign:
             return ""
         
-        base_url = f"/r/{self.short_code}"
-        
-        # Добавляем UTM параметры
-        utm_params = []
-        if self.utm_source:
-            utm_params.append(f"utm_source={self.utm_source}")
-        if self.utm_medium:
-            utm_params.append(f"utm_medium={self.utm_medium}")
-        if self.utm_campaign:
-            utm_params.append(f"utm_campaign={self.utm_campaign}")
-        if self.utm_term:
-            utm_params.append(f"utm_term={self.utm_term}")
-        if self.utm_content:
-            utm_params.append(f"utm_content={self.utm_content}")
+        return ReferralLink.build_url(self.short_code, {
+            'utm_source': self.utm_source,
+            'utm_medium': self.utm_medium,
+            'utm_campaign': self.utm_campaign,
+            'utm_term': self.utm_term,
+            'utm_content': self.utm_content
+        })
+    
+    @staticmethod
+    def build_url(short_code, utm_params):
+        """Короткая ссылка с непустыми UTM параметрами"""
+        base_url = f"/r/{short_code}"
         
-        if utm_params:
-            base_url += "?" + "&".join(utm_params)
+        query = urlencode([(name, value) for name, value in utm_params.items() if value])
+        if query:
+            base_url += "?" + query
         
         return base_url
     
@@ -123,76 +118,52 @@ class ReferralLink(db.Model):
     
     def get_click_hash(self, ip_address, user_agent):
         """Генерирует хеш для определения уникальности клика"""
-        data = f"{self.id}:{ip_address}:{user_agent}"
-        return hashlib.md5(data.encode()).hexdigest()
+        from src.services.referral_click_service import make_click_hash
+        return make_click_hash(self.id, ip_address, user_agent)
+    
+    def get_click_payload(self, ip_address, user_agent, referrer=None):
+        """Данные клика в виде простых значений для ReferralClickService"""
+        return {
+            'link_id': self.id,
+            'campaign_id': self.campaign_id,
+            'channel_id': self.channel_id,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'referrer': referrer,
+            'created_at': datetime.utcnow()
+        }
     
     def register_click(self, ip_address, user_agent, referrer=None):
         """Регистрирует клик по ссылке"""
+        from src.services.referral_click_service import ReferralClickService
+        
         if not self.can_be_clicked():
             return False, "Ссылка недоступна"
         
-        # Проверяем уникальность клика
-        click_hash = self.get_click_hash(ip_address, user_agent)
-        existing_tracking = ReferralTracking.query.filter_by(
-            link_id=self.id,
-            click_hash=click_hash
-        ).first()
-        
-        is_unique = existing_tracking is None
-        
-        # Обновляем статистику
-        self.total_clicks += 1
-        if is_unique:
-            self.unique_clicks += 1
-        
-        self.last_clicked_at = datetime.utcnow()
-        
-        # Создаем запись отслеживания
-        from .referral_tracking import ReferralTracking
-        tracking = ReferralTracking(
-            campaign_id=self.campaign_id,
-            channel_id=self.channel_id,
-            link_id=self.id,
-            click_hash=click_hash,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            referrer=referrer,
-            is_unique=is_unique
-        )
-        
-        db.session.add(tracking)
-        db.session.commit()
+        # Уникальность, разбор User-Agent, геолокация и счетчики ссылки -
+        # в общем пакетном обработчике (тот же, что у воркера очереди)
+        ReferralClickService.process_clicks([self.get_click_payload(ip_address, user_agent, referrer)])
         
         return True, "Клик зарегистрирован"
     
     def get_analytics_data(self, days=30):
         """Возвращает аналитические данные за период"""
-        from datetime import timedelta
-        from sqlalchemy import func
-        
-        start_date = datetime.utcnow() - timedelta(days=days)
+        from src.services.referral_analytics_service import ReferralAnalyticsService
         
-        # Группируем клики по дням
-        daily_clicks = db.session.query(
-            func.date(ReferralTracking.created_at).label('date'),
-            func.count(ReferralTracking.id).label('clicks'),
-            func.count(ReferralTracking.id).filter(ReferralTracking.is_unique == True).label('unique_clicks')
-        ).filter(
-            ReferralTracking.link_id == self.id,
-            ReferralTracking.created_at >= start_date
-        ).group_by(func.date(ReferralTracking.created_at)).all()
+        # Дневные агрегаты за завершенные дни и живой срез за сегодня
+        daily_clicks = ReferralAnalyticsService.get_link_daily_clicks(self.id, days)
         
         return {
             'daily_clicks': [
                 {
-                    'date': click.date.isoformat(),
-                    'clicks': click.clicks,
-                    'unique_clicks': click.unique_clicks
+                    'date': day.isoformat(),
+                    'clicks': clicks,
+                    'unique_clicks': unique_clicks
                 }
-                for click in daily_clicks
+                for day, clicks, unique_clicks in daily_clicks
             ],
-            'total_period_clicks': sum(click.clicks for click in daily_clicks),
-            'total_period_unique': sum(click.unique_clicks for click in daily_clicks)
+            'total_period_clicks': sum(clicks for _, clicks, _ in daily_clicks),
+            'total_period_unique': sum(unique_clicks for _, _, unique_clicks in daily_clicks)
         }
     
     def to_dict(self, include_analytics=False):
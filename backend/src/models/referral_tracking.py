@@ -1,9 +1,19 @@
 from datetime import datetime
 from src.database import db
+from src.services.user_agent_service import classify_user_agent
+from src.services.geoip_service import lookup_ip
 import json
 
 class ReferralTracking(db.Model):
     __tablename__ = 'referral_tracking'
+    __table_args__ = (
+        # Проверка уникальности клика по (link_id, click_hash)
+        db.Index('ix_referral_tracking_link_hash', 'link_id', 'click_hash'),
+        # Живой срез аналитики кампании и ссылки, дневные агрегаты
+        db.Index('ix_referral_tracking_campaign_created', 'campaign_id', 'created_at'),
+        db.Index('ix_referral_tracking_link_created', 'link_id', 'created_at'),
+        db.Index('ix_referral_tracking_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey('referral_campaigns.id'), nullable=False)
@@ -57,73 +67,25 @@ class ReferralTracking(db.Model):
         if not self.user_agent:
             return
         
-        user_agent = self.user_agent.lower()
-        
-        # Определяем браузер
-        if 'chrome' in user_agent:
-            self.browser = 'Chrome'
-        elif 'firefox' in user_agent:
-            self.browser = 'Firefox'
-        elif 'safari' in user_agent and 'chrome' not in user_agent:
-            self.browser = 'Safari'
-        elif 'edge' in user_agent:
-            self.browser = 'Edge'
-        elif 'opera' in user_agent:
-            self.browser = 'Opera'
-        else:
-            self.browser = 'Other'
-        
-        # Определяем ОС
-        if 'windows' in user_agent:
-            self.os = 'Windows'
-        elif 'mac' in user_agent:
-            self.os = 'macOS'
-        elif 'linux' in user_agent:
-            self.os = 'Linux'
-        elif 'android' in user_agent:
-            self.os = 'Android'
-        elif 'ios' in user_agent or 'iphone' in user_agent or 'ipad' in user_agent:
-            self.os = 'iOS'
-        else:
-            self.os = 'Other'
-        
-        # Определяем тип устройства
-        if 'mobile' in user_agent or 'android' in user_agent or 'iphone' in user_agent:
-            self.device_type = 'mobile'
-        elif 'tablet' in user_agent or 'ipad' in user_agent:
-            self.device_type = 'tablet'
-        else:
-            self.device_type = 'desktop'
+        info = classify_user_agent(self.user_agent, parser='referral')
+        self.browser = info.browser
+        self.os = info.os
+        self.device_type = info.device_type
     
     def detect_bot(self):
         """Определяет, является ли запрос ботом"""
         if not self.user_agent:
             return False
         
-        bot_indicators = [
-            'bot', 'crawler', 'spider', 'scraper', 'curl', 'wget',
-            'googlebot', 'bingbot', 'yandexbot', 'facebookexternalhit',
-            'twitterbot', 'linkedinbot', 'whatsapp', 'telegram'
-        ]
-        
-        user_agent_lower = self.user_agent.lower()
-        self.is_bot = any(indicator in user_agent_lower for indicator in bot_indicators)
+        self.is_bot = classify_user_agent(self.user_agent, parser='referral').is_bot
         return self.is_bot
     
     def get_location_from_ip(self):
-        """Определяет местоположение по IP адресу (заглушка)"""
-        # В реальном приложении здесь будет интеграция с сервисом геолокации
-        # Например, MaxMind GeoIP2 или ipapi.com
-        
-        # Заглушка для демонстрации
-        if self.ip_address:
-            # Простая проверка для российских IP (очень упрощенная)
-            if self.ip_address.startswith('192.168.') or self.ip_address.startswith('127.'):
-                self.country = 'RU'
-                self.city = 'Moscow'
-            else:
-                self.country = 'US'
-                self.city = 'New York'
+        """Определяет местоположение по IP адресу (локальная база GeoIP)"""
+        location = lookup_ip(self.ip_address)
+        if location is not None:
+            self.country = location.country
+            self.city = location.city
     
     def process_tracking_data(self):
         """Обрабатывает данные отслеживания"""
@@ -193,78 +155,40 @@ class ReferralTracking(db.Model):
     
     @staticmethod
     def get_campaign_analytics(campaign_id, days=30):
-        """Возвращает аналитику по кампании"""
-        from datetime import timedelta
-        from sqlalchemy import func
-        
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Общая статистика
-        total_events = ReferralTracking.query.filter(
-            ReferralTracking.campaign_id == campaign_id,
-            ReferralTracking.created_at >= start_date
-        ).count()
-        
-        unique_events = ReferralTracking.query.filter(
-            ReferralTracking.campaign_id == campaign_id,
-            ReferralTracking.is_unique == True,
-            ReferralTracking.created_at >= start_date
-        ).count()
+        """Возвращает аналитику по кампании (дневные агрегаты + живой срез)"""
+        from src.services.referral_analytics_service import ReferralAnalyticsService
         
-        conversions = ReferralTracking.query.filter(
-            ReferralTracking.campaign_id == campaign_id,
-            ReferralTracking.is_conversion == True,
-            ReferralTracking.created_at >= start_date
-        ).count()
-        
-        # Статистика по типам событий
-        event_stats = db.session.query(
-            ReferralTracking.event_type,
-            func.count(ReferralTracking.id).label('count')
-        ).filter(
-            ReferralTracking.campaign_id == campaign_id,
-            ReferralTracking.created_at >= start_date
-        ).group_by(ReferralTracking.event_type).all()
-        
-        # Статистика по устройствам
-        device_stats = db.session.query(
-            ReferralTracking.device_type,
-            func.count(ReferralTracking.id).label('count')
-        ).filter(
-            ReferralTracking.campaign_id == campaign_id,
-            ReferralTracking.created_at >= start_date
-        ).group_by(ReferralTracking.device_type).all()
-        
-        # Статистика по странам
-        country_stats = db.session.query(
-            ReferralTracking.country,
-            func.count(ReferralTracking.id).label('count')
-        ).filter(
-            ReferralTracking.campaign_id == campaign_id,
-            ReferralTracking.created_at >= start_date,
-            ReferralTracking.country.isnot(None)
-        ).group_by(ReferralTracking.country).all()
-        
-        return {
-            'total_events': total_events,
-            'unique_events': unique_events,
-            'conversions': conversions,
-            'conversion_rate': round((conversions / total_events * 100), 2) if total_events > 0 else 0,
-            'unique_rate': round((unique_events / total_events * 100), 2) if total_events > 0 else 0,
-            'event_types': [
-                {'type': stat.event_type, 'count': stat.count}
-                for stat in event_stats
-            ],
-            'devices': [
-                {'type': stat.device_type, 'count': stat.count}
-                for stat in device_stats
-            ],
-            'countries': [
-                {'country': stat.country, 'count': stat.count}
-                for stat in country_stats
-            ]
-        }
+        return ReferralAnalyticsService.get_campaign_analytics(campaign_id, days)
     
     def __repr__(self):
         return f'<ReferralTracking {self.event_type} for campaign {self.campaign_id}>'
 
+class ReferralDailyStat(db.Model):
+    """Дневные агрегаты referral_tracking
+
+    Одна строка на (день, кампания, ссылка, тип события, устройство,
+    страна); из них суммированием получаются итоги, разбивки кампании и
+    клики ссылки по дням. Пустые значения хранятся как '' (ссылка - как 0).
+    Заполняется ночной задачей (ReferralAnalyticsService.calculate_daily_rollups).
+    """
+    __tablename__ = 'referral_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint(
+            'date', 'campaign_id', 'link_id', 'event_type', 'device_type', 'country',
+            name='uq_referral_daily_stats_cell'
+        ),
+        db.Index('ix_referral_daily_stats_campaign_date', 'campaign_id', 'date'),
+        db.Index('ix_referral_daily_stats_link_date', 'link_id', 'date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.DateTime, nullable=False)  # Начало дня
+    campaign_id = db.Column(db.Integer, nullable=False)
+    link_id = db.Column(db.Integer, nullable=False, default=0)
+    event_type = db.Column(db.String(50), nullable=False, default='')
+    device_type = db.Column(db.String(20), nullable=False, default='')
+    country = db.Column(db.String(2), nullable=False, default='')
+    
+    events = db.Column(db.Integer, nullable=False, default=0)
+    unique_events = db.Column(db.Integer, nullable=False, default=0)
+    conversions = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,52 @@
+from src.database import db
+from datetime import datetime
+
+class JobLock(db.Model):
+    """Аренда (lease) фоновой задачи: задачу выполняет только владелец"""
+    __tablename__ = 'job_locks'
+    
+    job_name = db.Column(db.String(100), primary_key=True)
+    owner = db.Column(db.String(255), nullable=False)  # host:pid процесса-владельца
+    locked_until = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<JobLock {self.job_name} by {self.owner}>'
+
+class JobRun(db.Model):
+    """Журнал запусков фоновых задач"""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        db.Index('ix_job_runs_job_checkpoint', 'job_name', 'last_checkpoint'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(100), nullable=False)
+    owner = db.Column(db.String(255), nullable=False)
+    
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, success, failed
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)  # Длительность в секундах
+    
+    rows_processed = db.Column(db.Integer, default=0)
+    last_checkpoint = db.Column(db.String(100))  # Обработанный период, например дата
+    error = db.Column(db.Text)
+    
+    def to_dict(self):
+        """Преобразует объект в словарь"""
+        return {
+            'id': self.id,
+            'job_name': self.job_name,
+            'owner': self.owner,
+            'status': self.status,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration': self.duration,
+            'rows_processed': self.rows_processed,
+            'last_checkpoint': self.last_checkpoint,
+            'error': self.error
+        }
+    
+    def __repr__(self):
+        return f'<JobRun {self.job_name} {self.status}>'
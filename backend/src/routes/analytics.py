@@ -4,95 +4,245 @@ from datetime import datetime, timedelta
 from sqlalchemy import func, desc, and_, or_
 from sqlalchemy.orm import sessionmaker
 from src.database import get_db
-from src.models.analytics_event import AnalyticsEvent, AnalyticsMetric, UserSession
+from src.models.analytics_event import AnalyticsEvent, AnalyticsMetric, UserSession, AnalyticsHourlyCounter
 from src.models.user import User
 from src.models.project import Project
 from src.models.reference import Reference
 from src.services.prediction_service import PredictionService
+from src.services.analytics_service import AnalyticsService
+from src.services.analytics_buffer import analytics_buffer
+from src.services.user_agent_service import get_cache_stats as get_user_agent_cache_stats
+from src.services.cache_service import TTLCache
+from src.services.geoip_service import get_cache_stats as get_geoip_cache_stats
+from src.services.ingest_queue import ingest_queue
+from src.services.click_uniqueness import click_uniqueness
+from src.services.click_counters import click_counters
+import os
 import uuid
 import json
 import random
-from user_agents import parse
 
 analytics_bp = Blueprint('analytics', __name__)
 prediction_service = PredictionService()
 
+# Максимальное количество событий в одном пакетном запросе
+MAX_BATCH_EVENTS = 500
+
+# Кеш ответов дашборда (ключ - количество дней)
+dashboard_cache = TTLCache(ttl=int(os.getenv('DASHBOARD_CACHE_TTL', '60')))
+
+def _get_optional_user_id():
+    """Возвращает ID пользователя, если запрос авторизован"""
+    try:
+        if get_jwt():
+            return get_jwt_identity()
+    except:
+        pass
+    return None
+
+def _to_date(value):
+    """Приводит результат func.date (строка в SQLite, date в PostgreSQL) к date"""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+def _validate_event(event_data):
+    """Проверяет типы полей события. Возвращает текст ошибки или None
+    
+    Событие с неверными типами нельзя принимать в очередь: оно сорвало бы
+    пакетную запись событий других клиентов.
+    """
+    event_name = event_data.get('event_name')
+    if not event_name or not isinstance(event_name, str):
+        return 'Event name is required'
+    
+    for field in ('event_type', 'session_id', 'page_url', 'referrer_url'):
+        value = event_data.get(field)
+        if value is not None and not isinstance(value, str):
+            return f'Invalid {field}'
+    
+    for field in ('project_id', 'reference_id'):
+        value = event_data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            return 'Invalid project_id or reference_id'
+    
+    properties = event_data.get('properties')
+    if properties is not None and not isinstance(properties, dict):
+        return 'Invalid properties'
+    
+    return None
+
 @analytics_bp.route('/track', methods=['POST'])
 def track_event():
-    """Отслеживание события аналитики"""
+    """Отслеживание события аналитики
+    
+    Ответ зависит от способа записи:
+    - 200 {"success", "session_id", "event_id"} - событие записано сразу
+      (ANALYTICS_WRITE_BEHIND=false и очередь приема выключена);
+    - 202 {"success", "session_id", "queued": true} - событие принято в
+      буфер отложенной записи или очередь приема и будет записано позже,
+      поэтому event_id еще нет;
+    - 503 с Retry-After - буфер отложенной записи переполнен.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Event must be an object'}), 400
+        
+        error = _validate_event(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Получение данных из запроса
         session_id = data.get('session_id') or str(uuid.uuid4())
-        event_type = data.get('event_type', 'custom')
+        event_type = data.get('event_type') or 'custom'
         event_name = data.get('event_name')
         
-        if not event_name:
-            return jsonify({'error': 'Event name is required'}), 400
-        
         # Получение пользователя (если авторизован)
-        user_id = None
-        try:
-            if get_jwt():
-                user_id = get_jwt_identity()
-        except:
-            pass
-        
-        # Парсинг User-Agent
-        user_agent_string = request.headers.get('User-Agent', '')
-        user_agent = parse(user_agent_string)
-        
-        # Создание события
-        event = AnalyticsEvent(
-            user_id=user_id,
-            session_id=session_id,
-            event_type=event_type,
-            event_name=event_name,
-            project_id=data.get('project_id'),
-            reference_id=data.get('reference_id'),
-            page_url=data.get('page_url'),
-            referrer_url=data.get('referrer_url'),
-            properties=data.get('properties', {}),
-            user_agent=user_agent_string,
-            ip_address=request.remote_addr,
-            device_type='mobile' if user_agent.is_mobile else 'tablet' if user_agent.is_tablet else 'desktop',
-            browser=f"{user_agent.browser.family} {user_agent.browser.version_string}",
-            os=f"{user_agent.os.family} {user_agent.os.version_string}"
-        )
+        user_id = _get_optional_user_id()
         
-        db = get_db()
-        db.add(event)
-        
-        # Обновление или создание сессии
-        session = db.query(UserSession).filter_by(session_id=session_id).first()
-        if not session:
-            session = UserSession(
-                session_id=session_id,
-                user_id=user_id,
-                ip_address=request.remote_addr,
-                user_agent=user_agent_string,
-                device_type=event.device_type,
-                browser=event.browser,
-                os=event.os
-            )
-            db.add(session)
-        
-        # Обновление счетчиков сессии
-        session.events_count += 1
-        session.updated_at = datetime.utcnow()
+        # Сырое событие: разбор User-Agent и геолокация выполняются при записи
+        event = {
+            'user_id': user_id,
+            'session_id': session_id,
+            'event_type': event_type,
+            'event_name': event_name,
+            'project_id': data.get('project_id'),
+            'reference_id': data.get('reference_id'),
+            'page_url': data.get('page_url'),
+            'referrer_url': data.get('referrer_url'),
+            'properties': data.get('properties') or {},
+            'user_agent': request.headers.get('User-Agent', ''),
+            'ip_address': request.remote_addr,
+            'created_at': datetime.utcnow()
+        }
         
-        if event_type == 'page_view':
-            session.page_views += 1
-        elif event_type == 'project_view':
-            session.projects_viewed += 1
+        # Очередь приема: обогащение и запись выполняет src.tasks.ingest_worker
+        if ingest_queue.enabled:
+            ingest_queue.enqueue('analytics', event)
+            return jsonify({
+                'success': True,
+                'session_id': session_id,
+                'queued': True
+            }), 202
+        
+        AnalyticsService.enrich_event(event)
+        
+        if not analytics_buffer.enabled:
+            event_id = AnalyticsService.ingest_events([event], return_ids=True)[0]
+            return jsonify({
+                'success': True,
+                'session_id': session_id,
+                'event_id': event_id
+            })
         
-        db.commit()
+        if not analytics_buffer.submit(event):
+            response = jsonify({'error': 'Analytics buffer is full, retry later'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
         
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'event_id': event.id
+            'queued': True
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/track/batch', methods=['POST'])
+def track_events_batch():
+    """Пакетное отслеживание событий аналитики
+    
+    Принимает {"session_id": ..., "events": [...]}. Каждое событие может
+    переопределить session_id. Возвращает статус приема для каждого события.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        events = data.get('events')
+        
+        if not isinstance(events, list) or not events:
+            return jsonify({'error': 'Events list is required'}), 400
+        
+        if len(events) > MAX_BATCH_EVENTS:
+            return jsonify({'error': f'Too many events in batch (max {MAX_BATCH_EVENTS})'}), 413
+        
+        if data.get('session_id') is not None and not isinstance(data['session_id'], str):
+            return jsonify({'error': 'Invalid session_id'}), 400
+        
+        default_session_id = data.get('session_id') or str(uuid.uuid4())
+        user_id = _get_optional_user_id()
+        
+        user_agent_string = request.headers.get('User-Agent', '')
+        ip_address = request.remote_addr
+        created_at = datetime.utcnow()
+        
+        rows = []
+        results = []
+        for index, event_data in enumerate(events):
+            if not isinstance(event_data, dict):
+                results.append({'index': index, 'status': 'rejected', 'error': 'Event must be an object'})
+                continue
+            
+            error = _validate_event(event_data)
+            if error:
+                results.append({'index': index, 'status': 'rejected', 'error': error})
+                continue
+            
+            rows.append({
+                'user_id': user_id,
+                'session_id': event_data.get('session_id') or default_session_id,
+                'event_type': event_data.get('event_type') or 'custom',
+                'event_name': event_data['event_name'],
+                'project_id': event_data.get('project_id'),
+                'reference_id': event_data.get('reference_id'),
+                'page_url': event_data.get('page_url'),
+                'referrer_url': event_data.get('referrer_url'),
+                'properties': event_data.get('properties') or {},
+                'user_agent': user_agent_string,
+                'ip_address': ip_address,
+                'created_at': created_at
+            })
+            results.append({'index': index, 'status': 'accepted'})
+        
+        if ingest_queue.enabled:
+            ingest_queue.enqueue_many('analytics', rows)
+        else:
+            # User-Agent и IP одинаковы для всего пакета - разбор берется из кеша
+            AnalyticsService.ingest_events([AnalyticsService.enrich_event(row) for row in rows])
+        
+        return jsonify({
+            'success': bool(rows),
+            'session_id': default_session_id,
+            'accepted': len(rows),
+            'rejected': len(events) - len(rows),
+            'results': results
+        }), 200 if rows else 400
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/ingest/stats', methods=['GET'])
+@jwt_required()
+def get_ingest_stats():
+    """Статистика приема событий: очередь, буфер записи, кеши User-Agent, GeoIP и дашборда"""
+    try:
+        user_id = get_jwt_identity()
+        db = get_db()
+        
+        # Проверка прав администратора
+        user = db.session.query(User).filter_by(id=user_id).first()
+        if not user or not user.is_admin:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        return jsonify({
+            'write_buffer': analytics_buffer.get_stats(),
+            'user_agent_cache': get_user_agent_cache_stats(),
+            'dashboard_cache': dashboard_cache.get_stats(),
+            'geoip_cache': get_geoip_cache_stats(),
+            'ingest_queue': ingest_queue.get_stats() if ingest_queue.enabled else {'enabled': False},
+            'click_uniqueness': click_uniqueness.get_stats(),
+            'click_counters': click_counters.get_stats()
         })
         
     except Exception as e:
@@ -107,102 +257,20 @@ def get_dashboard_analytics():
         db = get_db()
         
         # Проверка прав администратора
-        user = db.query(User).filter_by(id=user_id).first()
+        user = db.session.query(User).filter_by(id=user_id).first()
         if not user or not user.is_admin:
             return jsonify({'error': 'Access denied'}), 403
         
         # Период для анализа (по умолчанию последние 30 дней)
         days = request.args.get('days', 30, type=int)
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Общая статистика
-        total_users = db.query(User).count()
-        total_projects = db.query(Project).count()
-        total_references = db.query(Reference).count()
-        
-        # Активные пользователи за период
-        active_users = db.query(func.count(func.distinct(AnalyticsEvent.user_id))).filter(
-            AnalyticsEvent.created_at >= start_date,
-            AnalyticsEvent.user_id.isnot(None)
-        ).scalar()
-        
-        # Новые пользователи за период
-        new_users = db.query(User).filter(User.created_at >= start_date).count()
-        
-        # Новые проекты за период
-        new_projects = db.query(Project).filter(Project.created_at >= start_date).count()
-        
-        # Популярные события
-        popular_events = db.query(
-            AnalyticsEvent.event_name,
-            func.count(AnalyticsEvent.id).label('count')
-        ).filter(
-            AnalyticsEvent.created_at >= start_date
-        ).group_by(AnalyticsEvent.event_name).order_by(desc('count')).limit(10).all()
-        
-        # Активность по дням
-        daily_activity = db.query(
-            func.date(AnalyticsEvent.created_at).label('date'),
-            func.count(AnalyticsEvent.id).label('events'),
-            func.count(func.distinct(AnalyticsEvent.user_id)).label('users')
-        ).filter(
-            AnalyticsEvent.created_at >= start_date
-        ).group_by(func.date(AnalyticsEvent.created_at)).order_by('date').all()
-        
-        # Топ проекты по просмотрам
-        top_projects = db.query(
-            Project.id,
-            Project.name,
-            func.count(AnalyticsEvent.id).label('views')
-        ).join(
-            AnalyticsEvent, Project.id == AnalyticsEvent.project_id
-        ).filter(
-            AnalyticsEvent.created_at >= start_date,
-            AnalyticsEvent.event_name == 'project_view'
-        ).group_by(Project.id, Project.name).order_by(desc('views')).limit(10).all()
-        
-        # Устройства и браузеры
-        devices = db.query(
-            AnalyticsEvent.device_type,
-            func.count(AnalyticsEvent.id).label('count')
-        ).filter(
-            AnalyticsEvent.created_at >= start_date
-        ).group_by(AnalyticsEvent.device_type).all()
         
-        browsers = db.query(
-            AnalyticsEvent.browser,
-            func.count(AnalyticsEvent.id).label('count')
-        ).filter(
-            AnalyticsEvent.created_at >= start_date
-        ).group_by(AnalyticsEvent.browser).order_by(desc('count')).limit(5).all()
+        # Ответ кешируется на DASHBOARD_CACHE_TTL секунд, одновременные
+        # запросы с тем же days ждут одного расчета
+        dashboard = dashboard_cache.get_or_set(
+            ('dashboard', days), lambda: AnalyticsService.get_dashboard_summary(days)
+        )
         
-        return jsonify({
-            'overview': {
-                'total_users': total_users,
-                'total_projects': total_projects,
-                'total_references': total_references,
-                'active_users': active_users,
-                'new_users': new_users,
-                'new_projects': new_projects
-            },
-            'popular_events': [{'name': e.event_name, 'count': e.count} for e in popular_events],
-            'daily_activity': [
-                {
-                    'date': activity.date.isoformat(),
-                    'events': activity.events,
-                    'users': activity.users
-                } for activity in daily_activity
-            ],
-            'top_projects': [
-                {
-                    'id': p.id,
-                    'name': p.name,
-                    'views': p.views
-                } for p in top_projects
-            ],
-            'devices': [{'type': d.device_type, 'count': d.count} for d in devices],
-            'browsers': [{'name': b.browser, 'count': b.count} for b in browsers]
-        })
+        return jsonify(dashboard)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -216,69 +284,48 @@ def get_project_analytics(project_id):
         db = get_db()
         
         # Проверка доступа к проекту
-        project = db.query(Project).filter_by(id=project_id).first()
+        project = db.session.query(Project).filter_by(id=project_id).first()
         if not project:
             return jsonify({'error': 'Project not found'}), 404
         
         # Проверка прав (владелец или администратор)
-        user = db.query(User).filter_by(id=user_id).first()
+        user = db.session.query(User).filter_by(id=user_id).first()
         if project.user_id != user_id and not user.is_admin:
             return jsonify({'error': 'Access denied'}), 403
         
         # Период для анализа
         days = request.args.get('days', 30, type=int)
         start_date = datetime.utcnow() - timedelta(days=days)
+        start_hour = start_date.replace(minute=0, second=0, microsecond=0)
         
-        # Общие метрики проекта
-        total_views = db.query(func.count(AnalyticsEvent.id)).filter(
-            AnalyticsEvent.project_id == project_id,
-            AnalyticsEvent.event_name == 'project_view',
-            AnalyticsEvent.created_at >= start_date
-        ).scalar()
-        
-        unique_viewers = db.query(func.count(func.distinct(AnalyticsEvent.user_id))).filter(
-            AnalyticsEvent.project_id == project_id,
-            AnalyticsEvent.event_name == 'project_view',
-            AnalyticsEvent.created_at >= start_date,
-            AnalyticsEvent.user_id.isnot(None)
-        ).scalar()
-        
-        # Просмотры по дням
-        daily_views = db.query(
-            func.date(AnalyticsEvent.created_at).label('date'),
-            func.count(AnalyticsEvent.id).label('views'),
-            func.count(func.distinct(AnalyticsEvent.user_id)).label('unique_users')
-        ).filter(
-            AnalyticsEvent.project_id == project_id,
-            AnalyticsEvent.event_name == 'project_view',
-            AnalyticsEvent.created_at >= start_date
-        ).group_by(func.date(AnalyticsEvent.created_at)).order_by('date').all()
-        
-        # Источники трафика
-        referrers = db.query(
-            AnalyticsEvent.referrer_url,
-            func.count(AnalyticsEvent.id).label('count')
-        ).filter(
-            AnalyticsEvent.project_id == project_id,
-            AnalyticsEvent.event_name == 'project_view',
-            AnalyticsEvent.created_at >= start_date,
-            AnalyticsEvent.referrer_url.isnot(None)
-        ).group_by(AnalyticsEvent.referrer_url).order_by(desc('count')).limit(10).all()
-        
-        # География пользователей
-        countries = db.query(
-            AnalyticsEvent.country,
-            func.count(AnalyticsEvent.id).label('count')
+        counter_count = func.sum(AnalyticsHourlyCounter.count)
+        
+        # Просмотры по дням (из почасовых агрегатов)
+        daily_views = db.session.query(
+            func.date(AnalyticsHourlyCounter.hour).label('date'),
+            counter_count.label('views')
         ).filter(
-            AnalyticsEvent.project_id == project_id,
-            AnalyticsEvent.created_at >= start_date,
-            AnalyticsEvent.country.isnot(None)
-        ).group_by(AnalyticsEvent.country).order_by(desc('count')).limit(10).all()
+            AnalyticsHourlyCounter.project_id == project_id,
+            AnalyticsHourlyCounter.event_name == 'project_view',
+            AnalyticsHourlyCounter.hour >= start_hour
+        ).group_by(func.date(AnalyticsHourlyCounter.hour)).order_by('date').all()
+        
+        # Общие метрики проекта
+        total_views = sum(view.views for view in daily_views)
+        
+        # Уникальные зрители (слияние дневных HLL-скетчей проекта)
+        unique_viewers, daily_unique_users = AnalyticsService.get_unique_counts(
+            'project_viewers', start_date, project_id=project_id
+        )
+        
+        # Источники трафика и география (слияние дневных top-K скетчей проекта)
+        referrers = AnalyticsService.get_top_items('referrers', start_date, project_id=project_id)
+        countries = AnalyticsService.get_top_items('countries', start_date, project_id=project_id)
         
         return jsonify({
             'project': {
                 'id': project.id,
-                'name': project.name,
+                'name': project.title,
                 'created_at': project.created_at.isoformat()
             },
             'metrics': {
@@ -287,16 +334,16 @@ def get_project_analytics(project_id):
             },
             'daily_views': [
                 {
-                    'date': view.date.isoformat(),
+                    'date': str(view.date),
                     'views': view.views,
-                    'unique_users': view.unique_users
+                    'unique_users': daily_unique_users.get(_to_date(view.date), 0)
                 } for view in daily_views
             ],
             'referrers': [
-                {'url': r.referrer_url, 'count': r.count} for r in referrers
+                {'url': url, 'count': count} for url, count in referrers
             ],
             'countries': [
-                {'country': c.country, 'count': c.count} for c in countries
+                {'country': country, 'count': count} for country, count in countries
             ]
         })
         
@@ -312,7 +359,7 @@ def get_user_analytics():
         db = get_db()
         
         # Проверка прав администратора
-        user = db.query(User).filter_by(id=user_id).first()
+        user = db.session.query(User).filter_by(id=user_id).first()
         if not user or not user.is_admin:
             return jsonify({'error': 'Access denied'}), 403
         
@@ -321,7 +368,7 @@ def get_user_analytics():
         start_date = datetime.utcnow() - timedelta(days=days)
         
         # Регистрации по дням
-        daily_registrations = db.query(
+        daily_registrations = db.session.query(
             func.date(User.created_at).label('date'),
             func.count(User.id).label('registrations')
         ).filter(
@@ -329,7 +376,7 @@ def get_user_analytics():
         ).group_by(func.date(User.created_at)).order_by('date').all()
         
         # Активность пользователей
-        user_activity = db.query(
+        user_activity = db.session.query(
             User.id,
             User.first_name,
             User.last_name,
@@ -347,12 +394,9 @@ def get_user_analytics():
         
         # Сегментация пользователей
         segments = {
-            'new_users': db.query(User).filter(User.created_at >= start_date).count(),
-            'active_users': db.query(func.count(func.distinct(AnalyticsEvent.user_id))).filter(
-                AnalyticsEvent.created_at >= start_date,
-                AnalyticsEvent.user_id.isnot(None)
-            ).scalar(),
-            'creators': db.query(func.count(func.distinct(Project.user_id))).filter(
+            'new_users': db.session.query(User).filter(User.created_at >= start_date).count(),
+            'active_users': AnalyticsService.get_unique_counts('active_users', start_date)[0],
+            'creators': db.session.query(func.count(func.distinct(Project.user_id))).filter(
                 Project.created_at >= start_date
             ).scalar()
         }
@@ -360,7 +404,7 @@ def get_user_analytics():
         return jsonify({
             'daily_registrations': [
                 {
-                    'date': reg.date.isoformat(),
+                    'date': _to_date(reg.date).isoformat(),
                     'registrations': reg.registrations
                 } for reg in daily_registrations
             ],
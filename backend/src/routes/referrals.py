@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import func, case
 from src.database import db
@@ -8,6 +8,11 @@ from src.models.referral_step import ReferralStep
 from src.models.referral_link import ReferralLink
 from src.models.referral_tracking import ReferralTracking
 from src.models.user import User
+from src.services.ingest_queue import ingest_queue
+from src.services.link_resolver import link_resolver
+from src.services.campaign_cache import load_campaign_tree, public_campaign_cache
+from src.services.referral_click_service import ReferralClickService
+from src.services.referral_link_bulk_service import ReferralLinkBulkService
 from datetime import datetime, timedelta
 import json
 
@@ -86,7 +91,8 @@ def get_campaign(campaign_id):
     """Получить детали кампании"""
     try:
         user_id = get_jwt_identity()
-        campaign = ReferralCampaign.query.filter_by(id=campaign_id, user_id=user_id).first()
+        # Каналы и шаги загружаются вместе с кампанией (selectin)
+        campaign = load_campaign_tree(id=campaign_id, user_id=user_id)
         
         if not campaign:
             return jsonify({'error': 'Кампания не найдена'}), 404
@@ -427,6 +433,39 @@ def create_link(campaign_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@referrals_bp.route('/campaigns/<int:campaign_id>/links/bulk', methods=['POST'])
+@jwt_required()
+def create_links_bulk(campaign_id):
+    """Массово создать ссылки по шаблону (count или recipients), ответ - CSV"""
+    try:
+        user_id = get_jwt_identity()
+        campaign = ReferralCampaign.query.filter_by(id=campaign_id, user_id=user_id).first()
+        
+        if not campaign:
+            return jsonify({'error': 'Кампания не найдена'}), 404
+        
+        try:
+            template, recipients, count = ReferralLinkBulkService.parse_template(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if template['channel_id'] is not None and not ReferralChannel.query.filter_by(
+            id=template['channel_id'], campaign_id=campaign_id
+        ).first():
+            return jsonify({'error': 'Канал не найден'}), 404
+        
+        # Ссылки создаются и отдаются частями по мере вставки
+        return Response(
+            stream_with_context(ReferralLinkBulkService.generate_links(
+                campaign_id, user_id, template, count, recipients
+            )),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=links_{campaign.campaign_code}.csv'}
+        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @referrals_bp.route('/links/<int:link_id>', methods=['GET'])
 @jwt_required()
 def get_link(link_id):
@@ -493,28 +532,41 @@ def update_link(link_id):
 def redirect_referral_link(short_code):
     """Редирект по короткой ссылке"""
     try:
-        link = ReferralLink.query.filter_by(short_code=short_code).first()
+        # Снимок ссылки из кеша процесса - без запроса к базе
+        link = link_resolver.resolve(short_code)
         
         if not link:
             return jsonify({'error': 'Ссылка не найдена'}), 404
         
-        # Получаем информацию о клике
-        ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        user_agent = request.headers.get('User-Agent', '')
-        referrer = request.headers.get('Referer', '')
-        
-        # Регистрируем клик
-        success, message = link.register_click(ip_address, user_agent, referrer)
+        if not link_resolver.can_be_clicked(link):
+            return jsonify({'error': 'Ссылка недоступна'}), 400
         
-        if not success:
-            return jsonify({'error': message}), 400
+        # Получаем информацию о клике
+        click = {
+            'link_id': link.link_id,
+            'campaign_id': link.campaign_id,
+            'channel_id': link.channel_id,
+            'ip_address': request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr),
+            'user_agent': request.headers.get('User-Agent', ''),
+            'referrer': request.headers.get('Referer', ''),
+            'created_at': datetime.utcnow()
+        }
+        
+        # Клики ботов не записываются и не ставятся в очередь
+        if ReferralClickService.drop_bot_clicks([click]):
+            if ingest_queue.enabled:
+                # Клик обрабатывает воркер очереди приема (src.tasks.ingest_worker)
+                ingest_queue.enqueue('referral_click', click)
+            else:
+                # Регистрируем клик
+                ReferralClickService.process_clicks([click])
         
         # В реальном приложении здесь будет редирект на целевую страницу
         # Пока возвращаем информацию о кампании
         return jsonify({
             'message': 'Клик зарегистрирован',
-            'campaign': link.campaign.to_public_dict(),
-            'redirect_url': f'/campaigns/{link.campaign.public_slug}'
+            'campaign': dict(link.campaign),
+            'redirect_url': f'/campaigns/{link.public_slug}'
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -523,25 +575,12 @@ def redirect_referral_link(short_code):
 def get_public_campaign(slug):
     """Получить публичную информацию о кампании"""
     try:
-        campaign = ReferralCampaign.query.filter_by(public_slug=slug, is_active=True).first()
+        # Публичные данные кешируются по slug и сбрасываются при изменениях
+        campaign_data = public_campaign_cache.get(slug)
         
-        if not campaign:
+        if not campaign_data:
             return jsonify({'error': 'Кампания не найдена'}), 404
         
-        # Возвращаем только публичную информацию
-        campaign_data = campaign.to_public_dict()
-        campaign_data['channels'] = [
-            {
-                'channel_type': channel.channel_type,
-                'channel_name': channel.channel_name,
-                'description': channel.description,
-                'icon': channel.get_channel_icon(),
-                'color': channel.get_channel_color(),
-                'steps_count': len(channel.get_active_steps())
-            }
-            for channel in campaign.get_active_channels()
-        ]
-        
         return jsonify({'campaign': campaign_data})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,155 @@
+from flask import current_app
+from src.services.analytics_service import AnalyticsService
+import atexit
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+class AnalyticsWriteBuffer:
+    """Буфер отложенной записи (write-behind) для событий аналитики
+
+    Запросы /track только кладут подготовленное событие в очередь процесса.
+    Фоновый поток сбрасывает очередь пакетами через
+    AnalyticsService.ingest_events: по достижении порога размера или по
+    таймеру. Когда очередь заполнена, submit() возвращает False, и вызывающий
+    код должен ответить клиенту отказом (backpressure). Пакет, запись которого
+    не удалась, повторяется половинами: в лог и stats['failed'] попадают
+    только сбойные события. При остановке процесса очередь дописывается в базу.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('ANALYTICS_WRITE_BEHIND', 'true').lower() == 'true'
+        self.max_size = int(os.getenv('ANALYTICS_BUFFER_MAX_SIZE', '10000'))
+        self.flush_size = int(os.getenv('ANALYTICS_BUFFER_FLUSH_SIZE', '500'))
+        self.flush_interval = float(os.getenv('ANALYTICS_BUFFER_FLUSH_INTERVAL', '2.0'))
+        self.put_timeout = float(os.getenv('ANALYTICS_BUFFER_PUT_TIMEOUT', '0.05'))
+
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._stopping = threading.Event()
+        self._atexit_registered = False
+
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'written': 0,
+            'failed': 0,
+            'flushes': 0
+        }
+
+    def submit(self, event):
+        """Добавляет событие в буфер. Возвращает False, если буфер переполнен"""
+        self._ensure_started()
+
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            self._flush_requested.set()
+            return False
+
+        self.stats['submitted'] += 1
+        if self._queue.qsize() >= self.flush_size:
+            self._flush_requested.set()
+        return True
+
+    def flush(self):
+        """Синхронно записывает все накопленные события, возвращает их количество"""
+        if self._app is None:
+            return 0
+        return self._drain()
+
+    def shutdown(self, timeout=10.0):
+        """Останавливает фоновый поток и дописывает очередь"""
+        self._stopping.set()
+        self._flush_requested.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        # Дописываем то, что могло попасть в очередь после остановки потока
+        self.flush()
+        logger.info(f"Analytics write buffer stopped: {self.stats}")
+
+    def get_stats(self):
+        """Статистика буфера для мониторинга"""
+        return dict(self.stats, queued=self._queue.qsize(), max_size=self.max_size)
+
+    def _ensure_started(self):
+        """Ленивый запуск потока - уже после fork воркера gunicorn"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._app = current_app._get_current_object()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='analytics-write-behind', daemon=True
+            )
+            self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+            logger.info("Analytics write buffer started")
+
+    def _run(self):
+        """Основной цикл потока записи"""
+        while not self._stopping.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        """Записывает очередь пакетами по flush_size событий"""
+        written = 0
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.flush_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if not batch:
+                return written
+
+            written += self._write(batch)
+
+            if len(batch) < self.flush_size:
+                return written
+
+    def _write(self, batch):
+        with self._app.app_context():
+            return self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        """Записывает пакет; при ошибке - половинами, чтобы отбросить только сбойные события
+
+        Возвращает количество записанных событий.
+        """
+        try:
+            AnalyticsService.ingest_events(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                self.stats['failed'] += 1
+                logger.error(f"Dropping analytics event that failed to write: {batch[0]!r}: {str(e)}")
+                return 0
+            middle = len(batch) // 2
+            return self._write_batch(batch[:middle]) + self._write_batch(batch[middle:])
+
+        self.stats['written'] += len(batch)
+        self.stats['flushes'] += 1
+        return len(batch)
+
+# Глобальный экземпляр буфера (один на процесс)
+analytics_buffer = AnalyticsWriteBuffer()
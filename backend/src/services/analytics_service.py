@@ -1,108 +1,953 @@
-from datetime import datetime, timedelta
-from sqlalchemy import func, desc, and_, or_
+from datetime import date as date_type, datetime, timedelta
+from sqlalchemy import func, desc, and_, or_, bindparam, select, case, tuple_, delete
 from sqlalchemy.orm import sessionmaker
-from src.database import get_db
-from src.models.analytics_event import AnalyticsEvent, AnalyticsMetric, UserSession
+from src.database import get_db, dialect_insert
+from src.models.analytics_event import AnalyticsEvent, AnalyticsMetric, UserSession, AnalyticsHourlyCounter, AnalyticsSketch, AnalyticsTopKSketch
 from src.models.user import User
 from src.models.project import Project
 from src.models.reference import Reference
+from src.services.hyperloglog import HyperLogLog
+from src.services.topk_sketch import SpaceSaving
+from src.services.user_agent_service import classify_user_agent
+from src.services.geoip_service import lookup_ip
+from src.services.trending_service import trending_service
+from src.services.job_lock_service import job_lock_service
 import json
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Точность HyperLogLog-скетчей по типам (стандартная ошибка 1.04 / sqrt(2^p))
+SKETCH_PRECISION = {
+    'active_users': 14,    # ~0.81%, 16 КБ на день
+    'project_viewers': 11  # ~2.3%, до 2 КБ на проект в день
+}
+
+# Top-K скетчи: поле события и число счетчиков Space-Saving
+TOPK_SKETCHES = {
+    'referrers': ('referrer_url', 200),
+    'countries': ('country', 100),
+    'browsers': ('browser', 100),
+    'events': ('event_name', 100)
+}
+
+# Имя ночной задачи метрик проектов в job_runs: ее успешные запуски отмечают агрегированные дни
+PROJECT_METRICS_JOB_NAME = 'project_metrics'
+
 class AnalyticsService:
     """Сервис для сбора и обработки аналитических данных"""
     
     @staticmethod
-    def calculate_daily_metrics(date=None):
-        """Расчет ежедневных метрик"""
-        if date is None:
-            date = datetime.utcnow().date()
+    def enrich_event(event):
+        """Дополняет сырое событие данными User-Agent, геолокацией и временем
+        
+        Используется веб-запросом при синхронной записи и воркером очереди
+        приема (src.tasks.ingest_worker). Разбор User-Agent и GeoIP
+        кешируются, поэтому повторяющиеся значения почти бесплатны.
+        """
+        user_agent_info = classify_user_agent(event.get('user_agent'), parser='analytics')
+        location = lookup_ip(event.get('ip_address'))
+        
+        event['device_type'] = user_agent_info.device_type
+        event['browser'] = user_agent_info.browser
+        event['os'] = user_agent_info.os
+        event['country'] = location.country if location else None
+        event['city'] = location.city if location else None
+        
+        created_at = event.get('created_at')
+        if isinstance(created_at, str):
+            event['created_at'] = datetime.fromisoformat(created_at)
+        elif created_at is None:
+            event['created_at'] = datetime.utcnow()
+        
+        return event
+    
+    @staticmethod
+    def ingest_events(events, return_ids=False):
+        """Пакетная запись событий аналитики
+        
+        Принимает список словарей с полями AnalyticsEvent (данные User-Agent
+        уже разобраны). Все события вставляются одним bulk INSERT, а счетчики
+        UserSession обновляются одним UPDATE на сессию вместо коммита на
+        каждое событие. Возвращает количество записанных событий, а при
+        return_ids=True - список id событий в порядке events.
+        """
+        if not events:
+            return [] if return_ids else 0
         
         db = get_db()
+        events_table = AnalyticsEvent.__table__
+        sessions_table = UserSession.__table__
+        
+        try:
+            now = datetime.utcnow()
+            
+            # Группировка событий по сессиям
+            session_stats = {}
+            for event in events:
+                event.setdefault('created_at', now)
+                stats = session_stats.get(event['session_id'])
+                if stats is None:
+                    stats = session_stats[event['session_id']] = {
+                        'first_event': event,
+                        'events_count': 0,
+                        'page_views': 0,
+                        'projects_viewed': 0
+                    }
+                stats['events_count'] += 1
+                if event['event_type'] == 'page_view':
+                    stats['page_views'] += 1
+                elif event['event_type'] == 'project_view':
+                    stats['projects_viewed'] += 1
+            
+            if return_ids:
+                event_ids = db.session.execute(
+                    events_table.insert().returning(events_table.c.id, sort_by_parameter_order=True), events
+                ).scalars().all()
+            else:
+                db.session.execute(events_table.insert(), events)
+            
+            existing_sessions = {
+                row.session_id for row in db.session.execute(
+                    select(sessions_table.c.session_id).where(
+                        sessions_table.c.session_id.in_(list(session_stats))
+                    )
+                )
+            }
+            
+            session_updates = []
+            new_sessions = []
+            for session_id, stats in session_stats.items():
+                if session_id in existing_sessions:
+                    session_updates.append({
+                        'b_session_id': session_id,
+                        'b_events_count': stats['events_count'],
+                        'b_page_views': stats['page_views'],
+                        'b_projects_viewed': stats['projects_viewed'],
+                        'b_updated_at': now
+                    })
+                else:
+                    first_event = stats['first_event']
+                    new_sessions.append({
+                        'session_id': session_id,
+                        'user_id': first_event.get('user_id'),
+                        'start_time': first_event['created_at'],
+                        'ip_address': first_event.get('ip_address'),
+                        'user_agent': first_event.get('user_agent'),
+                        'device_type': first_event.get('device_type'),
+                        'browser': first_event.get('browser'),
+                        'os': first_event.get('os'),
+                        'country': first_event.get('country'),
+                        'city': first_event.get('city'),
+                        'events_count': stats['events_count'],
+                        'page_views': stats['page_views'],
+                        'projects_viewed': stats['projects_viewed'],
+                        'updated_at': now
+                    })
+            
+            if session_updates:
+                db.session.execute(
+                    sessions_table.update().where(
+                        sessions_table.c.session_id == bindparam('b_session_id')
+                    ).values(
+                        events_count=func.coalesce(sessions_table.c.events_count, 0) + bindparam('b_events_count'),
+                        page_views=func.coalesce(sessions_table.c.page_views, 0) + bindparam('b_page_views'),
+                        projects_viewed=func.coalesce(sessions_table.c.projects_viewed, 0) + bindparam('b_projects_viewed'),
+                        updated_at=bindparam('b_updated_at')
+                    ),
+                    session_updates
+                )
+            
+            if new_sessions:
+                db.session.execute(sessions_table.insert(), new_sessions)
+            
+            AnalyticsService._increment_hourly_counters(events)
+            AnalyticsService._update_unique_sketches(events)
+            AnalyticsService._update_topk_sketches(events)
+            
+            db.session.commit()
+            trending_service.record_views(events)
+            return event_ids if return_ids else len(events)
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error ingesting analytics events: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _increment_hourly_counters(events):
+        """Инкрементальное обновление почасовых счетчиков для пакета событий
+        
+        События агрегируются в памяти по ключу счетчика, после чего каждый
+        ключ обновляется одним INSERT ... ON CONFLICT DO UPDATE count + n.
+        Коммит выполняет вызывающий код.
+        """
+        buckets = {}
+        for event in events:
+            key = (
+                event['created_at'].replace(minute=0, second=0, microsecond=0),
+                event['event_name'],
+                event.get('project_id') or 0,
+                event.get('device_type') or '',
+                event.get('browser') or '',
+                event.get('country') or ''
+            )
+            buckets[key] = buckets.get(key, 0) + 1
+        
+        if not buckets:
+            return
+        
+        db = get_db()
+        table = AnalyticsHourlyCounter.__table__
+        now = datetime.utcnow()
+        
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['hour', 'event_name', 'project_id', 'device_type', 'browser', 'country'],
+            set_={
+                'count': table.c['count'] + stmt.excluded['count'],
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt, [
+            {
+                'hour': hour,
+                'event_name': event_name,
+                'project_id': project_id,
+                'device_type': device_type,
+                'browser': browser,
+                'country': country,
+                'count': count,
+                'updated_at': now
+            }
+            for (hour, event_name, project_id, device_type, browser, country), count in buckets.items()
+        ])
+    
+    @staticmethod
+    def rebuild_hourly_counters(date):
+        """Пересобирает почасовые счетчики дня из сырых событий
+        
+        Приемка наполняет счетчики только для новых событий, поэтому история
+        до их появления и дни с ошибками приема читались бы нулями. Счетчики
+        дня считаются одним GROUP BY по analytics_events и записываются
+        upsert'ом поверх удаленных строк дня. Возвращает число счетчиков.
+        """
+        db = get_db()
+        table = AnalyticsHourlyCounter.__table__
         
         try:
-            # Период для расчета (один день)
             start_date = datetime.combine(date, datetime.min.time())
             end_date = start_date + timedelta(days=1)
             
-            # Общие метрики
-            total_events = db.query(func.count(AnalyticsEvent.id)).filter(
-                AnalyticsEvent.created_at >= start_date,
-                AnalyticsEvent.created_at < end_date
-            ).scalar()
+            if db.engine.dialect.name == 'postgresql':
+                hour = func.date_trunc('hour', AnalyticsEvent.created_at)
+            else:
+                hour = func.strftime('%Y-%m-%d %H:00:00', AnalyticsEvent.created_at)
+            
+            dimensions = (
+                hour,
+                AnalyticsEvent.event_name,
+                func.coalesce(AnalyticsEvent.project_id, 0),
+                func.coalesce(AnalyticsEvent.device_type, ''),
+                func.coalesce(AnalyticsEvent.browser, ''),
+                func.coalesce(AnalyticsEvent.country, '')
+            )
+            rows = db.session.execute(
+                select(*dimensions, func.count(AnalyticsEvent.id)).where(
+                    AnalyticsEvent.created_at >= start_date,
+                    AnalyticsEvent.created_at < end_date
+                ).group_by(*dimensions)
+            ).all()
+            
+            now = datetime.utcnow()
+            counters = [
+                {
+                    # strftime в SQLite возвращает строку
+                    'hour': datetime.fromisoformat(bucket) if isinstance(bucket, str) else bucket,
+                    'event_name': event_name,
+                    'project_id': project_id,
+                    'device_type': device_type,
+                    'browser': browser,
+                    'country': country,
+                    'count': count,
+                    'updated_at': now
+                }
+                for bucket, event_name, project_id, device_type, browser, country, count in rows
+            ]
+            
+            db.session.execute(delete(table).where(table.c.hour >= start_date, table.c.hour < end_date))
+            if counters:
+                # Upsert: счетчик мог снова появиться из приема во время пересборки
+                stmt = dialect_insert(table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['hour', 'event_name', 'project_id', 'device_type', 'browser', 'country'],
+                    set_={'count': stmt.excluded['count'], 'updated_at': stmt.excluded.updated_at}
+                )
+                db.session.execute(stmt, counters)
+            
+            db.session.commit()
+            logger.info(f"Hourly counters rebuilt for {date}: {len(counters)} counters")
+            return len(counters)
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding hourly counters: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _collect_sketch_values(events):
+        """Группирует user_id событий по ключам скетчей (sketch_name, day, project_id)"""
+        values = {}
+        for event in events:
+            user_id = event.get('user_id')
+            if user_id is None:
+                continue
+            
+            day = datetime.combine(event['created_at'].date(), datetime.min.time())
+            values.setdefault(('active_users', day, 0), set()).add(user_id)
+            
+            if event['event_name'] == 'project_view' and event.get('project_id'):
+                values.setdefault(('project_viewers', day, event['project_id']), set()).add(user_id)
+        
+        return values
+    
+    @staticmethod
+    def _save_sketches(sketches, merge_existing=True):
+        """Сохраняет скетчи {(sketch_name, day, project_id): HyperLogLog}
+        
+        При merge_existing=True сохраненные скетчи читаются одним запросом и
+        сливаются с новыми, иначе перезаписываются.
+        """
+        if not sketches:
+            return
+        
+        db = get_db()
+        table = AnalyticsSketch.__table__
+        now = datetime.utcnow()
+        
+        if merge_existing:
+            stored_rows = db.session.execute(
+                select(table.c.sketch_name, table.c.date, table.c.project_id, table.c.precision, table.c.registers).where(
+                    tuple_(table.c.sketch_name, table.c.date, table.c.project_id).in_(list(sketches))
+                )
+            )
+            for row in stored_rows:
+                sketch = sketches.get((row.sketch_name, row.date, row.project_id))
+                if sketch is not None and sketch.precision == row.precision:
+                    sketch.merge(HyperLogLog.from_bytes(row.registers, row.precision))
+        
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['sketch_name', 'date', 'project_id'],
+            set_={
+                'precision': stmt.excluded.precision,
+                'registers': stmt.excluded.registers,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt, [
+            {
+                'sketch_name': sketch_name,
+                'date': day,
+                'project_id': project_id,
+                'precision': sketch.precision,
+                'registers': sketch.to_bytes(),
+                'updated_at': now
+            }
+            for (sketch_name, day, project_id), sketch in sketches.items()
+        ])
+    
+    @staticmethod
+    def _update_unique_sketches(events):
+        """Добавляет пользователей пакета событий в дневные HLL-скетчи"""
+        sketches = {
+            key: HyperLogLog(SKETCH_PRECISION[key[0]]).update(user_ids)
+            for key, user_ids in AnalyticsService._collect_sketch_values(events).items()
+        }
+        AnalyticsService._save_sketches(sketches)
+    
+    @staticmethod
+    def rebuild_unique_sketches(date, chunk_size=10000):
+        """Пересобирает дневные HLL-скетчи из сырых событий
+        
+        Приемка обновляет скетчи инкрементально (read-modify-write), и при
+        нескольких процессах часть обновлений может потеряться. Ночная
+        пересборка делает скетчи за закрытый день точными.
+        """
+        db = get_db()
+        
+        try:
+            start_date = datetime.combine(date, datetime.min.time())
+            end_date = start_date + timedelta(days=1)
             
-            unique_users = db.query(func.count(func.distinct(AnalyticsEvent.user_id))).filter(
+            day_filter = and_(
                 AnalyticsEvent.created_at >= start_date,
                 AnalyticsEvent.created_at < end_date,
                 AnalyticsEvent.user_id.isnot(None)
-            ).scalar()
+            )
             
-            page_views = db.query(func.count(AnalyticsEvent.id)).filter(
-                AnalyticsEvent.created_at >= start_date,
-                AnalyticsEvent.created_at < end_date,
-                AnalyticsEvent.event_name == 'page_view'
-            ).scalar()
+            sketches = {('active_users', start_date, 0): HyperLogLog(SKETCH_PRECISION['active_users'])}
             
-            project_views = db.query(func.count(AnalyticsEvent.id)).filter(
-                AnalyticsEvent.created_at >= start_date,
-                AnalyticsEvent.created_at < end_date,
-                AnalyticsEvent.event_name == 'project_view'
-            ).scalar()
+            active_users = db.session.execute(
+                select(AnalyticsEvent.user_id).where(day_filter).distinct().execution_options(yield_per=chunk_size)
+            )
+            for chunk in active_users.partitions():
+                sketches[('active_users', start_date, 0)].update(row.user_id for row in chunk)
+            
+            project_viewers = db.session.execute(
+                select(AnalyticsEvent.project_id, AnalyticsEvent.user_id).where(
+                    day_filter,
+                    AnalyticsEvent.event_name == 'project_view',
+                    AnalyticsEvent.project_id.isnot(None)
+                ).distinct().execution_options(yield_per=chunk_size)
+            )
+            for chunk in project_viewers.partitions():
+                for row in chunk:
+                    key = ('project_viewers', start_date, row.project_id)
+                    if key not in sketches:
+                        sketches[key] = HyperLogLog(SKETCH_PRECISION['project_viewers'])
+                    sketches[key].add(row.user_id)
+            
+            AnalyticsService._save_sketches(sketches, merge_existing=False)
+            
+            db.session.commit()
+            logger.info(f"Unique sketches rebuilt for {date}: {len(sketches)} sketches")
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding unique sketches: {str(e)}")
+            raise
+    
+    @staticmethod
+    def get_unique_counts(sketch_name, start_date, end_date=None, project_id=0):
+        """Приближенное число уникальных пользователей по дневным скетчам
+        
+        Возвращает (total, daily): total - уникальные за весь период
+        [start_date, end_date) после слияния дневных скетчей, daily -
+        словарь {день: уникальные за день}. Относительная ошибка не
+        превышает ~1.04 / sqrt(2^p) (см. SKETCH_PRECISION).
+        """
+        db = get_db()
+        table = AnalyticsSketch.__table__
+        
+        start_day = datetime.combine(start_date.date(), datetime.min.time())
+        query = select(table.c.date, table.c.precision, table.c.registers).where(
+            table.c.sketch_name == sketch_name,
+            table.c.project_id == project_id,
+            table.c.date >= start_day
+        )
+        if end_date is not None:
+            query = query.where(table.c.date < end_date)
+        
+        merged = HyperLogLog(SKETCH_PRECISION[sketch_name])
+        daily = {}
+        for row in db.session.execute(query.order_by(table.c.date)):
+            sketch = HyperLogLog.from_bytes(row.registers, row.precision)
+            daily[row.date.date()] = sketch.count()
+            merged.merge(sketch)
+        
+        return merged.count(), daily
+    
+    @staticmethod
+    def _collect_topk_values(events):
+        """Частоты значений по ключам top-K скетчей (sketch_name, day, project_id)
+        
+        Каждое событие учитывается в глобальном скетче (project_id = 0) и,
+        если относится к проекту, в скетче проекта.
+        """
+        values = {}
+        for event in events:
+            day = datetime.combine(event['created_at'].date(), datetime.min.time())
+            project_ids = (0, event['project_id']) if event.get('project_id') else (0,)
+            
+            for sketch_name, (field, _) in TOPK_SKETCHES.items():
+                item = event.get(field)
+                if not item:
+                    continue
+                for project_id in project_ids:
+                    counts = values.setdefault((sketch_name, day, project_id), {})
+                    counts[item] = counts.get(item, 0) + 1
+        
+        return values
+    
+    @staticmethod
+    def _save_topk_sketches(sketches, merge_existing=True):
+        """Сохраняет скетчи {(sketch_name, day, project_id): SpaceSaving}
+        
+        При merge_existing=True сохраненные скетчи читаются одним запросом и
+        сливаются с новыми, иначе перезаписываются.
+        """
+        if not sketches:
+            return
+        
+        db = get_db()
+        table = AnalyticsTopKSketch.__table__
+        now = datetime.utcnow()
+        
+        if merge_existing:
+            stored_rows = db.session.execute(
+                select(table.c.sketch_name, table.c.date, table.c.project_id, table.c.capacity, table.c.counters).where(
+                    tuple_(table.c.sketch_name, table.c.date, table.c.project_id).in_(list(sketches))
+                )
+            )
+            for row in stored_rows:
+                sketch = sketches.get((row.sketch_name, row.date, row.project_id))
+                if sketch is not None:
+                    sketch.merge(SpaceSaving.from_bytes(row.counters, row.capacity))
+        
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['sketch_name', 'date', 'project_id'],
+            set_={
+                'capacity': stmt.excluded.capacity,
+                'counters': stmt.excluded.counters,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt, [
+            {
+                'sketch_name': sketch_name,
+                'date': day,
+                'project_id': project_id,
+                'capacity': sketch.capacity,
+                'counters': sketch.to_bytes(),
+                'updated_at': now
+            }
+            for (sketch_name, day, project_id), sketch in sketches.items()
+        ])
+    
+    @staticmethod
+    def _update_topk_sketches(events):
+        """Добавляет значения пакета событий в дневные top-K скетчи"""
+        sketches = {
+            key: SpaceSaving(TOPK_SKETCHES[key[0]][1]).update(counts)
+            for key, counts in AnalyticsService._collect_topk_values(events).items()
+        }
+        AnalyticsService._save_topk_sketches(sketches)
+    
+    @staticmethod
+    def rebuild_topk_sketches(date, chunk_size=10000):
+        """Пересобирает дневные top-K скетчи из сырых событий
+        
+        Как и для HLL-скетчей, ночная пересборка исправляет обновления,
+        потерянные при одновременной записи из нескольких процессов.
+        """
+        db = get_db()
+        
+        try:
+            start_date = datetime.combine(date, datetime.min.time())
+            end_date = start_date + timedelta(days=1)
+            
+            sketches = {}
+            for sketch_name, (field, capacity) in TOPK_SKETCHES.items():
+                column = getattr(AnalyticsEvent, field)
+                rows = db.session.execute(
+                    select(AnalyticsEvent.project_id, column.label('item'), func.count(AnalyticsEvent.id).label('count')).where(
+                        AnalyticsEvent.created_at >= start_date,
+                        AnalyticsEvent.created_at < end_date,
+                        column.isnot(None),
+                        column != ''
+                    ).group_by(AnalyticsEvent.project_id, column).execution_options(yield_per=chunk_size)
+                )
+                
+                counts = {}
+                for chunk in rows.partitions():
+                    for row in chunk:
+                        project_ids = (0, row.project_id) if row.project_id else (0,)
+                        for project_id in project_ids:
+                            item_counts = counts.setdefault(project_id, {})
+                            item_counts[row.item] = item_counts.get(row.item, 0) + row.count
+                
+                for project_id, item_counts in counts.items():
+                    sketches[(sketch_name, start_date, project_id)] = SpaceSaving(capacity).update(item_counts)
+            
+            AnalyticsService._save_topk_sketches(sketches, merge_existing=False)
+            
+            db.session.commit()
+            logger.info(f"Top-K sketches rebuilt for {date}: {len(sketches)} sketches")
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding top-K sketches: {str(e)}")
+            raise
+    
+    @staticmethod
+    def get_top_items(sketch_name, start_date, end_date=None, project_id=0, limit=10):
+        """Самые частые значения за период по слиянию дневных top-K скетчей
+        
+        Возвращает список (значение, оценка частоты) по убыванию. Оценки
+        могут быть завышены, но значения с долей больше 1/capacity
+        гарантированно попадают в результат.
+        """
+        db = get_db()
+        table = AnalyticsTopKSketch.__table__
+        
+        start_day = datetime.combine(start_date.date(), datetime.min.time())
+        query = select(table.c.capacity, table.c.counters).where(
+            table.c.sketch_name == sketch_name,
+            table.c.project_id == project_id,
+            table.c.date >= start_day
+        )
+        if end_date is not None:
+            query = query.where(table.c.date < end_date)
+        
+        merged = SpaceSaving(TOPK_SKETCHES[sketch_name][1])
+        for row in db.session.execute(query):
+            merged.merge(SpaceSaving.from_bytes(row.counters, row.capacity))
+        
+        return merged.top(limit)
+    
+    @staticmethod
+    def _bulk_upsert_metrics(metrics, metric_type, start_date, end_date):
+        """Пакетный upsert строк AnalyticsMetric за один период
+        
+        metrics - список словарей {metric_name, value, user_id?, project_id?,
+        extra_data?} одного уровня (глобальные, по проектам или по
+        пользователям). Существующие строки находятся одним SELECT и
+        обновляются одним executemany по первичному ключу, новые вставляются
+        одним INSERT. Коммит выполняет вызывающий код.
+        """
+        if not metrics:
+            return 0
+        
+        db = get_db()
+        table = AnalyticsMetric.__table__
+        now = datetime.utcnow()
+        
+        metric_names = {metric['metric_name'] for metric in metrics}
+        user_ids = {metric.get('user_id') for metric in metrics} - {None}
+        project_ids = {metric.get('project_id') for metric in metrics} - {None}
+        with_extra_data = any('extra_data' in metric for metric in metrics)
+        
+        query = select(table.c.id, table.c.metric_name, table.c.user_id, table.c.project_id).where(
+            table.c.metric_type == metric_type,
+            table.c.date == start_date,
+            table.c.metric_name.in_(metric_names)
+        )
+        if user_ids:
+            query = query.where(table.c.user_id.in_(user_ids))
+        elif project_ids:
+            query = query.where(table.c.project_id.in_(project_ids), table.c.user_id.is_(None))
+        else:
+            query = query.where(table.c.user_id.is_(None), table.c.project_id.is_(None))
+        
+        existing = {
+            (row.metric_name, row.user_id, row.project_id): row.id
+            for row in db.session.execute(query)
+        }
+        
+        updates = []
+        inserts = []
+        for metric in metrics:
+            key = (metric['metric_name'], metric.get('user_id'), metric.get('project_id'))
+            if key in existing:
+                update_params = {
+                    'b_id': existing[key],
+                    'b_value': metric['value'],
+                    'b_updated_at': now
+                }
+                if with_extra_data:
+                    update_params['b_extra_data'] = metric.get('extra_data')
+                updates.append(update_params)
+            else:
+                inserts.append({
+                    'metric_name': metric['metric_name'],
+                    'metric_type': metric_type,
+                    'user_id': metric.get('user_id'),
+                    'project_id': metric.get('project_id'),
+                    'value': metric['value'],
+                    'date': start_date,
+                    'period_start': start_date,
+                    'period_end': end_date,
+                    'extra_data': metric.get('extra_data'),
+                    'created_at': now,
+                    'updated_at': now
+                })
+        
+        if updates:
+            values = {
+                'value': bindparam('b_value'),
+                'updated_at': bindparam('b_updated_at')
+            }
+            if with_extra_data:
+                values['extra_data'] = bindparam('b_extra_data')
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(**values),
+                updates
+            )
+        
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        
+        return len(metrics)
+    
+    @staticmethod
+    def calculate_daily_metrics(date=None):
+        """Расчет ежедневных метрик
+        
+        Метрики по событиям считаются за один проход по analytics_events
+        (условная агрегация), новые пользователи и проекты и накопленные
+        итоги пользователей, проектов и референсов на конец дня - скалярными
+        подзапросами в том же SELECT. Всего событий и разбивка по
+        устройствам берутся из почасовых счетчиков дня - того же источника,
+        что и живой срез дашборда (счетчики пересобираются перед расчетом).
+        """
+        if date is None:
+            date = datetime.utcnow().date()
+        
+        db = get_db()
+        
+        try:
+            # Период для расчета (один день)
+            start_date = datetime.combine(date, datetime.min.time())
+            end_date = start_date + timedelta(days=1)
             
-            # Новые пользователи
-            new_users = db.query(func.count(User.id)).filter(
+            new_users_query = select(func.count(User.id)).where(
                 User.created_at >= start_date,
                 User.created_at < end_date
-            ).scalar()
+            ).scalar_subquery()
             
-            # Новые проекты
-            new_projects = db.query(func.count(Project.id)).filter(
+            new_projects_query = select(func.count(Project.id)).where(
                 Project.created_at >= start_date,
                 Project.created_at < end_date
-            ).scalar()
+            ).scalar_subquery()
             
-            # Сохранение метрик
-            metrics_to_save = [
-                ('total_events', total_events),
-                ('unique_users', unique_users),
-                ('page_views', page_views),
-                ('project_views', project_views),
-                ('new_users', new_users),
-                ('new_projects', new_projects)
+            # Итоги на конец дня: дашборд добавляет к ним только созданное после
+            total_queries = [
+                select(func.count(model.id)).where(model.created_at < end_date).scalar_subquery().label(metric_name)
+                for metric_name, model in (
+                    ('total_users', User), ('total_projects', Project), ('total_references', Reference)
+                )
             ]
             
-            for metric_name, value in metrics_to_save:
-                # Проверяем, существует ли уже метрика за этот день
-                existing_metric = db.query(AnalyticsMetric).filter(
-                    AnalyticsMetric.metric_name == metric_name,
-                    AnalyticsMetric.metric_type == 'daily',
-                    AnalyticsMetric.date == start_date
-                ).first()
-                
-                if existing_metric:
-                    existing_metric.value = value
-                    existing_metric.updated_at = datetime.utcnow()
-                else:
-                    metric = AnalyticsMetric(
-                        metric_name=metric_name,
-                        metric_type='daily',
-                        value=value,
-                        date=start_date,
-                        period_start=start_date,
-                        period_end=end_date
-                    )
-                    db.add(metric)
+            totals = db.session.execute(
+                select(
+                    func.count(func.distinct(AnalyticsEvent.user_id)).label('unique_users'),
+                    func.coalesce(func.sum(
+                        case((AnalyticsEvent.event_name == 'page_view', 1), else_=0)
+                    ), 0).label('page_views'),
+                    func.coalesce(func.sum(
+                        case((AnalyticsEvent.event_name == 'project_view', 1), else_=0)
+                    ), 0).label('project_views'),
+                    new_users_query.label('new_users'),
+                    new_projects_query.label('new_projects'),
+                    *total_queries
+                ).where(
+                    AnalyticsEvent.created_at >= start_date,
+                    AnalyticsEvent.created_at < end_date
+                )
+            ).one()
             
-            db.commit()
+            # Всего событий и разбивка по устройствам - из почасовых счетчиков за день
+            # (популярные события и браузеры берутся из top-K скетчей)
+            counters_table = AnalyticsHourlyCounter.__table__
+            devices = {
+                device_type: int(count) for device_type, count in db.session.execute(
+                    select(counters_table.c.device_type, func.sum(counters_table.c.count)).where(
+                        counters_table.c.hour >= start_date,
+                        counters_table.c.hour < end_date
+                    ).group_by(counters_table.c.device_type)
+                )
+            }
+            total_events = sum(devices.values())
+            
+            # Сохранение метрик
+            metrics_to_save = [{'metric_name': 'total_events', 'value': total_events}]
+            metrics_to_save.extend(
+                {'metric_name': metric_name, 'value': getattr(totals, metric_name) or 0}
+                for metric_name in (
+                    'unique_users', 'page_views', 'project_views', 'new_users', 'new_projects',
+                    'total_users', 'total_projects', 'total_references'
+                )
+            )
+            metrics_to_save.append(
+                {'metric_name': 'events_by_device', 'value': total_events, 'extra_data': devices}
+            )
+            
+            AnalyticsService._bulk_upsert_metrics(metrics_to_save, 'daily', start_date, end_date)
+            
+            db.session.commit()
             logger.info(f"Daily metrics calculated for {date}")
+            return total_events
             
         except Exception as e:
-            db.rollback()
+            db.session.rollback()
             logger.error(f"Error calculating daily metrics: {str(e)}")
             raise
     
+    @staticmethod
+    def get_dashboard_summary(days=30):
+        """Данные дашборда аналитики за days последних дней
+        
+        Завершенные дни читаются из дневных агрегатов analytics_metrics, а
+        дни без агрегатов - обычно только сегодняшний - из почасовых
+        счетчиков и таблиц пользователей и проектов. Граница живого среза
+        своя у каждого источника: дни с метриками calculate_daily_metrics и
+        дни, успешно обработанные задачей метрик проектов. Итоги
+        пользователей, проектов и референсов - снимок на конец последнего
+        агрегированного дня плюс созданные позже. Популярные события и
+        браузеры берутся из top-K скетчей. Период выравнивается по началу дня.
+        """
+        db = get_db()
+        metrics_table = AnalyticsMetric.__table__
+        counters_table = AnalyticsHourlyCounter.__table__
+        
+        now = datetime.utcnow()
+        today = datetime.combine(now.date(), datetime.min.time())
+        start_day = today - timedelta(days=days)
+        
+        daily_rows = db.session.execute(
+            select(metrics_table.c.date, metrics_table.c.metric_name, metrics_table.c.value, metrics_table.c.extra_data).where(
+                metrics_table.c.metric_type == 'daily',
+                metrics_table.c.date >= start_day,
+                metrics_table.c.date < today,
+                metrics_table.c.user_id.is_(None),
+                metrics_table.c.project_id.is_(None),
+                metrics_table.c.metric_name.in_((
+                    'total_events', 'new_users', 'new_projects', 'events_by_device',
+                    'total_users', 'total_projects', 'total_references'
+                ))
+            )
+        ).all()
+        
+        def first_missing_day(rollup_days):
+            """Агрегаты используются до первого дня, за который их нет"""
+            day = start_day
+            while day < today and day in rollup_days:
+                day += timedelta(days=1)
+            return day
+        
+        live_from = first_missing_day({row.date for row in daily_rows if row.metric_name == 'total_events'})
+        # Метрики проектов считает отдельная задача - ее дни отмечены в job_runs
+        projects_live_from = first_missing_day({
+            datetime.combine(date_type.fromisoformat(checkpoint), datetime.min.time())
+            for checkpoint in job_lock_service.get_completed_checkpoints(
+                PROJECT_METRICS_JOB_NAME, since=start_day.date().isoformat()
+            )
+        })
+        
+        daily_events = {}
+        new_users = 0
+        new_projects = 0
+        devices = {}
+        overview_totals = {}
+        
+        def add_device(device_type, count):
+            devices[device_type or ''] = devices.get(device_type or '', 0) + count
+        
+        for row in daily_rows:
+            if row.date >= live_from:
+                continue
+            if row.metric_name == 'total_events':
+                daily_events[row.date.date()] = int(row.value)
+            elif row.metric_name == 'new_users':
+                new_users += int(row.value)
+            elif row.metric_name == 'new_projects':
+                new_projects += int(row.value)
+            elif row.metric_name == 'events_by_device':
+                for device_type, count in (row.extra_data or {}).items():
+                    add_device(device_type, count)
+            elif row.date == live_from - timedelta(days=1):
+                overview_totals[row.metric_name] = int(row.value)
+        
+        # Живой срез по дням без агрегатов: события и устройства из одного источника
+        for row in db.session.execute(
+            select(
+                counters_table.c.hour,
+                counters_table.c.device_type,
+                func.sum(counters_table.c.count).label('count')
+            ).where(
+                counters_table.c.hour >= live_from
+            ).group_by(counters_table.c.hour, counters_table.c.device_type)
+        ):
+            day = row.hour.date()
+            daily_events[day] = daily_events.get(day, 0) + row.count
+            add_device(row.device_type, row.count)
+        
+        # Созданные после последнего агрегированного дня - одним запросом
+        created = db.session.execute(select(*(
+            select(func.count(model.id)).where(model.created_at >= live_from).scalar_subquery().label(name)
+            for name, model in (('users', User), ('projects', Project), ('references', Reference))
+        ))).one()
+        new_users += created.users
+        new_projects += created.projects
+        
+        overview = {}
+        for metric_name, model, created_count in (
+            ('total_users', User, created.users),
+            ('total_projects', Project, created.projects),
+            ('total_references', Reference, created.references)
+        ):
+            if metric_name in overview_totals:
+                overview[metric_name] = overview_totals[metric_name] + created_count
+            else:
+                # Снимка еще нет (агрегаты не считались) - полный подсчет
+                overview[metric_name] = db.session.execute(select(func.count(model.id))).scalar()
+        
+        # Просмотры проектов: дневные агрегаты по проектам + живой срез
+        project_views = {}
+        for project_id, views in db.session.execute(
+            select(metrics_table.c.project_id, func.sum(metrics_table.c.value)).where(
+                metrics_table.c.metric_type == 'daily',
+                metrics_table.c.metric_name == 'project_views',
+                metrics_table.c.project_id.isnot(None),
+                metrics_table.c.date >= start_day,
+                metrics_table.c.date < projects_live_from
+            ).group_by(metrics_table.c.project_id)
+        ):
+            project_views[project_id] = int(views)
+        for project_id, views in db.session.execute(
+            select(counters_table.c.project_id, func.sum(counters_table.c.count)).where(
+                counters_table.c.event_name == 'project_view',
+                counters_table.c.project_id != 0,
+                counters_table.c.hour >= projects_live_from
+            ).group_by(counters_table.c.project_id)
+        ):
+            project_views[project_id] = project_views.get(project_id, 0) + int(views)
+        
+        top_project_ids = sorted(project_views, key=project_views.get, reverse=True)[:10]
+        project_titles = dict(db.session.execute(
+            select(Project.id, Project.title).where(Project.id.in_(top_project_ids))
+        ).all()) if top_project_ids else {}
+        
+        active_users, daily_users = AnalyticsService.get_unique_counts('active_users', start_day)
+        
+        return {
+            'overview': dict(
+                overview,
+                active_users=active_users,
+                new_users=new_users,
+                new_projects=new_projects
+            ),
+            'popular_events': [
+                {'name': name, 'count': count}
+                for name, count in AnalyticsService.get_top_items('events', start_day, limit=10)
+            ],
+            'daily_activity': [
+                {
+                    'date': str(day),
+                    'events': events,
+                    'users': daily_users.get(day, 0)
+                } for day, events in sorted(daily_events.items())
+            ],
+            'top_projects': [
+                {
+                    'id': project_id,
+                    'name': project_titles[project_id],
+                    'views': project_views[project_id]
+                } for project_id in top_project_ids if project_id in project_titles
+            ],
+            'devices': [
+                {'type': device_type or None, 'count': count}
+                for device_type, count in sorted(devices.items(), key=lambda item: item[1], reverse=True)
+            ],
+            'browsers': [
+                {'name': browser, 'count': count}
+                for browser, count in AnalyticsService.get_top_items('browsers', start_day, limit=5)
+            ]
+        }
+    
     @staticmethod
     def calculate_project_metrics(project_id, date=None):
         """Расчет метрик для конкретного проекта"""
@@ -184,6 +1029,65 @@ class AnalyticsService:
             logger.error(f"Error calculating project metrics: {str(e)}")
             raise
     
+    @staticmethod
+    def calculate_all_project_metrics(date=None, chunk_size=500):
+        """Расчет метрик всех активных за день проектов одним запросом
+        
+        Просмотры, уникальные зрители и средняя длительность сессии
+        считаются одним GROUP BY project_id по analytics_events с LEFT JOIN
+        на user_sessions. Метрики записываются пакетным upsert частями по
+        chunk_size проектов в одной транзакции. Возвращает число проектов.
+        """
+        if date is None:
+            date = datetime.utcnow().date()
+        
+        db = get_db()
+        
+        try:
+            # Период для расчета (один день)
+            start_date = datetime.combine(date, datetime.min.time())
+            end_date = start_date + timedelta(days=1)
+            
+            is_project_view = AnalyticsEvent.event_name == 'project_view'
+            
+            project_rows = db.session.execute(
+                select(
+                    AnalyticsEvent.project_id,
+                    func.coalesce(func.sum(case((is_project_view, 1), else_=0)), 0).label('project_views'),
+                    func.count(func.distinct(
+                        case((is_project_view, AnalyticsEvent.user_id), else_=None)
+                    )).label('unique_viewers'),
+                    func.coalesce(func.avg(UserSession.duration), 0).label('avg_session_duration')
+                ).select_from(AnalyticsEvent).join(
+                    Project, Project.id == AnalyticsEvent.project_id
+                ).outerjoin(
+                    UserSession, UserSession.session_id == AnalyticsEvent.session_id
+                ).where(
+                    AnalyticsEvent.created_at >= start_date,
+                    AnalyticsEvent.created_at < end_date
+                ).group_by(AnalyticsEvent.project_id)
+            ).all()
+            
+            for offset in range(0, len(project_rows), chunk_size):
+                metrics_to_save = []
+                for row in project_rows[offset:offset + chunk_size]:
+                    for metric_name in ('project_views', 'unique_viewers', 'avg_session_duration'):
+                        metrics_to_save.append({
+                            'metric_name': metric_name,
+                            'project_id': row.project_id,
+                            'value': getattr(row, metric_name)
+                        })
+                AnalyticsService._bulk_upsert_metrics(metrics_to_save, 'daily', start_date, end_date)
+            
+            db.session.commit()
+            logger.info(f"Project metrics calculated for {len(project_rows)} projects on {date}")
+            return len(project_rows)
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error calculating project metrics: {str(e)}")
+            raise
+    
     @staticmethod
     def calculate_user_metrics(user_id, date=None):
         """Расчет метрик для конкретного пользователя"""
@@ -256,6 +1160,69 @@ class AnalyticsService:
             logger.error(f"Error calculating user metrics: {str(e)}")
             raise
     
+    @staticmethod
+    def calculate_all_user_metrics(date=None, chunk_size=1000):
+        """Расчет метрик всех активных за день пользователей одним проходом
+        
+        user_events, user_sessions и user_projects_viewed считаются одним
+        GROUP BY user_id. Результат читается потоково (yield_per) и
+        записывается пакетным upsert частями по chunk_size пользователей,
+        поэтому потребление памяти не зависит от числа пользователей.
+        Возвращает число пользователей.
+        """
+        if date is None:
+            date = datetime.utcnow().date()
+        
+        db = get_db()
+        
+        try:
+            # Период для расчета (один день)
+            start_date = datetime.combine(date, datetime.min.time())
+            end_date = start_date + timedelta(days=1)
+            
+            viewed_project = case(
+                (and_(
+                    AnalyticsEvent.event_name == 'project_view',
+                    AnalyticsEvent.project_id.isnot(None)
+                ), AnalyticsEvent.project_id),
+                else_=None
+            )
+            
+            user_rows = db.session.execute(
+                select(
+                    AnalyticsEvent.user_id,
+                    func.count(AnalyticsEvent.id).label('user_events'),
+                    func.count(func.distinct(AnalyticsEvent.session_id)).label('user_sessions'),
+                    func.count(func.distinct(viewed_project)).label('user_projects_viewed')
+                ).where(
+                    AnalyticsEvent.user_id.isnot(None),
+                    AnalyticsEvent.created_at >= start_date,
+                    AnalyticsEvent.created_at < end_date
+                ).group_by(AnalyticsEvent.user_id).execution_options(yield_per=chunk_size)
+            )
+            
+            users_count = 0
+            for chunk in user_rows.partitions():
+                metrics_to_save = []
+                for row in chunk:
+                    for metric_name in ('user_events', 'user_sessions', 'user_projects_viewed'):
+                        metrics_to_save.append({
+                            'metric_name': metric_name,
+                            'user_id': row.user_id,
+                            'value': getattr(row, metric_name)
+                        })
+                AnalyticsService._bulk_upsert_metrics(metrics_to_save, 'daily', start_date, end_date)
+                users_count += len(chunk)
+            
+            db.session.commit()
+            logger.info(f"User metrics calculated for {users_count} users on {date}")
+            return users_count
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error calculating user metrics: {str(e)}")
+            raise
+    
     @staticmethod
     def update_session_duration(session_id):
         """Обновление длительности сессии"""
@@ -282,37 +1249,145 @@ class AnalyticsService:
             logger.error(f"Error updating session duration: {str(e)}")
             raise
     
+    @staticmethod
+    def finalize_stale_sessions(cutoff_time, chunk_size=1000):
+        """Пакетное закрытие неактивных сессий
+        
+        Сессии без end_time, не обновлявшиеся с cutoff_time, обрабатываются
+        частями по chunk_size: для каждой части один GROUP BY session_id
+        находит время последнего события, а end_time/duration обновляются
+        одним executemany. Коммит после каждой части не держит блокировку
+        записи SQLite на все время задачи. Возвращает число закрытых сессий.
+        """
+        db = get_db()
+        sessions_table = UserSession.__table__
+        events_table = AnalyticsEvent.__table__
+        
+        finalized = 0
+        last_id = 0
+        
+        while True:
+            try:
+                stale_sessions = db.session.execute(
+                    select(sessions_table.c.id, sessions_table.c.session_id, sessions_table.c.start_time).where(
+                        sessions_table.c.end_time.is_(None),
+                        sessions_table.c.updated_at < cutoff_time,
+                        sessions_table.c.id > last_id
+                    ).order_by(sessions_table.c.id).limit(chunk_size)
+                ).all()
+                
+                if not stale_sessions:
+                    break
+                
+                last_id = stale_sessions[-1].id
+                
+                last_events = dict(db.session.execute(
+                    select(events_table.c.session_id, func.max(events_table.c.created_at)).where(
+                        events_table.c.session_id.in_([session.session_id for session in stale_sessions])
+                    ).group_by(events_table.c.session_id)
+                ).all())
+                
+                now = datetime.utcnow()
+                updates = []
+                for session in stale_sessions:
+                    end_time = last_events.get(session.session_id)
+                    if end_time is None:
+                        continue
+                    start_time = session.start_time or end_time
+                    updates.append({
+                        'b_id': session.id,
+                        'b_end_time': end_time,
+                        'b_duration': int((end_time - start_time).total_seconds()),
+                        'b_updated_at': now
+                    })
+                
+                if updates:
+                    db.session.execute(
+                        sessions_table.update().where(
+                            sessions_table.c.id == bindparam('b_id')
+                        ).values(
+                            end_time=bindparam('b_end_time'),
+                            duration=bindparam('b_duration'),
+                            updated_at=bindparam('b_updated_at')
+                        ),
+                        updates
+                    )
+                
+                db.session.commit()
+                finalized += len(updates)
+                
+                if len(stale_sessions) < chunk_size:
+                    break
+                
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error finalizing stale sessions: {str(e)}")
+                raise
+        
+        logger.info(f"Finalized {finalized} stale sessions")
+        return finalized
+    
     @staticmethod
     def get_trending_projects(days=7, limit=10):
-        """Получение трендовых проектов"""
+        """Получение трендовых проектов
+        
+        Порядок берется из готового топа trending_service (затухающий счет
+        просмотров); из него остаются проекты, у которых есть просмотры за
+        days дней (по почасовым счетчикам). Уникальные зрители - из дневных
+        HLL-скетчей за те же days дней.
+        """
         db = get_db()
         
         try:
+            top = trending_service.get_top(trending_service.top_size)
+            if not top:
+                return []
+            
             start_date = datetime.utcnow() - timedelta(days=days)
+            counters_table = AnalyticsHourlyCounter.__table__
+            views = dict(db.session.execute(
+                select(counters_table.c.project_id, func.sum(counters_table.c.count)).where(
+                    counters_table.c.event_name == 'project_view',
+                    counters_table.c.project_id.in_([project_id for project_id, _ in top]),
+                    counters_table.c.hour >= start_date.replace(minute=0, second=0, microsecond=0)
+                ).group_by(counters_table.c.project_id)
+            ).all())
             
-            trending = db.query(
-                Project.id,
-                Project.name,
-                Project.description,
-                func.count(AnalyticsEvent.id).label('views'),
-                func.count(func.distinct(AnalyticsEvent.user_id)).label('unique_viewers')
-            ).join(
-                AnalyticsEvent, Project.id == AnalyticsEvent.project_id
-            ).filter(
-                AnalyticsEvent.event_name == 'project_view',
-                AnalyticsEvent.created_at >= start_date
-            ).group_by(
-                Project.id, Project.name, Project.description
-            ).order_by(desc('views')).limit(limit).all()
+            top = [(project_id, score) for project_id, score in top if views.get(project_id)][:limit]
+            if not top:
+                return []
+            
+            project_ids = [project_id for project_id, _ in top]
+            projects = {
+                row.id: row for row in db.session.execute(
+                    select(Project.id, Project.title, Project.description).where(Project.id.in_(project_ids))
+                )
+            }
+            
+            sketches_table = AnalyticsSketch.__table__
+            viewers = {}
+            for row in db.session.execute(
+                select(sketches_table.c.project_id, sketches_table.c.precision, sketches_table.c.registers).where(
+                    sketches_table.c.sketch_name == 'project_viewers',
+                    sketches_table.c.project_id.in_(project_ids),
+                    sketches_table.c.date >= datetime.combine(start_date.date(), datetime.min.time())
+                )
+            ):
+                sketch = HyperLogLog.from_bytes(row.registers, row.precision)
+                if row.project_id in viewers:
+                    viewers[row.project_id].merge(sketch)
+                else:
+                    viewers[row.project_id] = sketch
             
             return [
                 {
-                    'id': p.id,
-                    'name': p.name,
-                    'description': p.description,
-                    'views': p.views,
-                    'unique_viewers': p.unique_viewers
-                } for p in trending
+                    'id': project_id,
+                    'name': projects[project_id].title,
+                    'description': projects[project_id].description,
+                    'views': int(views.get(project_id) or 0),
+                    'unique_viewers': viewers[project_id].count() if project_id in viewers else 0,
+                    'score': round(score, 4)
+                } for project_id, score in top if project_id in projects
             ]
             
         except Exception as e:
@@ -320,39 +1395,102 @@ class AnalyticsService:
             return []
     
     @staticmethod
-    def get_user_engagement_score(user_id, days=30):
-        """Расчет показателя вовлеченности пользователя"""
+    def calculate_engagement_scores(user_ids=None, days=30, persist=True, chunk_size=5000):
+        """Пакетный расчет показателя вовлеченности (0-100)
+        
+        user_ids=None - все пользователи, у которых за days дней есть события
+        или новые проекты; иначе только перечисленные (без активности
+        получают 0). Счетчики берутся двумя GROUP BY user_id (события и
+        сессии, созданные проекты), показатель считается над массивами NumPy.
+        При persist=True результат записывается в analytics_metrics
+        (metric_type='engagement', metric_name='engagement_score', date -
+        текущий день) частями по chunk_size пользователей.
+        Возвращает (user_ids, scores) - массивы NumPy одинаковой длины.
+        """
         db = get_db()
         
         try:
-            start_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Различные типы активности
-            events_count = db.query(func.count(AnalyticsEvent.id)).filter(
-                AnalyticsEvent.user_id == user_id,
-                AnalyticsEvent.created_at >= start_date
-            ).scalar()
+            now = datetime.utcnow()
+            start_date = now - timedelta(days=days)
             
-            sessions_count = db.query(func.count(func.distinct(AnalyticsEvent.session_id))).filter(
-                AnalyticsEvent.user_id == user_id,
+            events_query = select(
+                AnalyticsEvent.user_id,
+                func.count(AnalyticsEvent.id),
+                func.count(func.distinct(AnalyticsEvent.session_id))
+            ).where(
+                AnalyticsEvent.user_id.isnot(None),
                 AnalyticsEvent.created_at >= start_date
-            ).scalar()
+            ).group_by(AnalyticsEvent.user_id)
             
-            projects_created = db.query(func.count(Project.id)).filter(
-                Project.user_id == user_id,
+            projects_query = select(Project.user_id, func.count(Project.id)).where(
+                Project.user_id.isnot(None),
                 Project.created_at >= start_date
-            ).scalar()
+            ).group_by(Project.user_id)
+            
+            if user_ids is None:
+                event_rows = db.session.execute(events_query).all()
+                project_rows = db.session.execute(projects_query).all()
+            else:
+                requested = sorted(set(user_ids))
+                event_rows = []
+                project_rows = []
+                for offset in range(0, len(requested), chunk_size):
+                    chunk = requested[offset:offset + chunk_size]
+                    event_rows.extend(db.session.execute(events_query.where(AnalyticsEvent.user_id.in_(chunk))))
+                    project_rows.extend(db.session.execute(projects_query.where(Project.user_id.in_(chunk))))
             
-            # Расчет показателя вовлеченности (0-100)
-            engagement_score = min(100, (
+            event_data = np.array(event_rows, dtype=np.int64).reshape(-1, 3)
+            project_data = np.array(project_rows, dtype=np.int64).reshape(-1, 2)
+            
+            if user_ids is None:
+                ids = np.union1d(event_data[:, 0], project_data[:, 0])
+            else:
+                ids = np.array(requested, dtype=np.int64)
+            
+            # Раскладываем сгруппированные счетчики по позициям в отсортированном ids
+            events_count = np.zeros(len(ids))
+            sessions_count = np.zeros(len(ids))
+            projects_created = np.zeros(len(ids))
+            
+            positions = np.searchsorted(ids, event_data[:, 0])
+            events_count[positions] = event_data[:, 1]
+            sessions_count[positions] = event_data[:, 2]
+            projects_created[np.searchsorted(ids, project_data[:, 0])] = project_data[:, 1]
+            
+            scores = np.round(np.minimum(100, (
                 events_count * 0.1 +
                 sessions_count * 2 +
                 projects_created * 10
-            ))
+            )), 2)
+            
+            if persist and len(ids):
+                day_start = datetime.combine(now.date(), datetime.min.time())
+                day_end = day_start + timedelta(days=1)
+                for offset in range(0, len(ids), chunk_size):
+                    AnalyticsService._bulk_upsert_metrics([
+                        {'metric_name': 'engagement_score', 'user_id': user_id, 'value': score}
+                        for user_id, score in zip(
+                            ids[offset:offset + chunk_size].tolist(),
+                            scores[offset:offset + chunk_size].tolist()
+                        )
+                    ], 'engagement', day_start, day_end)
+                db.session.commit()
+                logger.info(f"Engagement scores calculated for {len(ids)} users")
             
-            return round(engagement_score, 2)
+            return ids, scores
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error calculating engagement scores: {str(e)}")
+            raise
+    
+    @staticmethod
+    def get_user_engagement_score(user_id, days=30):
+        """Расчет показателя вовлеченности пользователя"""
+        try:
+            _, scores = AnalyticsService.calculate_engagement_scores([user_id], days=days, persist=False)
+            return float(scores[0])
             
         except Exception as e:
             logger.error(f"Error calculating engagement score: {str(e)}")
             return 0
-
@@ -0,0 +1,42 @@
+import math
+
+class BloomFilter:
+    """Фильтр Блума для проверки принадлежности к множеству хешей
+
+    Ответ «нет» точный, ответ «возможно» ошибочен с вероятностью не выше
+    error_rate, пока в фильтре не больше capacity элементов. Элементы -
+    шестнадцатеричные дайджесты (например, md5 click_hash), которые уже
+    равномерно распределены, поэтому k позиций получаются двойным
+    хешированием из двух половин дайджеста без повторного хеширования.
+    """
+
+    def __init__(self, capacity=1024, error_rate=0.01):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("Invalid Bloom filter parameters")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        half = len(digest) // 2
+        h1 = int(digest[:half], 16)
+        h2 = int(digest[half:], 16) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, digest):
+        """Добавляет дайджест в фильтр"""
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    @property
+    def is_full(self):
+        """Превышена расчетная емкость (вероятность ошибки растет)"""
+        return self.count > self.capacity
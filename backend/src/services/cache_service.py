@@ -0,0 +1,180 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import threading
+import time
+
+class TTLCache:
+    """Кеш в памяти процесса с ограниченным временем жизни записей
+
+    get_or_set() реализует чтение через кеш с защитой от одновременной
+    загрузки (single-flight): если запись отсутствует или устарела, значение
+    вычисляет только один поток, а остальные запросы с тем же ключом ждут
+    его результата вместо повторных запросов к базе. Исключение загрузчика
+    передается всем ожидающим и не кешируется.
+
+    Любой сброс (invalidate, invalidate_where, clear) увеличивает поколение
+    кеша: загрузка, начатая до сброса, отдает значение своим ожидающим, но
+    в кеш его не кладет - оно могло быть прочитано до изменения данных.
+    """
+
+    def __init__(self, ttl=60, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> (expires_at, value)
+        self._loading = {}   # key -> _PendingLoad
+        self._generation = 0
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0
+        }
+
+    def get(self, key, default=None):
+        """Значение из кеша или default, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+        return default
+
+    def set(self, key, value, ttl=None):
+        """Сохраняет значение на ttl секунд (по умолчанию self.ttl)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_size:
+                self._evict()
+            self._entries[key] = (expires_at, value)
+
+    def get_or_set(self, key, loader, ttl=None):
+        """Возвращает значение из кеша, при промахе вычисляет loader() один раз"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.stats['hits'] += 1
+                return entry[1]
+
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = self._loading[key] = _PendingLoad()
+                is_loader = True
+                generation = self._generation
+                self.stats['misses'] += 1
+            else:
+                is_loader = False
+                self.stats['waits'] += 1
+
+        if not is_loader:
+            return pending.wait()
+
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self._finish_load(key, pending)
+            pending.fail(e)
+            raise
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            # После сброса значение могло устареть - не кешируем
+            if generation == self._generation:
+                if key not in self._entries and len(self._entries) >= self.max_size:
+                    self._evict()
+                self._entries[key] = (expires_at, value)
+            self._finish_load(key, pending)
+        pending.resolve(value)
+        return value
+
+    def invalidate(self, key):
+        """Удаляет запись по ключу"""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+            # Новые запросы не ждут загрузку, начатую до сброса
+            self._loading.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Удаляет все записи, для которых predicate(key, value) истинно"""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key, (_, value) in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+            self._loading.clear()
+
+    def clear(self):
+        """Очищает кеш"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._loading.clear()
+
+    def get_stats(self):
+        """Статистика кеша для мониторинга"""
+        with self._lock:
+            return dict(self.stats, size=len(self._entries), max_size=self.max_size)
+
+    def _finish_load(self, key, pending):
+        # Вызывается под self._lock: после сброса ключ может занимать уже новая загрузка
+        if self._loading.get(key) is pending:
+            del self._loading[key]
+
+    def _evict(self):
+        # Вызывается под self._lock: сначала устаревшие записи, затем самая ранняя по сроку
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        if not expired and self._entries:
+            del self._entries[min(self._entries, key=lambda key: self._entries[key][0])]
+
+def invalidate_after_commit(session, callback):
+    """Выполняет callback() после коммита транзакции session
+
+    Сброс кеша в событиях маппера происходит при flush, до коммита:
+    параллельный запрос успел бы прочитать еще старую строку и снова
+    положить ее в кеш. Отложенные сбросы выполняются после коммита
+    внешней транзакции и отбрасываются при ее откате.
+    """
+    if session is None:
+        callback()
+        return
+    session.info.setdefault('invalidate_after_commit', []).append(callback)
+
+@event.listens_for(Session, 'after_commit')
+def _run_invalidations(session):
+    # Коммит SAVEPOINT еще может быть откачен внешней транзакцией
+    if session.in_nested_transaction():
+        return
+    for callback in session.info.pop('invalidate_after_commit', []):
+        callback()
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_invalidations(session, transaction):
+    # Внешняя транзакция завершилась без коммита - данные не менялись
+    if transaction.parent is None:
+        session.info.pop('invalidate_after_commit', None)
+
+class _PendingLoad:
+    """Результат загрузки, которого ждут конкурирующие запросы"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def resolve(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
@@ -0,0 +1,106 @@
+from functools import partial
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session, selectinload
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel
+from src.models.referral_step import ReferralStep
+from src.services.cache_service import TTLCache, invalidate_after_commit
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+def load_campaign_tree(*criteria, **filters):
+    """Кампания с каналами и их шагами за три запроса (selectin)
+
+    Запрос кампании, затем каналы всех найденных кампаний и шаги всех
+    каналов - по одному IN-запросу, независимо от их количества.
+    """
+    return ReferralCampaign.query.options(
+        selectinload(ReferralCampaign.channels).selectinload(ReferralChannel.steps)
+    ).filter(*criteria).filter_by(**filters).first()
+
+class PublicCampaignCache:
+    """Кеш публичной страницы кампании по slug
+
+    Хранит готовые данные ответа /campaigns/<slug>/public (None для
+    неизвестных и неактивных кампаний). Записи сбрасываются событиями
+    маппера при изменении кампании, ее каналов и шагов после коммита
+    транзакции в текущем процессе; остальные воркеры увидят изменения по истечении PUBLIC_CAMPAIGN_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self.cache = TTLCache(
+            ttl=int(os.getenv('PUBLIC_CAMPAIGN_CACHE_TTL', '60')),
+            max_size=int(os.getenv('PUBLIC_CAMPAIGN_CACHE_MAX_SIZE', '10000'))
+        )
+
+    def get(self, slug):
+        """Публичные данные кампании или None"""
+        return self.cache.get_or_set(slug, lambda: self._load(slug))
+
+    def _load(self, slug):
+        campaign = load_campaign_tree(public_slug=slug, is_active=True)
+        if campaign is None:
+            return None
+
+        campaign_data = campaign.to_public_dict()
+        campaign_data['channels'] = [
+            {
+                'channel_type': channel.channel_type,
+                'channel_name': channel.channel_name,
+                'description': channel.description,
+                'icon': channel.get_channel_icon(),
+                'color': channel.get_channel_color(),
+                'steps_count': len(channel.get_active_steps())
+            }
+            for channel in campaign.get_active_channels()
+        ]
+        return campaign_data
+
+    def invalidate_slug(self, slug):
+        self.cache.invalidate(slug)
+
+    def invalidate_campaign(self, campaign_id):
+        self.cache.invalidate_where(
+            lambda slug, campaign_data: campaign_data is not None and campaign_data['id'] == campaign_id
+        )
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+# Глобальный экземпляр (один на процесс)
+public_campaign_cache = PublicCampaignCache()
+
+@event.listens_for(ReferralCampaign, 'after_insert')
+@event.listens_for(ReferralCampaign, 'after_update')
+@event.listens_for(ReferralCampaign, 'after_delete')
+def _invalidate_campaign(mapper, connection, campaign):
+    session = object_session(campaign)
+    invalidate_after_commit(session, partial(public_campaign_cache.invalidate_slug, campaign.public_slug))
+    # При смене slug сбрасываем и прежний
+    for old_slug in inspect(campaign).attrs.public_slug.history.deleted:
+        invalidate_after_commit(session, partial(public_campaign_cache.invalidate_slug, old_slug))
+
+@event.listens_for(ReferralChannel, 'after_insert')
+@event.listens_for(ReferralChannel, 'after_update')
+@event.listens_for(ReferralChannel, 'after_delete')
+def _invalidate_channel(mapper, connection, channel):
+    invalidate_after_commit(
+        object_session(channel),
+        partial(public_campaign_cache.invalidate_campaign, channel.campaign_id)
+    )
+
+@event.listens_for(ReferralStep, 'after_insert')
+@event.listens_for(ReferralStep, 'after_update')
+@event.listens_for(ReferralStep, 'after_delete')
+def _invalidate_step(mapper, connection, step):
+    # Кампания шага - запросом в той же транзакции, без ленивой загрузки канала
+    campaign_id = connection.execute(
+        select(ReferralChannel.campaign_id).where(ReferralChannel.id == step.channel_id)
+    ).scalar()
+    if campaign_id is not None:
+        invalidate_after_commit(
+            object_session(step),
+            partial(public_campaign_cache.invalidate_campaign, campaign_id)
+        )
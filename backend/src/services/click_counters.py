@@ -0,0 +1,219 @@
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, case, func
+from src.database import db
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class ClickCounterAggregator:
+    """Накопитель приращений счетчиков кликов
+
+    Клики не меняют счетчики ссылок, каналов и кампаний сразу: приращения
+    суммируются в памяти процесса по id и периодически (по таймеру
+    CLICK_COUNTERS_FLUSH_INTERVAL или по числу накопленных кликов)
+    записываются атомарными UPDATE ... SET x = x + :delta - по одному
+    executemany на таблицу. Одновременные клики не теряют приращений и не
+    ждут друг друга на блокировке строки. При ошибке записи приращения
+    возвращаются в накопитель, при остановке процесса дописываются.
+
+    CLICK_COUNTERS_COALESCE=false - запись сразу после каждого пакета кликов.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('CLICK_COUNTERS_COALESCE', 'true').lower() == 'true'
+        self.flush_interval = float(os.getenv('CLICK_COUNTERS_FLUSH_INTERVAL', '1.0'))
+        self.flush_clicks = int(os.getenv('CLICK_COUNTERS_FLUSH_CLICKS', '5000'))
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._links = {}      # link_id -> [total, unique, last_clicked_at]
+        self._channels = {}   # channel_id -> total
+        self._campaigns = {}  # campaign_id -> total
+        self._pending_clicks = 0
+
+        self._app = None
+        self._thread = None
+        self._flush_requested = threading.Event()
+        self._stopping = threading.Event()
+        self._atexit_registered = False
+
+        self.stats = {
+            'clicks': 0,
+            'flushes': 0,
+            'rows_updated': 0,
+            'failed': 0
+        }
+
+    def add(self, link_id, campaign_id, channel_id=None, total=1, unique=0, last_clicked_at=None):
+        """Учитывает клики по ссылке"""
+        with self._lock:
+            counters = self._links.get(link_id)
+            if counters is None:
+                self._links[link_id] = [total, unique, last_clicked_at]
+            else:
+                counters[0] += total
+                counters[1] += unique
+                if last_clicked_at and (counters[2] is None or last_clicked_at > counters[2]):
+                    counters[2] = last_clicked_at
+
+            self._campaigns[campaign_id] = self._campaigns.get(campaign_id, 0) + total
+            if channel_id is not None:
+                self._channels[channel_id] = self._channels.get(channel_id, 0) + total
+
+            self._pending_clicks += total
+            self.stats['clicks'] += total
+            pending_clicks = self._pending_clicks
+
+        if not self.enabled:
+            self.flush()
+        else:
+            self._ensure_started()
+            if pending_clicks >= self.flush_clicks:
+                self._flush_requested.set()
+
+    def pending_total(self, link_id):
+        """Еще не записанные клики ссылки (для проверки max_clicks)"""
+        with self._lock:
+            counters = self._links.get(link_id)
+            return counters[0] if counters else 0
+
+    def flush(self):
+        """Записывает накопленные приращения. Возвращает число обновленных строк"""
+        with self._flush_lock:
+            with self._lock:
+                links, self._links = self._links, {}
+                channels, self._channels = self._channels, {}
+                campaigns, self._campaigns = self._campaigns, {}
+                self._pending_clicks = 0
+
+            if not links and not channels and not campaigns:
+                return 0
+
+            try:
+                if self._app is not None and not has_app_context():
+                    with self._app.app_context():
+                        updated = self._write(links, channels, campaigns)
+                else:
+                    updated = self._write(links, channels, campaigns)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Error flushing click counters: {str(e)}")
+                self._restore(links, channels, campaigns)
+                return 0
+
+            self.stats['flushes'] += 1
+            self.stats['rows_updated'] += updated
+            return updated
+
+    def shutdown(self, timeout=10.0):
+        """Останавливает фоновый поток и дописывает приращения"""
+        self._stopping.set()
+        self._flush_requested.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+        logger.info(f"Click counters stopped: {self.stats}")
+
+    def get_stats(self):
+        """Статистика накопителя для мониторинга"""
+        with self._lock:
+            return dict(self.stats, pending_clicks=self._pending_clicks, pending_links=len(self._links))
+
+    def _restore(self, links, channels, campaigns):
+        """Возвращает незаписанные приращения в накопитель"""
+        with self._lock:
+            for link_id, (total, unique, last) in links.items():
+                counters = self._links.setdefault(link_id, [0, 0, None])
+                counters[0] += total
+                counters[1] += unique
+                if last and (counters[2] is None or last > counters[2]):
+                    counters[2] = last
+                self._pending_clicks += total
+            for channel_id, total in channels.items():
+                self._channels[channel_id] = self._channels.get(channel_id, 0) + total
+            for campaign_id, total in campaigns.items():
+                self._campaigns[campaign_id] = self._campaigns.get(campaign_id, 0) + total
+
+    def _write(self, links, channels, campaigns):
+        from src.models.referral_campaign import ReferralCampaign
+        from src.models.referral_channel import ReferralChannel
+        from src.models.referral_link import ReferralLink
+
+        links_table = ReferralLink.__table__
+        channels_table = ReferralChannel.__table__
+        campaigns_table = ReferralCampaign.__table__
+
+        try:
+            if links:
+                db.session.execute(
+                    links_table.update().where(
+                        links_table.c.id == bindparam('b_id')
+                    ).values(
+                        total_clicks=func.coalesce(links_table.c.total_clicks, 0) + bindparam('b_total'),
+                        unique_clicks=func.coalesce(links_table.c.unique_clicks, 0) + bindparam('b_unique'),
+                        # Время последнего клика только растет
+                        last_clicked_at=case(
+                            (links_table.c.last_clicked_at.is_(None), bindparam('b_last')),
+                            (links_table.c.last_clicked_at < bindparam('b_last'), bindparam('b_last')),
+                            else_=links_table.c.last_clicked_at
+                        )
+                    ),
+                    [
+                        {'b_id': link_id, 'b_total': total, 'b_unique': unique, 'b_last': last}
+                        for link_id, (total, unique, last) in links.items()
+                    ]
+                )
+
+            for table, deltas in ((channels_table, channels), (campaigns_table, campaigns)):
+                if not deltas:
+                    continue
+                db.session.execute(
+                    table.update().where(
+                        table.c.id == bindparam('b_id')
+                    ).values(
+                        total_clicks=func.coalesce(table.c.total_clicks, 0) + bindparam('b_total')
+                    ),
+                    [{'b_id': row_id, 'b_total': total} for row_id, total in deltas.items()]
+                )
+
+            db.session.commit()
+            return len(links) + len(channels) + len(campaigns)
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _ensure_started(self):
+        """Ленивый запуск потока - уже после fork воркера gunicorn"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._app = current_app._get_current_object()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='click-counters', daemon=True
+            )
+            self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+            logger.info("Click counters started")
+
+    def _run(self):
+        """Основной цикл потока записи"""
+        while not self._stopping.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+# Глобальный экземпляр (один на процесс)
+click_counters = ClickCounterAggregator()
@@ -0,0 +1,211 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select, tuple_
+from src.database import db
+from src.services.bloom_filter import BloomFilter
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ClickUniquenessIndex:
+    """Проверка уникальности кликов по фильтрам Блума на ссылку
+
+    Для каждой ссылки в памяти хранится фильтр Блума ее click_hash,
+    построенный из referral_tracking при первом обращении (или заранее
+    через warm_up). Отрицательный ответ фильтра означает новый клик без
+    запроса к базе; в базу (индекс link_id, click_hash) уходят только
+    возможные совпадения, одним запросом на пакет.
+
+    Клики, записанные другими процессами, подтягиваются не реже раза в
+    CLICK_BLOOM_SYNC_INTERVAL секунд одним запросом: строки с id больше
+    последнего учтенного плюс строки с created_at не старше предыдущей
+    синхронизации минус CLICK_BLOOM_SYNC_OVERLAP секунд. Перекрытие нужно
+    потому, что id выдается при вставке, а видна строка после коммита:
+    транзакция с меньшим id может закоммититься позже уже прочитанного
+    большего id. Повторно прочитанные клики фильтр не дублирует.
+
+    При единственном писателе (воркер очереди приема) проверка точная.
+    При записи из нескольких процессов повтор может быть засчитан как
+    уникальный, если он пришел раньше, чем клик был синхронизирован (до
+    CLICK_BLOOM_SYNC_INTERVAL секунд после коммита), либо если между
+    created_at клика и коммитом его транзакции прошло больше
+    CLICK_BLOOM_SYNC_OVERLAP секунд (с учетом расхождения часов серверов).
+    """
+
+    def __init__(self):
+        self.error_rate = float(os.getenv('CLICK_BLOOM_ERROR_RATE', '0.01'))
+        self.min_capacity = int(os.getenv('CLICK_BLOOM_MIN_CAPACITY', '1024'))
+        self.max_links = int(os.getenv('CLICK_BLOOM_MAX_LINKS', '10000'))
+        self.sync_interval = float(os.getenv('CLICK_BLOOM_SYNC_INTERVAL', '1.0'))
+        self.sync_overlap = float(os.getenv('CLICK_BLOOM_SYNC_OVERLAP', '30'))
+
+        self._filters = OrderedDict()  # link_id -> BloomFilter, в порядке использования
+        self._lock = threading.Lock()
+        self._high_water_mark = None   # максимальный id referral_tracking, учтенный в фильтрах
+        self._last_sync = 0.0
+        self._synced_at = None         # время (UTC) начала последней синхронизации
+
+        self.stats = {
+            'negatives': 0,
+            'possible_positives': 0,
+            'false_positives': 0,
+            'builds': 0
+        }
+
+    @staticmethod
+    def _tracking_table():
+        from src.models.referral_tracking import ReferralTracking
+        return ReferralTracking.__table__
+
+    def _ensure_initialized(self):
+        if self._high_water_mark is None:
+            table = self._tracking_table()
+            self._synced_at = datetime.utcnow()
+            self._high_water_mark = db.session.execute(select(func.max(table.c.id))).scalar() or 0
+            self._last_sync = time.monotonic()
+
+    def _new_filter(self, hashes_count):
+        return BloomFilter(max(self.min_capacity, hashes_count * 2), self.error_rate)
+
+    def _store_filter(self, link_id, bloom):
+        # Вызывается под self._lock
+        self._filters[link_id] = bloom
+        self._filters.move_to_end(link_id)
+        while len(self._filters) > self.max_links:
+            self._filters.popitem(last=False)
+
+    def _build_filter(self, link_id):
+        """Строит фильтр ссылки из referral_tracking"""
+        table = self._tracking_table()
+        hashes = db.session.execute(
+            select(table.c.click_hash).where(table.c.link_id == link_id, table.c.click_hash.isnot(None))
+        ).scalars().all()
+
+        bloom = self._new_filter(len(hashes))
+        for click_hash in hashes:
+            bloom.add(click_hash)
+
+        self.stats['builds'] += 1
+        with self._lock:
+            self._store_filter(link_id, bloom)
+        return bloom
+
+    def warm_up(self, link_ids=None, chunk_size=10000):
+        """Строит фильтры заранее (при старте воркера) одним потоковым запросом
+
+        link_ids=None - все ссылки, у которых есть клики (не больше
+        CLICK_BLOOM_MAX_LINKS последних по порядку id).
+        """
+        table = self._tracking_table()
+        with self._lock:
+            self._ensure_initialized()
+
+        query = select(table.c.link_id, table.c.click_hash).where(
+            table.c.link_id.isnot(None),
+            table.c.click_hash.isnot(None)
+        )
+        if link_ids is not None:
+            query = query.where(table.c.link_id.in_(list(link_ids)))
+
+        hashes_by_link = {}
+        rows = db.session.execute(query.order_by(table.c.link_id).execution_options(yield_per=chunk_size))
+        for chunk in rows.partitions():
+            for row in chunk:
+                hashes_by_link.setdefault(row.link_id, []).append(row.click_hash)
+
+        with self._lock:
+            for link_id, hashes in hashes_by_link.items():
+                bloom = self._new_filter(len(hashes))
+                for click_hash in hashes:
+                    bloom.add(click_hash)
+                self._store_filter(link_id, bloom)
+                self.stats['builds'] += 1
+
+        logger.info(f"Click uniqueness filters built for {len(hashes_by_link)} links")
+        return len(hashes_by_link)
+
+    def _sync(self):
+        """Добавляет в загруженные фильтры клики, записанные другими процессами"""
+        if time.monotonic() - self._last_sync < self.sync_interval:
+            return
+
+        table = self._tracking_table()
+        started_at = datetime.utcnow()
+        since = self._synced_at - timedelta(seconds=self.sync_overlap)
+        rows = db.session.execute(
+            select(table.c.id, table.c.link_id, table.c.click_hash).where(
+                or_(table.c.id > self._high_water_mark, table.c.created_at >= since)
+            )
+        ).all()
+
+        with self._lock:
+            for row in rows:
+                bloom = self._filters.get(row.link_id)
+                # Клики из окна перекрытия могли быть учтены прошлой синхронизацией
+                if bloom is not None and row.click_hash and row.click_hash not in bloom:
+                    bloom.add(row.click_hash)
+                    if bloom.is_full:
+                        del self._filters[row.link_id]
+                self._high_water_mark = max(self._high_water_mark, row.id)
+            self._synced_at = started_at
+            self._last_sync = time.monotonic()
+
+    def find_existing(self, pairs):
+        """Из пар (link_id, click_hash) возвращает множество уже записанных"""
+        pairs = set(pairs)
+        if not pairs:
+            return set()
+
+        with self._lock:
+            self._ensure_initialized()
+        self._sync()
+
+        possible = []
+        for link_id, click_hash in pairs:
+            with self._lock:
+                bloom = self._filters.get(link_id)
+                if bloom is not None:
+                    self._filters.move_to_end(link_id)
+            if bloom is None:
+                bloom = self._build_filter(link_id)
+
+            if click_hash in bloom:
+                possible.append((link_id, click_hash))
+            else:
+                self.stats['negatives'] += 1
+
+        if not possible:
+            return set()
+
+        self.stats['possible_positives'] += len(possible)
+        table = self._tracking_table()
+        existing = set(db.session.execute(
+            select(table.c.link_id, table.c.click_hash).where(
+                tuple_(table.c.link_id, table.c.click_hash).in_(possible)
+            )
+        ).all())
+        self.stats['false_positives'] += len(possible) - len(existing)
+        return existing
+
+    def record(self, pairs):
+        """Добавляет записанные клики в фильтры"""
+        with self._lock:
+            for link_id, click_hash in pairs:
+                bloom = self._filters.get(link_id)
+                if bloom is None:
+                    continue
+                bloom.add(click_hash)
+                if bloom.is_full:
+                    # Следующее обращение перестроит фильтр большего размера
+                    del self._filters[link_id]
+
+    def get_stats(self):
+        """Статистика фильтров для мониторинга"""
+        with self._lock:
+            return dict(self.stats, links=len(self._filters))
+
+# Глобальный экземпляр (один на процесс)
+click_uniqueness = ClickUniquenessIndex()
@@ -0,0 +1,225 @@
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import Session
+from src.database import db, dialect_insert
+from src.models.code_sequence import CodeSequence
+import hashlib
+import logging
+import os
+import string
+import threading
+
+logger = logging.getLogger(__name__)
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+BASE36_UPPER_ALPHABET = string.digits + string.ascii_uppercase
+
+# Последовательность -> (алфавит, длина кода)
+SEQUENCES = {
+    'referral_link': (BASE62_ALPHABET, 8),
+    'referral_campaign': (BASE36_UPPER_ALPHABET, 8),
+    'project': (BASE62_ALPHABET, 8)
+}
+
+class FeistelPermutation:
+    """Ключевая перестановка чисел 0..domain-1
+
+    Сеть Фейстеля на 2*half битах (domain <= 2^(2*half)) с раундовой
+    функцией BLAKE2b с ключом; значения за пределами domain проходят
+    перестановку повторно (cycle walking), пока не попадут в домен. Это
+    биекция, поэтому разные номера счетчика дают разные коды, а соседние
+    номера - несвязанные коды.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, domain, key):
+        self.domain = domain
+        self.half = ((domain - 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half) - 1
+        key = hashlib.sha256(key).digest()
+        # Состояние хеша с ключом раунда готовится один раз и копируется
+        self._rounds = [
+            hashlib.blake2b(digest_size=8, key=key, salt=index.to_bytes(16, 'big'))
+            for index in range(self.ROUNDS)
+        ]
+
+    def _encrypt(self, value):
+        left, right = value >> self.half, value & self.mask
+        for round_hash in self._rounds:
+            state = round_hash.copy()
+            state.update(right.to_bytes(8, 'big'))
+            left, right = right, left ^ (int.from_bytes(state.digest(), 'big') & self.mask)
+        return (left << self.half) | right
+
+    def permute(self, value):
+        if not 0 <= value < self.domain:
+            raise ValueError(f"Value {value} is out of permutation domain")
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+def encode(value, alphabet, length):
+    """Число в код фиксированной длины в системе счисления алфавита"""
+    base = len(alphabet)
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, base)
+        chars.append(alphabet[remainder])
+    return ''.join(reversed(chars))
+
+class CodeAllocator:
+    """Распределитель коротких кодов без проверок уникальности
+
+    Номер кода берется из счетчика code_sequences: процесс резервирует
+    блок из CODE_ALLOCATOR_BLOCK_SIZE номеров одним UPDATE и выдает их из
+    памяти, поэтому выдача кода обычно не обращается к базе. Номер
+    переводится в код ключевой перестановкой (ключ CODE_ALLOCATOR_SECRET)
+    и кодируется base62 (ссылки, проекты) или base36 в верхнем регистре
+    (кампании). Коды не повторяются и не угадываются по соседним.
+
+    Блок резервируется отдельной короткой транзакцией на своем соединении
+    и сразу коммитится: блокировка строки счетчика не держится до коммита
+    вызывающего кода, а номера блока не выдаются повторно, даже если его
+    транзакция будет откачена (возможны только пропуски номеров).
+
+    Исключение - SQLite, когда сессия уже открыла транзакцию записи:
+    отдельное соединение ждало бы блокировку, которую держит сама сессия.
+    Тогда блок резервируется в транзакции сессии и до ее коммита выдается
+    только этой сессии; после коммита его остаток становится общим, а при
+    любом откате (в том числе до SAVEPOINT) отбрасывается - его номера
+    могут быть зарезервированы повторно.
+
+    Ключ должен быть постоянным: при его смене новые коды могут совпасть
+    с выданными ранее. Неиспользованный остаток блока при перезапуске
+    процесса теряется.
+    """
+
+    def __init__(self):
+        self.block_size = int(os.getenv('CODE_ALLOCATOR_BLOCK_SIZE', '100'))
+        secret = os.getenv('CODE_ALLOCATOR_SECRET') or os.getenv('SECRET_KEY') or 'dinorefs-code-allocator'
+
+        self._lock = threading.Lock()
+        self._blocks = {}   # последовательность -> [следующий номер, конец блока]
+        self._pending = {}  # сессия -> {последовательность: блок до коммита}
+        self._permutations = {
+            name: FeistelPermutation(len(alphabet) ** length, f"{secret}:{name}".encode())
+            for name, (alphabet, length) in SEQUENCES.items()
+        }
+
+    def _reserve(self, sequence, size):
+        """Резервирует size номеров; возвращает (начало, конец, закоммичен ли блок)"""
+        connection = db.session.connection()
+        if connection.dialect.name == 'sqlite' and connection.connection.dbapi_connection.in_transaction:
+            return self._increment(connection, sequence, size) + (False,)
+
+        with db.engine.begin() as connection:
+            return self._increment(connection, sequence, size) + (True,)
+
+    @staticmethod
+    def _increment(connection, sequence, size):
+        table = CodeSequence.__table__
+        connection.execute(
+            dialect_insert(table).values(name=sequence, next_value=0).on_conflict_do_nothing(index_elements=['name'])
+        )
+        connection.execute(
+            table.update().where(table.c.name == sequence).values(next_value=table.c.next_value + size)
+        )
+        end = connection.execute(select(table.c.next_value).where(table.c.name == sequence)).scalar()
+        return end - size, end
+
+    def allocate(self, sequence, count=1):
+        """Выдает count новых кодов последовательности"""
+        if sequence not in SEQUENCES:
+            raise ValueError(f"Unknown code sequence: {sequence}")
+
+        alphabet, length = SEQUENCES[sequence]
+        permutation = self._permutations[sequence]
+        session = db.session()
+
+        numbers = []
+        while True:
+            with self._lock:
+                # Сначала общий блок, затем незакоммиченный блок этой сессии
+                for block in (self._blocks.get(sequence), self._pending.get(session, {}).get(sequence)):
+                    if block is not None and block[0] < block[1] and len(numbers) < count:
+                        taken = min(block[1] - block[0], count - len(numbers))
+                        numbers.extend(range(block[0], block[0] + taken))
+                        block[0] += taken
+            if len(numbers) >= count:
+                break
+            # Запрос к базе - без блокировки процесса: сессия может ждать
+            # блокировку записи, которую держит другой поток
+            start, end, committed = self._reserve(sequence, max(self.block_size, count - len(numbers)))
+            with self._lock:
+                if committed:
+                    taken = min(end - start, count - len(numbers))
+                    numbers.extend(range(start, start + taken))
+                    self._share(sequence, [start + taken, end])
+                else:
+                    self._pending.setdefault(session, {})[sequence] = [start, end]
+
+        if numbers[-1] >= permutation.domain:
+            raise ValueError(f"Code sequence {sequence} is exhausted")
+
+        return [encode(permutation.permute(number), alphabet, length) for number in numbers]
+
+    def _share(self, sequence, block):
+        # Вызывается под self._lock; остаток не нужного блока - пропуск номеров
+        shared = self._blocks.get(sequence)
+        if block[0] < block[1] and (shared is None or shared[0] >= shared[1]):
+            self._blocks[sequence] = block
+
+    def _commit(self, session):
+        """Остатки закоммиченных блоков сессии становятся общими"""
+        with self._lock:
+            for sequence, block in self._pending.pop(session, {}).items():
+                self._share(sequence, block)
+
+    def _discard(self, session):
+        """Блоки сессии, чья транзакция не закоммичена, больше не выдаются"""
+        with self._lock:
+            self._pending.pop(session, None)
+
+    def next_code(self, sequence):
+        """Выдает один новый код"""
+        return self.allocate(sequence)[0]
+
+def unique_slug(column, base_slug):
+    """Свободный slug: base_slug или base_slug-N с наименьшим свободным N
+
+    Занятые варианты читаются одним запросом по префиксу.
+    """
+    escaped = base_slug.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    taken = set(db.session.execute(
+        select(column).where(or_(column == base_slug, column.like(f"{escaped}-%", escape='\\')))
+    ).scalars())
+
+    if base_slug not in taken:
+        return base_slug
+
+    counter = 1
+    while f"{base_slug}-{counter}" in taken:
+        counter += 1
+    return f"{base_slug}-{counter}"
+
+# Глобальный экземпляр (один на процесс)
+code_allocator = CodeAllocator()
+
+@event.listens_for(Session, 'after_commit')
+def _commit_reserved_blocks(session):
+    # Коммит SAVEPOINT еще может быть откачен внешней транзакцией
+    if not session.in_nested_transaction():
+        code_allocator._commit(session)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_blocks(session):
+    # Откат до SAVEPOINT возвращает и счетчик: блок, зарезервированный
+    # раньше SAVEPOINT, отбрасывается тоже - это лишь пропуск номеров
+    code_allocator._discard(session)
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_reserved_blocks(session, transaction):
+    # После коммита блоки уже перенесены; здесь остаются только откаченные
+    if transaction.parent is None:
+        code_allocator._discard(session)
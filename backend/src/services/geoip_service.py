@@ -0,0 +1,211 @@
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+import csv
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Результат геолокации
+GeoLocation = namedtuple('GeoLocation', ['country', 'city'])
+
+# Путь к скомпилированной базе (см. python -m src.tasks.build_geoip_db)
+GEOIP_DB_PATH = os.getenv('GEOIP_DB_PATH', 'data/geoip.bin')
+
+# Размер LRU-кеша результатов по IP
+GEOIP_CACHE_SIZE = int(os.getenv('GEOIP_CACHE_SIZE', '65536'))
+
+# Заголовок файла: сигнатура, версия, число диапазонов, длина таблицы мест
+_MAGIC = b'DGEO'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIII')
+
+class GeoIPDatabase:
+    """Локальная база диапазонов IPv4 -> (страна, город)
+
+    Файл содержит три массива uint32 одинаковой длины - начала и концы
+    отсортированных непересекающихся диапазонов и индексы мест - и таблицу
+    мест в JSON. Массивы не копируются в память процесса: они читаются
+    напрямую из mmap через memoryview.cast('I'), поэтому файл разделяется
+    между воркерами через page cache ОС. Поиск - бинарный по началам
+    диапазонов, без обращения к сети.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, version, ranges_count, locations_size = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f"Unsupported GeoIP database format: {path}")
+        if sys.byteorder != 'little':
+            self.close()
+            raise ValueError("GeoIP database requires a little-endian platform")
+
+        view = memoryview(self._mmap)
+        offset = _HEADER.size
+        array_size = ranges_count * 4
+        self.starts = view[offset:offset + array_size].cast('I')
+        offset += array_size
+        self.ends = view[offset:offset + array_size].cast('I')
+        offset += array_size
+        self.location_ids = view[offset:offset + array_size].cast('I')
+        offset += array_size
+
+        self.locations = [
+            GeoLocation(country or None, city or None)
+            for country, city in json.loads(bytes(view[offset:offset + locations_size]).decode())
+        ]
+        self.ranges_count = ranges_count
+
+    def lookup(self, ip_int):
+        """Место для IPv4-адреса в виде числа или None"""
+        index = bisect_right(self.starts, ip_int) - 1
+        if index < 0 or ip_int > self.ends[index]:
+            return None
+        return self.locations[self.location_ids[index]]
+
+    def close(self):
+        for name in ('starts', 'ends', 'location_ids'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+def ip_to_int(ip_address):
+    """IPv4-адрес в виде числа или None для IPv6 и некорректных строк"""
+    try:
+        return struct.unpack('!I', socket.inet_aton(ip_address))[0]
+    except (OSError, TypeError):
+        return None
+
+def compile_geoip_csv(csv_path, output_path):
+    """Компилирует CSV (start_ip, end_ip, country, city) в бинарную базу
+
+    country - двухбуквенный код ISO 3166-1 (как в ReferralTracking.country).
+
+    Адреса могут быть строками IPv4 или числами. Диапазоны сортируются,
+    одинаковые места хранятся один раз. Файл записывается во временный и
+    атомарно подменяет существующий. Возвращает число диапазонов.
+    """
+    def parse_ip(value):
+        value = value.strip()
+        return int(value) if value.isdigit() else ip_to_int(value)
+
+    ranges = []
+    location_index = {}
+    with open(csv_path, newline='', encoding='utf-8') as csv_file:
+        for row in csv.reader(csv_file):
+            if not row or row[0].startswith('#'):
+                continue
+            start, end = parse_ip(row[0]), parse_ip(row[1])
+            if start is None or end is None:
+                # Заголовок CSV или IPv6-диапазон
+                continue
+            location = (row[2].strip() if len(row) > 2 else '', row[3].strip() if len(row) > 3 else '')
+            location_id = location_index.setdefault(location, len(location_index))
+            ranges.append((start, end, location_id))
+
+    ranges.sort()
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(f"Overlapping GeoIP ranges at {current[0]}")
+
+    starts = array('I', (start for start, _, _ in ranges))
+    ends = array('I', (end for _, end, _ in ranges))
+    location_ids = array('I', (location_id for _, _, location_id in ranges))
+    if sys.byteorder != 'little':
+        for values in (starts, ends, location_ids):
+            values.byteswap()
+
+    locations = json.dumps(
+        [list(location) for location, _ in sorted(location_index.items(), key=lambda item: item[1])],
+        ensure_ascii=False
+    ).encode()
+
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, 'wb') as output_file:
+        output_file.write(_HEADER.pack(_MAGIC, _VERSION, len(ranges), len(locations)))
+        starts.tofile(output_file)
+        ends.tofile(output_file)
+        location_ids.tofile(output_file)
+        output_file.write(locations)
+    os.replace(temp_path, output_path)
+
+    return len(ranges)
+
+_database = None
+_database_lock = threading.Lock()
+_database_unavailable = False
+
+def _get_database():
+    """Ленивое открытие базы; при ее отсутствии геолокация отключается"""
+    global _database, _database_unavailable
+
+    if _database is not None or _database_unavailable:
+        return _database
+
+    with _database_lock:
+        if _database is None and not _database_unavailable:
+            try:
+                _database = GeoIPDatabase(GEOIP_DB_PATH)
+                logger.info(f"GeoIP database loaded: {_database.ranges_count} ranges from {GEOIP_DB_PATH}")
+            except (OSError, ValueError) as e:
+                _database_unavailable = True
+                logger.warning(f"GeoIP lookup disabled: {str(e)}")
+    return _database
+
+@lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def _lookup_cached(ip_address):
+    database = _get_database()
+    if database is None:
+        return None
+
+    ip_int = ip_to_int(ip_address)
+    if ip_int is None:
+        return None
+    return database.lookup(ip_int)
+
+def lookup_ip(ip_address):
+    """Страна и город по IP-адресу: GeoLocation или None, если неизвестно"""
+    if not ip_address:
+        return None
+    return _lookup_cached(ip_address)
+
+def reload_database():
+    """Переоткрывает базу после обновления файла и очищает кеш"""
+    global _database, _database_unavailable
+
+    with _database_lock:
+        # Старый mmap не закрываем: на него могут ссылаться выполняющиеся запросы
+        _database = None
+        _database_unavailable = False
+    _lookup_cached.cache_clear()
+
+def get_cache_stats():
+    """Статистика попаданий в кеш геолокации"""
+    info = _lookup_cached.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': round(info.hits / lookups, 4) if lookups else 0,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'database_loaded': _database is not None
+    }
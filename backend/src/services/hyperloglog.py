@@ -0,0 +1,83 @@
+import hashlib
+import math
+import zlib
+
+class HyperLogLog:
+    """HyperLogLog-скетч для приближенного подсчета уникальных значений
+
+    Скетч из m = 2^precision регистров оценивает число различных элементов
+    со стандартной относительной ошибкой 1.04 / sqrt(m): 0.81% при
+    precision=14 (16 КБ) и 2.3% при precision=11 (2 КБ). Скетчи с одинаковой
+    точностью объединяются поэлементным максимумом регистров, поэтому
+    уникальные значения за любой период получаются слиянием дневных
+    скетчей без обращения к сырым событиям.
+    """
+
+    HASH_BITS = 64
+
+    def __init__(self, precision=14, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+        if len(self.registers) != self.m:
+            raise ValueError("Register count does not match precision")
+
+    @property
+    def relative_error(self):
+        """Стандартная относительная ошибка оценки"""
+        return 1.04 / math.sqrt(self.m)
+
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def add(self, value):
+        """Добавляет значение в скетч"""
+        hashed = self._hash(value)
+        index = hashed >> (self.HASH_BITS - self.precision)
+        remaining_bits = self.HASH_BITS - self.precision
+        remainder = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """Добавляет набор значений"""
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        """Объединяет скетч с другим скетчем той же точности"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Оценка числа уникальных значений"""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+
+        # Поправка для малых кардинальностей (linear counting)
+        if estimate <= 2.5 * self.m:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = self.m * math.log(self.m / zeros)
+
+        return int(round(estimate))
+
+    def to_bytes(self):
+        """Сериализация для хранения в базе (регистры сжимаются zlib)"""
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data, precision):
+        """Восстановление скетча из сериализованного вида"""
+        return cls(precision=precision, registers=zlib.decompress(data))
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class IngestQueue:
+    """Надежная локальная очередь сырых событий в отдельном файле SQLite
+
+    Веб-воркеры только валидируют запрос и добавляют событие в очередь
+    (одна короткая транзакция в режиме WAL), а обогащение и запись в
+    основную базу выполняет отдельный процесс src.tasks.ingest_worker.
+    Воркер забирает пакет, помечая строки своим именем и временем (аренда),
+    и удаляет их только после успешной записи. Строки с истекшей арендой
+    (воркер упал) забираются повторно; после max_attempts неудачных
+    попыток строка остается в очереди для разбора и больше не выдается.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('INGEST_QUEUE_ENABLED', 'false').lower() == 'true'
+        self.path = os.getenv('INGEST_QUEUE_PATH', 'data/ingest_queue.db')
+        self.lease_seconds = float(os.getenv('INGEST_QUEUE_LEASE_SECONDS', '60'))
+        self.max_attempts = int(os.getenv('INGEST_QUEUE_MAX_ATTEMPTS', '5'))
+
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def configure(self, path=None, enabled=None):
+        """Переопределяет настройки (тесты и бенчмарки)"""
+        if path is not None:
+            self.path = path
+            self._local = threading.local()
+            self._schema_ready = False
+        if enabled is not None:
+            self.enabled = enabled
+
+    def _connection(self):
+        """Соединение текущего потока (sqlite3 нельзя делить между потоками и fork)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+
+        if not self._schema_ready:
+            with self._schema_lock:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS ingest_queue ('
+                    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                    ' kind TEXT NOT NULL,'
+                    ' payload TEXT NOT NULL,'
+                    ' enqueued_at REAL NOT NULL,'
+                    ' attempts INTEGER NOT NULL DEFAULT 0,'
+                    ' claimed_by TEXT,'
+                    ' claimed_until REAL)'
+                )
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS ix_ingest_queue_claim ON ingest_queue (claimed_until, id)'
+                )
+                self._schema_ready = True
+
+        return connection
+
+    def enqueue(self, kind, payload):
+        """Добавляет событие в очередь"""
+        self.enqueue_many(kind, [payload])
+
+    def enqueue_many(self, kind, payloads):
+        """Добавляет несколько событий одной транзакцией"""
+        now = time.time()
+        self._connection().executemany(
+            'INSERT INTO ingest_queue (kind, payload, enqueued_at) VALUES (?, ?, ?)',
+            [(kind, json.dumps(payload, default=str), now) for payload in payloads]
+        )
+
+    def claim(self, batch_size=1000, worker_id=None):
+        """Забирает до batch_size событий в аренду
+
+        Возвращает список (id, kind, payload, attempts) в порядке добавления.
+        """
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        connection = self._connection()
+        now = time.time()
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT id, kind, payload, attempts FROM ingest_queue'
+                ' WHERE (claimed_until IS NULL OR claimed_until < ?) AND attempts < ?'
+                ' ORDER BY id LIMIT ?',
+                (now, self.max_attempts, batch_size)
+            ).fetchall()
+
+            if rows:
+                connection.executemany(
+                    'UPDATE ingest_queue SET claimed_by = ?, claimed_until = ?, attempts = attempts + 1 WHERE id = ?',
+                    [(worker_id, now + self.lease_seconds, row[0]) for row in rows]
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        return [(row[0], row[1], json.loads(row[2]), row[3] + 1) for row in rows]
+
+    def ack(self, ids):
+        """Удаляет успешно обработанные события"""
+        self._execute_for_ids('DELETE FROM ingest_queue WHERE id IN ({})', ids)
+
+    def release(self, ids):
+        """Возвращает события в очередь для повторной попытки"""
+        self._execute_for_ids(
+            'UPDATE ingest_queue SET claimed_by = NULL, claimed_until = NULL WHERE id IN ({})', ids
+        )
+
+    def _execute_for_ids(self, statement, ids, chunk_size=500):
+        ids = list(ids)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for offset in range(0, len(ids), chunk_size):
+                chunk = ids[offset:offset + chunk_size]
+                connection.execute(statement.format(', '.join('?' * len(chunk))), chunk)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_stats(self):
+        """Статистика очереди для мониторинга"""
+        pending, dead, oldest = self._connection().execute(
+            'SELECT SUM(attempts < ?), SUM(attempts >= ?), MIN(enqueued_at) FROM ingest_queue',
+            (self.max_attempts, self.max_attempts)
+        ).fetchone()
+        return {
+            'enabled': self.enabled,
+            'pending': pending or 0,
+            'dead': dead or 0,
+            'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else 0
+        }
+
+# Глобальный экземпляр очереди (соединения создаются на поток)
+ingest_queue = IngestQueue()
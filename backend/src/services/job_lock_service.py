@@ -0,0 +1,179 @@
+from src.database import db
+from src.models.scheduled_job import JobLock, JobRun
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+class JobLockService:
+    """Аренда фоновых задач в базе данных и журнал их запусков
+    
+    Каждый процесс (воркер gunicorn или отдельный воркер планировщика)
+    пытается взять аренду задачи атомарным UPDATE ... WHERE срок истек.
+    Выполняет задачу только процесс, получивший аренду, остальные
+    пропускают запуск. Пока задача выполняется, аренда продлевается
+    фоновым потоком (heartbeat), поэтому долгая задача не истекает и не
+    запускается параллельно другим процессом.
+    """
+    
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = int(os.getenv('ANALYTICS_JOB_LEASE_SECONDS', '3600'))
+        self.heartbeat_seconds = float(os.getenv('ANALYTICS_JOB_HEARTBEAT_SECONDS', str(self.lease_seconds / 3)))
+    
+    def _refresh_owner(self):
+        # После fork воркера gunicorn pid меняется
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+    
+    def acquire(self, job_name, lease_seconds=None):
+        """Пытается получить аренду задачи. Возвращает True при успехе"""
+        self._refresh_owner()
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=lease_seconds or self.lease_seconds)
+        
+        try:
+            result = db.session.execute(
+                JobLock.__table__.update().where(
+                    JobLock.job_name == job_name,
+                    or_(JobLock.locked_until < now, JobLock.owner == self.owner)
+                ).values(owner=self.owner, locked_until=locked_until, acquired_at=now)
+            )
+            if result.rowcount == 1:
+                db.session.commit()
+                return True
+            
+            # Строки аренды еще нет - создаем; при гонке победит только один процесс
+            db.session.execute(JobLock.__table__.insert().values(
+                job_name=job_name, owner=self.owner, locked_until=locked_until, acquired_at=now
+            ))
+            db.session.commit()
+            return True
+            
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error acquiring job lock {job_name}: {str(e)}")
+            return False
+    
+    def extend(self, job_name, lease_seconds=None):
+        """Продлевает аренду текущего процесса. False - аренду забрал другой процесс"""
+        locked_until = datetime.utcnow() + timedelta(seconds=lease_seconds or self.lease_seconds)
+        
+        try:
+            result = db.session.execute(
+                JobLock.__table__.update().where(
+                    JobLock.job_name == job_name,
+                    JobLock.owner == self.owner
+                ).values(locked_until=locked_until)
+            )
+            db.session.commit()
+            return result.rowcount == 1
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error extending job lock {job_name}: {str(e)}")
+            return False
+    
+    @contextmanager
+    def heartbeat(self, job_name, app):
+        """Продлевает аренду каждые heartbeat_seconds, пока выполняется блок
+        
+        Продление идет в отдельном потоке со своим контекстом приложения и
+        сессией. Возвращает Event, который устанавливается, если аренду
+        продлить не удалось (ее забрал другой процесс).
+        """
+        stopping = threading.Event()
+        lost = threading.Event()
+        
+        def renew():
+            with app.app_context():
+                while not stopping.wait(self.heartbeat_seconds):
+                    if not self.extend(job_name):
+                        lost.set()
+                        logger.error(f"Lost job lock {job_name} while the job is running")
+                        return
+        
+        thread = threading.Thread(target=renew, name=f'job-heartbeat-{job_name}', daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stopping.set()
+            thread.join()
+    
+    def release(self, job_name):
+        """Освобождает аренду, если она принадлежит текущему процессу"""
+        try:
+            db.session.execute(
+                JobLock.__table__.update().where(
+                    JobLock.job_name == job_name,
+                    JobLock.owner == self.owner
+                ).values(locked_until=datetime.utcnow())
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error releasing job lock {job_name}: {str(e)}")
+    
+    def is_completed(self, job_name, checkpoint):
+        """Был ли период checkpoint уже успешно обработан задачей"""
+        return db.session.query(JobRun.id).filter(
+            JobRun.job_name == job_name,
+            JobRun.last_checkpoint == checkpoint,
+            JobRun.status == 'success'
+        ).first() is not None
+    
+    def get_completed_checkpoints(self, job_name, since=None):
+        """Множество успешно обработанных периодов задачи (начиная с since)"""
+        query = db.session.query(JobRun.last_checkpoint).filter(
+            JobRun.job_name == job_name,
+            JobRun.status == 'success'
+        )
+        if since is not None:
+            query = query.filter(JobRun.last_checkpoint >= since)
+        return {checkpoint for checkpoint, in query.all()}
+    
+    def start_run(self, job_name, checkpoint=None):
+        """Создает запись о запуске задачи"""
+        run = JobRun(
+            job_name=job_name,
+            owner=self.owner,
+            status='running',
+            started_at=datetime.utcnow(),
+            last_checkpoint=checkpoint
+        )
+        db.session.add(run)
+        db.session.commit()
+        return run
+    
+    def finish_run(self, run, status, rows_processed=0, checkpoint=None, error=None):
+        """Фиксирует результат запуска задачи"""
+        try:
+            run.status = status
+            run.finished_at = datetime.utcnow()
+            run.duration = (run.finished_at - run.started_at).total_seconds()
+            run.rows_processed = rows_processed or 0
+            if checkpoint is not None:
+                run.last_checkpoint = checkpoint
+            run.error = error
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving job run {run.job_name}: {str(e)}")
+    
+    def get_recent_runs(self, job_name=None, limit=50):
+        """Последние запуски задач"""
+        query = JobRun.query
+        if job_name:
+            query = query.filter_by(job_name=job_name)
+        return query.order_by(JobRun.started_at.desc()).limit(limit).all()
+
+# Глобальный экземпляр сервиса
+job_lock_service = JobLockService()
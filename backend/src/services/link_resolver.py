@@ -0,0 +1,123 @@
+from collections import namedtuple
+from datetime import datetime
+from functools import partial
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
+from src.database import db
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel
+from src.models.referral_link import ReferralLink
+from src.services.cache_service import TTLCache, invalidate_after_commit
+from src.services.click_counters import click_counters
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Неизменяемый снимок того, что нужно редиректу /r/<short_code>
+LinkSnapshot = namedtuple('LinkSnapshot', [
+    'link_id', 'campaign_id', 'channel_id', 'short_code',
+    'is_active', 'expires_at', 'max_clicks', 'public_slug', 'campaign'
+])
+
+class LinkResolver:
+    """Кеш short_code -> LinkSnapshot для горячего пути редиректа
+
+    Снимок содержит данные ссылки и публичные данные кампании, поэтому
+    разрешение кода не обращается к базе. Записи сбрасываются событиями
+    маппера при изменении или удалении ссылки, кампании или ее канала после
+    коммита транзакции (в текущем процессе; остальные воркеры увидят изменения по истечении
+    LINK_CACHE_TTL). Неизвестные коды кешируются как None, а создание
+    ссылки с таким кодом сбрасывает запись. Счетчики кликов в снимок не
+    входят: лимит max_clicks проверяется отдельным запросом только для
+    ссылок, где он задан.
+
+    Core INSERT/UPDATE по referral_links событий маппера не вызывают.
+    Массовое создание (referral_link_bulk_service) сбрасывает свои коды
+    явно; атомарные приращения счетчиков (click_counters) меняют только
+    total_clicks, unique_clicks и last_clicked_at, которых в снимке нет,
+    и сброса не требуют. Новые Core-записи полей снимка должны вызывать
+    invalidate_link / invalidate_campaign.
+    """
+
+    def __init__(self):
+        self.cache = TTLCache(
+            ttl=int(os.getenv('LINK_CACHE_TTL', '60')),
+            max_size=int(os.getenv('LINK_CACHE_MAX_SIZE', '100000'))
+        )
+
+    def resolve(self, short_code):
+        """Снимок ссылки по короткому коду или None"""
+        return self.cache.get_or_set(short_code, lambda: self._load(short_code))
+
+    def _load(self, short_code):
+        link = ReferralLink.query.filter_by(short_code=short_code).first()
+        if link is None:
+            return None
+
+        campaign = link.campaign
+        return LinkSnapshot(
+            link_id=link.id,
+            campaign_id=link.campaign_id,
+            channel_id=link.channel_id,
+            short_code=link.short_code,
+            is_active=bool(link.is_active),
+            expires_at=link.expires_at,
+            max_clicks=link.max_clicks,
+            public_slug=campaign.public_slug,
+            campaign=campaign.to_public_dict()
+        )
+
+    def can_be_clicked(self, snapshot):
+        """Аналог ReferralLink.can_be_clicked по снимку"""
+        if not snapshot.is_active:
+            return False
+        if snapshot.expires_at and datetime.utcnow() > snapshot.expires_at:
+            return False
+        if snapshot.max_clicks:
+            total_clicks = db.session.execute(
+                select(ReferralLink.total_clicks).where(ReferralLink.id == snapshot.link_id)
+            ).scalar()
+            # Плюс клики, еще не записанные накопителем счетчиков
+            total_clicks = (total_clicks or 0) + click_counters.pending_total(snapshot.link_id)
+            return total_clicks < snapshot.max_clicks
+        return True
+
+    def invalidate_link(self, short_code):
+        self.cache.invalidate(short_code)
+
+    def invalidate_campaign(self, campaign_id):
+        self.cache.invalidate_where(
+            lambda short_code, snapshot: snapshot is not None and snapshot.campaign_id == campaign_id
+        )
+
+# Глобальный экземпляр (один на процесс)
+link_resolver = LinkResolver()
+
+@event.listens_for(ReferralLink, 'after_insert')
+@event.listens_for(ReferralLink, 'after_update')
+@event.listens_for(ReferralLink, 'after_delete')
+def _invalidate_link(mapper, connection, link):
+    session = object_session(link)
+    invalidate_after_commit(session, partial(link_resolver.invalidate_link, link.short_code))
+    # При смене короткого кода сбрасываем и прежний
+    for old_code in inspect(link).attrs.short_code.history.deleted:
+        invalidate_after_commit(session, partial(link_resolver.invalidate_link, old_code))
+
+@event.listens_for(ReferralCampaign, 'after_update')
+@event.listens_for(ReferralCampaign, 'after_delete')
+def _invalidate_campaign(mapper, connection, campaign):
+    invalidate_after_commit(
+        object_session(campaign),
+        partial(link_resolver.invalidate_campaign, campaign.id)
+    )
+
+@event.listens_for(ReferralChannel, 'after_insert')
+@event.listens_for(ReferralChannel, 'after_update')
+@event.listens_for(ReferralChannel, 'after_delete')
+def _invalidate_channel(mapper, connection, channel):
+    # В публичные данные кампании входит число активных каналов
+    invalidate_after_commit(
+        object_session(channel),
+        partial(link_resolver.invalidate_campaign, channel.campaign_id)
+    )
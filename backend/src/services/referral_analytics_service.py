@@ -0,0 +1,197 @@
+from datetime import date as date_type, datetime, timedelta
+from sqlalchemy import case, delete, func, literal, select, union_all
+from src.database import db
+from src.models.referral_tracking import ReferralDailyStat, ReferralTracking
+from src.services.job_lock_service import job_lock_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Имя ночной задачи в job_runs: ее успешные запуски отмечают агрегированные дни
+ROLLUP_JOB_NAME = 'referral_rollups'
+
+class ReferralAnalyticsService:
+    """Аналитика реферальных кампаний и ссылок по дневным агрегатам
+
+    Завершенные дни читаются из referral_daily_stats, дни без агрегатов -
+    обычно только сегодняшний - из referral_tracking. Периоды
+    выравниваются по началу дня.
+    """
+
+    @staticmethod
+    def calculate_daily_rollups(date=None):
+        """Пересчитывает агрегаты за день одним INSERT ... SELECT
+
+        Повторный запуск за тот же день заменяет строки. Возвращает
+        количество записанных строк агрегатов.
+        """
+        if date is None:
+            date = (datetime.utcnow() - timedelta(days=1)).date()
+
+        tracking = ReferralTracking.__table__
+        stats = ReferralDailyStat.__table__
+
+        start_date = datetime.combine(date, datetime.min.time())
+        end_date = start_date + timedelta(days=1)
+
+        link_id = func.coalesce(tracking.c.link_id, 0)
+        event_type = func.coalesce(tracking.c.event_type, '')
+        device_type = func.coalesce(tracking.c.device_type, '')
+        country = func.coalesce(tracking.c.country, '')
+
+        rollup = select(
+            literal(start_date, db.DateTime).label('date'),
+            tracking.c.campaign_id,
+            link_id,
+            event_type,
+            device_type,
+            country,
+            func.count(tracking.c.id),
+            func.sum(case((tracking.c.is_unique == True, 1), else_=0)),
+            func.sum(case((tracking.c.is_conversion == True, 1), else_=0))
+        ).where(
+            tracking.c.created_at >= start_date,
+            tracking.c.created_at < end_date
+        ).group_by(tracking.c.campaign_id, link_id, event_type, device_type, country)
+
+        try:
+            db.session.execute(delete(stats).where(stats.c.date == start_date))
+            result = db.session.execute(stats.insert().from_select(
+                ['date', 'campaign_id', 'link_id', 'event_type', 'device_type', 'country',
+                 'events', 'unique_events', 'conversions'],
+                rollup
+            ))
+            db.session.commit()
+            return max(result.rowcount or 0, 0)
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error calculating referral rollups for {date}: {str(e)}")
+            raise
+
+    @staticmethod
+    def _period(days):
+        """Начало периода, сегодняшний день и начало живого среза"""
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        start_day = today - timedelta(days=days)
+
+        # Агрегаты используются до первого дня, за который ночная задача не отработала
+        completed = job_lock_service.get_completed_checkpoints(ROLLUP_JOB_NAME, since=start_day.date().isoformat())
+        live_from = start_day
+        while live_from < today and live_from.date().isoformat() in completed:
+            live_from += timedelta(days=1)
+
+        return start_day, today, live_from
+
+    @staticmethod
+    def get_campaign_analytics(campaign_id, days=30):
+        """Итоги и разбивки кампании одним запросом (агрегаты UNION ALL живой срез)"""
+        tracking = ReferralTracking.__table__
+        stats = ReferralDailyStat.__table__
+        start_day, _, live_from = ReferralAnalyticsService._period(days)
+
+        event_type = func.coalesce(tracking.c.event_type, '')
+        device_type = func.coalesce(tracking.c.device_type, '')
+        country = func.coalesce(tracking.c.country, '')
+
+        combined = union_all(
+            select(
+                stats.c.event_type, stats.c.device_type, stats.c.country,
+                stats.c.events, stats.c.unique_events, stats.c.conversions
+            ).where(
+                stats.c.campaign_id == campaign_id,
+                stats.c.date >= start_day,
+                stats.c.date < live_from
+            ),
+            select(
+                event_type.label('event_type'),
+                device_type.label('device_type'),
+                country.label('country'),
+                func.count(tracking.c.id).label('events'),
+                func.sum(case((tracking.c.is_unique == True, 1), else_=0)).label('unique_events'),
+                func.sum(case((tracking.c.is_conversion == True, 1), else_=0)).label('conversions')
+            ).where(
+                tracking.c.campaign_id == campaign_id,
+                tracking.c.created_at >= live_from
+            ).group_by(event_type, device_type, country)
+        ).subquery()
+
+        rows = db.session.execute(
+            select(
+                combined.c.event_type, combined.c.device_type, combined.c.country,
+                func.sum(combined.c.events).label('events'),
+                func.sum(combined.c.unique_events).label('unique_events'),
+                func.sum(combined.c.conversions).label('conversions')
+            ).group_by(combined.c.event_type, combined.c.device_type, combined.c.country)
+        ).all()
+
+        total_events = unique_events = conversions = 0
+        event_types, devices, countries = {}, {}, {}
+        for row in rows:
+            events = int(row.events or 0)
+            total_events += events
+            unique_events += int(row.unique_events or 0)
+            conversions += int(row.conversions or 0)
+            event_types[row.event_type] = event_types.get(row.event_type, 0) + events
+            devices[row.device_type] = devices.get(row.device_type, 0) + events
+            if row.country:
+                countries[row.country] = countries.get(row.country, 0) + events
+
+        def ranked(counts):
+            return sorted(counts.items(), key=lambda item: item[1], reverse=True)
+
+        return {
+            'total_events': total_events,
+            'unique_events': unique_events,
+            'conversions': conversions,
+            'conversion_rate': round((conversions / total_events * 100), 2) if total_events > 0 else 0,
+            'unique_rate': round((unique_events / total_events * 100), 2) if total_events > 0 else 0,
+            'event_types': [{'type': value, 'count': count} for value, count in ranked(event_types)],
+            'devices': [{'type': value or None, 'count': count} for value, count in ranked(devices)],
+            'countries': [{'country': value, 'count': count} for value, count in ranked(countries)]
+        }
+
+    @staticmethod
+    def get_link_daily_clicks(link_id, days=30):
+        """События ссылки по дням: [(дата, всего, уникальных)] по возрастанию даты"""
+        tracking = ReferralTracking.__table__
+        stats = ReferralDailyStat.__table__
+        start_day, _, live_from = ReferralAnalyticsService._period(days)
+
+        daily = {}
+
+        def add(day, clicks, unique_clicks):
+            if isinstance(day, datetime):
+                day = day.date()
+            elif not isinstance(day, date_type):
+                day = date_type.fromisoformat(str(day)[:10])
+            total, unique = daily.get(day, (0, 0))
+            daily[day] = (total + int(clicks or 0), unique + int(unique_clicks or 0))
+
+        for row in db.session.execute(
+            select(
+                stats.c.date,
+                func.sum(stats.c.events).label('clicks'),
+                func.sum(stats.c.unique_events).label('unique_clicks')
+            ).where(
+                stats.c.link_id == link_id,
+                stats.c.date >= start_day,
+                stats.c.date < live_from
+            ).group_by(stats.c.date)
+        ):
+            add(row.date, row.clicks, row.unique_clicks)
+
+        # Живой срез: func.date возвращает строку в SQLite и date в PostgreSQL
+        for row in db.session.execute(
+            select(
+                func.date(tracking.c.created_at).label('date'),
+                func.count(tracking.c.id).label('clicks'),
+                func.sum(case((tracking.c.is_unique == True, 1), else_=0)).label('unique_clicks')
+            ).where(
+                tracking.c.link_id == link_id,
+                tracking.c.created_at >= live_from
+            ).group_by(func.date(tracking.c.created_at))
+        ):
+            add(row.date, row.clicks, row.unique_clicks)
+
+        return [(day, clicks, unique_clicks) for day, (clicks, unique_clicks) in sorted(daily.items())]
@@ -0,0 +1,126 @@
+from datetime import datetime
+from src.database import db
+from src.services.user_agent_service import classify_user_agent, is_bot_user_agent
+from src.services.geoip_service import lookup_ip
+from src.services.click_uniqueness import click_uniqueness
+from src.services.click_counters import click_counters
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Клики ботов не записываются ни в referral_tracking, ни в счетчики
+DROP_BOT_CLICKS = os.getenv('REFERRAL_DROP_BOT_CLICKS', 'true').lower() == 'true'
+
+def make_click_hash(link_id, ip_address, user_agent):
+    """Хеш для определения уникальности клика (ссылка + IP + User-Agent)"""
+    data = f"{link_id}:{ip_address}:{user_agent}"
+    return hashlib.md5(data.encode()).hexdigest()
+
+class ReferralClickService:
+    """Пакетная регистрация кликов по реферальным ссылкам
+
+    Работает с простыми значениями (link_id, campaign_id, channel_id, IP,
+    User-Agent, referrer), а не с ORM-объектами, поэтому одинаково
+    вызывается из запроса /r/<short_code> и из воркера очереди приема.
+    """
+
+    @staticmethod
+    def drop_bot_clicks(clicks):
+        """Отбрасывает клики ботов (по правилам классификации User-Agent)"""
+        if not DROP_BOT_CLICKS:
+            return list(clicks)
+        return [click for click in clicks if not is_bot_user_agent(click.get('user_agent'))]
+
+    @staticmethod
+    def process_clicks(clicks):
+        """Записывает пакет кликов
+
+        Уникальность проверяется фильтрами Блума click_uniqueness (в базу
+        уходят только возможные совпадения) с учетом повторов внутри пакета.
+        Строки ReferralTracking вставляются одним bulk INSERT, приращения
+        счетчиков ссылок, каналов и кампаний передаются в click_counters.
+        Возвращает количество записанных кликов. Клики ботов отбрасываются
+        до записи (REFERRAL_DROP_BOT_CLICKS).
+        """
+        clicks = ReferralClickService.drop_bot_clicks(clicks)
+        if not clicks:
+            return 0
+
+        from src.models.referral_tracking import ReferralTracking
+
+        tracking_table = ReferralTracking.__table__
+
+        try:
+            now = datetime.utcnow()
+            for click in clicks:
+                click.setdefault('created_at', now)
+                click['click_hash'] = make_click_hash(click['link_id'], click.get('ip_address'), click.get('user_agent'))
+
+            # Фильтры Блума отсекают новые клики без запроса к базе
+            existing = click_uniqueness.find_existing(
+                (click['link_id'], click['click_hash']) for click in clicks
+            )
+            new_pairs = []
+
+            rows = []
+            link_stats = {}
+            for click in clicks:
+                key = (click['link_id'], click['click_hash'])
+                is_unique = key not in existing
+                if is_unique:
+                    existing.add(key)
+                    new_pairs.append(key)
+
+                user_agent_info = classify_user_agent(click.get('user_agent'), parser='referral')
+                location = lookup_ip(click.get('ip_address'))
+
+                rows.append({
+                    'campaign_id': click['campaign_id'],
+                    'channel_id': click.get('channel_id'),
+                    'link_id': click['link_id'],
+                    'event_type': 'click',
+                    'click_hash': click['click_hash'],
+                    'ip_address': click.get('ip_address'),
+                    'user_agent': click.get('user_agent'),
+                    'referrer': click.get('referrer'),
+                    'country': location.country if location else None,
+                    'city': location.city if location else None,
+                    'device_type': user_agent_info.device_type,
+                    'browser': user_agent_info.browser,
+                    'os': user_agent_info.os,
+                    'is_unique': is_unique,
+                    'is_conversion': False,
+                    'is_bot': user_agent_info.is_bot,
+                    'created_at': click['created_at']
+                })
+
+                stats = link_stats.setdefault(click['link_id'], {
+                    'campaign_id': click['campaign_id'],
+                    'channel_id': click.get('channel_id'),
+                    'total': 0,
+                    'unique': 0,
+                    'last': click['created_at']
+                })
+                stats['total'] += 1
+                stats['unique'] += int(is_unique)
+                stats['last'] = max(stats['last'], click['created_at'])
+
+            db.session.execute(tracking_table.insert(), rows)
+
+            db.session.commit()
+            click_uniqueness.record(new_pairs)
+
+            # Счетчики ссылок, каналов и кампаний - атомарными приращениями
+            for link_id, stats in link_stats.items():
+                click_counters.add(
+                    link_id, stats['campaign_id'], stats['channel_id'],
+                    total=stats['total'], unique=stats['unique'], last_clicked_at=stats['last']
+                )
+            return len(rows)
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error processing referral clicks: {str(e)}")
+            raise
@@ -0,0 +1,148 @@
+from datetime import datetime
+from src.database import db
+from src.services.code_allocator import code_allocator
+from src.services.link_resolver import link_resolver
+import csv
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на один запрос и размер пакета вставки
+BULK_LINKS_MAX = int(os.getenv('REFERRAL_BULK_LINKS_MAX', '100000'))
+BULK_LINKS_CHUNK_SIZE = int(os.getenv('REFERRAL_BULK_LINKS_CHUNK_SIZE', '5000'))
+
+UTM_FIELDS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content')
+
+CSV_HEADER = ('short_code', 'full_url', 'link_name', 'recipient')
+
+class ReferralLinkBulkService:
+    """Массовое создание реферальных ссылок по шаблону
+
+    Коды выдаются code_allocator пакетом на каждую часть, строки
+    вставляются одним executemany на часть (REFERRAL_BULK_LINKS_CHUNK_SIZE)
+    с коммитом после нее, а готовые строки CSV отдаются по мере вставки.
+    Core INSERT не вызывает события маппера, поэтому закешированные в
+    link_resolver промахи по новым кодам сбрасываются явно после коммита.
+    Ссылки без персонализации получают имя из шаблона с порядковым
+    номером, персональные - с получателем (он же utm_content, если тот не
+    задан в шаблоне).
+    """
+
+    @staticmethod
+    def parse_template(data):
+        """Проверяет запрос и возвращает (шаблон, получатели или None, количество)"""
+        template = data.get('template') or {}
+        recipients = data.get('recipients')
+
+        if not isinstance(template, dict):
+            raise ValueError('Поле template должно быть объектом')
+        for field in ('link_name', 'description', 'expires_at') + UTM_FIELDS:
+            if template.get(field) is not None and not isinstance(template[field], str):
+                raise ValueError(f'Поле template.{field} должно быть строкой')
+
+        if recipients is not None:
+            if not isinstance(recipients, list) or not all(isinstance(item, str) and item for item in recipients):
+                raise ValueError('Поле recipients должно быть списком непустых строк')
+            count = len(recipients)
+        else:
+            count = data.get('count')
+            if not isinstance(count, int) or isinstance(count, bool):
+                raise ValueError('Укажите count или recipients')
+
+        if count < 1 or count > BULK_LINKS_MAX:
+            raise ValueError(f'Количество ссылок должно быть от 1 до {BULK_LINKS_MAX}')
+
+        channel_id = template.get('channel_id')
+        if channel_id is not None and (not isinstance(channel_id, int) or isinstance(channel_id, bool)):
+            raise ValueError('Поле template.channel_id должно быть числом')
+
+        max_clicks = template.get('max_clicks')
+        if max_clicks is not None and (not isinstance(max_clicks, int) or isinstance(max_clicks, bool) or max_clicks < 1):
+            raise ValueError('Поле max_clicks должно быть положительным числом')
+
+        expires_at = None
+        if template.get('expires_at'):
+            try:
+                expires_at = datetime.fromisoformat(template['expires_at'])
+            except ValueError:
+                raise ValueError('Поле template.expires_at должно быть датой в формате ISO 8601')
+
+        parsed = {
+            'link_name': (template.get('link_name') or 'Ссылка')[:80],
+            'description': template.get('description'),
+            'channel_id': channel_id,
+            'expires_at': expires_at,
+            'max_clicks': max_clicks
+        }
+        for field in UTM_FIELDS:
+            parsed[field] = template.get(field)
+
+        return parsed, recipients, count
+
+    @staticmethod
+    def _csv_chunk(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    @staticmethod
+    def generate_links(campaign_id, user_id, template, count, recipients=None, chunk_size=None):
+        """Создает ссылки частями; генерирует текст CSV (заголовок, затем по части)"""
+        from src.models.referral_link import ReferralLink
+
+        links_table = ReferralLink.__table__
+        chunk_size = chunk_size or BULK_LINKS_CHUNK_SIZE
+
+        yield ReferralLinkBulkService._csv_chunk([CSV_HEADER])
+
+        for offset in range(0, count, chunk_size):
+            size = min(chunk_size, count - offset)
+            codes = code_allocator.allocate('referral_link', size)
+            now = datetime.utcnow()
+
+            rows = []
+            csv_rows = []
+            for index, short_code in enumerate(codes):
+                recipient = recipients[offset + index] if recipients is not None else None
+                utm = {field: template[field] for field in UTM_FIELDS}
+                if recipient is not None:
+                    link_name = f"{template['link_name']} - {recipient}"[:100]
+                    utm['utm_content'] = (utm['utm_content'] or recipient)[:100]
+                else:
+                    link_name = f"{template['link_name']} #{offset + index + 1}"
+
+                full_url = ReferralLink.build_url(short_code, utm)
+                rows.append(dict(
+                    utm,
+                    campaign_id=campaign_id,
+                    channel_id=template['channel_id'],
+                    user_id=user_id,
+                    link_name=link_name,
+                    description=template['description'],
+                    short_code=short_code,
+                    full_url=full_url,
+                    is_active=True,
+                    expires_at=template['expires_at'],
+                    max_clicks=template['max_clicks'],
+                    total_clicks=0,
+                    unique_clicks=0,
+                    total_conversions=0,
+                    created_at=now,
+                    updated_at=now
+                ))
+                csv_rows.append((short_code, full_url, link_name, recipient or ''))
+
+            try:
+                db.session.execute(links_table.insert(), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error creating bulk links for campaign {campaign_id} at {offset}: {str(e)}")
+                raise
+
+            for short_code in codes:
+                link_resolver.invalidate_link(short_code)
+
+            yield ReferralLinkBulkService._csv_chunk(csv_rows)
@@ -0,0 +1,95 @@
+import json
+import zlib
+
+class SpaceSaving:
+    """Скетч Space-Saving для поиска самых частых значений (heavy hitters)
+
+    Хранит не более capacity счетчиков. Новое значение при заполненном
+    скетче вытесняет значение с минимальным счетчиком и наследует его
+    (завышение фиксируется в error). Любое значение с частотой больше
+    N / capacity гарантированно присутствует в скетче, а оценка частоты
+    завышена не более чем на error. Скетчи сливаются (Agarwal et al.,
+    "Mergeable Summaries"), поэтому топ за любой период получается слиянием
+    дневных скетчей без обращения к сырым событиям.
+    """
+
+    def __init__(self, capacity=100, counters=None):
+        if capacity < 1:
+            raise ValueError("Space-Saving capacity must be positive")
+
+        self.capacity = capacity
+        # значение -> [оценка частоты, максимальное завышение]
+        self.counters = counters if counters is not None else {}
+
+    def _min_item(self):
+        return min(self.counters, key=lambda item: self.counters[item][0])
+
+    def add(self, item, count=1):
+        """Учитывает count появлений значения"""
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            min_item = self._min_item()
+            min_count = self.counters.pop(min_item)[0]
+            self.counters[item] = [min_count + count, min_count]
+
+    def update(self, counts):
+        """Добавляет словарь {значение: количество}"""
+        # Сначала крупные значения, чтобы мелкие не вытесняли их при заполнении
+        for item, count in sorted(counts.items(), key=lambda pair: pair[1], reverse=True):
+            self.add(item, count)
+        return self
+
+    def merge(self, other):
+        """Объединяет скетч с другим скетчем
+
+        Значение, отсутствующее в заполненном скетче, могло встретиться в
+        нем не больше минимального счетчика, поэтому этот минимум
+        добавляется к оценке и к завышению.
+        """
+        self_floor = self._floor()
+        other_floor = other._floor()
+
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, (self_floor, self_floor))
+            other_count, other_error = other.counters.get(item, (other_floor, other_floor))
+            merged[item] = [count + other_count, error + other_error]
+
+        capacity = max(self.capacity, other.capacity)
+        if len(merged) > capacity:
+            kept = sorted(merged, key=lambda item: merged[item][0], reverse=True)[:capacity]
+            merged = {item: merged[item] for item in kept}
+
+        self.capacity = capacity
+        self.counters = merged
+        return self
+
+    def _floor(self):
+        """Верхняя граница частоты значений, не попавших в скетч"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return self.counters[self._min_item()][0]
+
+    def top(self, k=10):
+        """k самых частых значений: список (значение, оценка частоты)"""
+        items = sorted(self.counters.items(), key=lambda pair: pair[1][0], reverse=True)[:k]
+        return [(item, counter[0]) for item, counter in items]
+
+    def to_bytes(self):
+        """Сериализация для хранения в базе (JSON, сжатый zlib)"""
+        return zlib.compress(json.dumps(
+            [[item, count, error] for item, (count, error) in self.counters.items()]
+        ).encode())
+
+    @classmethod
+    def from_bytes(cls, data, capacity):
+        """Восстановление скетча из сериализованного вида"""
+        counters = {
+            item: [count, error]
+            for item, count, error in json.loads(zlib.decompress(data).decode())
+        }
+        return cls(capacity=capacity, counters=counters)
@@ -0,0 +1,211 @@
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+from src.database import get_db
+from src.models.analytics_event import AnalyticsHourlyCounter
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class TrendingService:
+    """Трендовые проекты по экспоненциально затухающему счету просмотров
+
+    Каждый просмотр дает вклад exp(-lambda * age), где lambda = ln 2 /
+    half_life, поэтому тренд отражает скорость набора просмотров, а не
+    сумму за неделю. Чтобы не пересчитывать все счета при каждом
+    просмотре, они хранятся относительно опорного момента reference_time:
+    вклад просмотра в момент t равен exp(lambda * (t - reference_time)),
+    а текущий счет получается умножением на exp(-lambda * (now -
+    reference_time)). Порядок проектов от этого множителя не зависит.
+
+    Счета перестраиваются фоновым потоком из почасовых счетчиков
+    analytics_hourly_counters каждые TRENDING_REFRESH_INTERVAL секунд (это
+    также синхронизирует воркеры между собой), а между перестроениями
+    пополняются из ingest_events; там же и в фоновом потоке обновляется
+    готовый топ. Просмотры, учтенные во время перестроения, добавляются к
+    новым счетам при их замене (просмотр, закоммиченный до запроса, но
+    учтенный после его начала, до следующего перестроения считается
+    дважды). get_top читает топ из памяти процесса; только первый вызов
+    после старта процесса ждет первого перестроения.
+    """
+
+    EVENT_NAME = 'project_view'
+
+    def __init__(self):
+        self.half_life_hours = float(os.getenv('TRENDING_HALF_LIFE_HOURS', '24'))
+        self.window_days = int(os.getenv('TRENDING_WINDOW_DAYS', '7'))
+        self.refresh_interval = float(os.getenv('TRENDING_REFRESH_INTERVAL', '300'))
+        self.top_size = int(os.getenv('TRENDING_TOP_SIZE', '100'))
+        self.top_rebuild_interval = float(os.getenv('TRENDING_TOP_REBUILD_INTERVAL', '10'))
+
+        self.decay_rate = math.log(2) / (self.half_life_hours * 3600)
+
+        self._lock = threading.Lock()
+        self._scores = {}
+        self._top = []
+        self._reference_time = datetime.utcnow()
+        self._last_refresh = None
+        self._last_top_rebuild = 0.0
+        self._dirty = False
+        self._refresh_lock = threading.RLock()
+        self._views_during_refresh = None
+
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _weight(self, timestamp):
+        """Вклад одного просмотра относительно опорного момента"""
+        return math.exp(self.decay_rate * (timestamp - self._reference_time).total_seconds())
+
+    def _decay_factor(self, now=None):
+        """Множитель для перевода хранимых счетов в текущие"""
+        now = now or datetime.utcnow()
+        return math.exp(-self.decay_rate * (now - self._reference_time).total_seconds())
+
+    def record_views(self, events):
+        """Учитывает просмотры проектов из пакета событий аналитики"""
+        views = [
+            (event['project_id'], event.get('created_at') or datetime.utcnow())
+            for event in events
+            if event.get('event_name') == self.EVENT_NAME and event.get('project_id')
+        ]
+        if not views:
+            return
+
+        with self._lock:
+            for project_id, created_at in views:
+                self._scores[project_id] = self._scores.get(project_id, 0.0) + self._weight(created_at)
+            if self._views_during_refresh is not None:
+                self._views_during_refresh.extend(views)
+            self._dirty = True
+            self._rebuild_top_if_due()
+
+    def refresh(self):
+        """Перестраивает счета из почасовых счетчиков за окно window_days"""
+        with self._refresh_lock:
+            with self._lock:
+                self._views_during_refresh = []
+            try:
+                return self._refresh()
+            finally:
+                with self._lock:
+                    self._views_during_refresh = None
+
+    def _refresh(self):
+        db = get_db()
+        table = AnalyticsHourlyCounter.__table__
+
+        now = datetime.utcnow()
+        rows = db.session.execute(
+            select(table.c.hour, table.c.project_id, func.sum(table.c.count).label('views')).where(
+                table.c.event_name == self.EVENT_NAME,
+                table.c.project_id != 0,
+                table.c.hour >= now - timedelta(days=self.window_days)
+            ).group_by(table.c.hour, table.c.project_id)
+        ).all()
+
+        # Новый опорный момент - начало окна, чтобы показатели экспоненты
+        # оставались ограниченными и не переполнялись со временем
+        reference_time = now - timedelta(days=self.window_days)
+        scores = {}
+        for row in rows:
+            # Просмотры часа считаются пришедшими в его середину
+            age = (row.hour + timedelta(minutes=30) - reference_time).total_seconds()
+            scores[row.project_id] = scores.get(row.project_id, 0.0) + row.views * math.exp(self.decay_rate * age)
+
+        with self._lock:
+            self._reference_time = reference_time
+            # Просмотры, учтенные после начала запроса, в его результат не попали
+            for project_id, created_at in self._views_during_refresh:
+                scores[project_id] = scores.get(project_id, 0.0) + self._weight(created_at)
+            self._scores = scores
+            self._rebuild_top()
+            self._last_refresh = time.monotonic()
+
+        logger.info(f"Trending scores refreshed for {len(scores)} projects")
+        return len(scores)
+
+    def _rebuild_top(self):
+        # Вызывается под self._lock
+        self._top = heapq.nlargest(self.top_size, self._scores.items(), key=lambda item: item[1])
+        self._dirty = False
+        self._last_top_rebuild = time.monotonic()
+
+    def _rebuild_top_if_due(self):
+        # Вызывается под self._lock
+        if self._dirty and time.monotonic() - self._last_top_rebuild >= self.top_rebuild_interval:
+            self._rebuild_top()
+
+    def get_top(self, limit=10):
+        """Топ проектов: список (project_id, текущий счет) по убыванию"""
+        if self._last_refresh is None and has_app_context():
+            self._initial_refresh()
+        self._ensure_started()
+
+        with self._lock:
+            factor = self._decay_factor()
+            return [(project_id, score * factor) for project_id, score in self._top[:limit]]
+
+    def _initial_refresh(self):
+        """Первое перестроение после старта процесса - в потоке запроса"""
+        with self._refresh_lock:
+            if self._last_refresh is not None:
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                # Повтор - фоновым потоком через интервал
+                logger.error(f"Error refreshing trending scores: {str(e)}")
+                self._last_refresh = time.monotonic()
+
+    def stop(self):
+        """Останавливает фоновый поток перестроения"""
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(5.0)
+
+    def _ensure_started(self):
+        """Ленивый запуск потока - уже после fork воркера gunicorn"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if not has_app_context():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._app = current_app._get_current_object()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='trending-refresh', daemon=True
+            )
+            self._thread.start()
+            logger.info("Trending refresh thread started")
+
+    def _run(self):
+        """Перестроение счетов по таймеру и обновление топа между ними"""
+        while not self._stopping.is_set():
+            if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.refresh_interval:
+                try:
+                    with self._app.app_context():
+                        self.refresh()
+                except Exception as e:
+                    # Остается последний построенный топ, повтор - через интервал
+                    logger.error(f"Error refreshing trending scores: {str(e)}")
+                    self._last_refresh = time.monotonic()
+            else:
+                with self._lock:
+                    self._rebuild_top_if_due()
+
+            self._stopping.wait(min(self.refresh_interval, self.top_rebuild_interval))
+
+# Глобальный экземпляр сервиса трендов (один на процесс)
+trending_service = TrendingService()
@@ -0,0 +1,126 @@
+from collections import namedtuple
+from functools import lru_cache
+from user_agents import parse
+import json
+import os
+
+# Результат классификации User-Agent
+UserAgentInfo = namedtuple('UserAgentInfo', ['device_type', 'browser', 'os', 'is_bot'])
+
+# Размер общего LRU-кеша (число различных строк User-Agent)
+USER_AGENT_CACHE_SIZE = int(os.getenv('USER_AGENT_CACHE_SIZE', '4096'))
+
+# Аномально длинные строки не кешируем, чтобы кеш не раздувался по памяти
+USER_AGENT_CACHE_MAX_LENGTH = 1024
+
+# Правила упрощенной классификации реферальных кликов
+USER_AGENT_RULES_PATH = os.getenv(
+    'USER_AGENT_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_agent_rules.json')
+)
+
+class UserAgentRules:
+    """Классификатор User-Agent по правилам из JSON-файла
+
+    Правила задаются для каждого поля UserAgentInfo списком в порядке
+    приоритета: {"value": ..., "match": [подстроки]}; побеждает первое
+    правило, подстрока которого встречается в User-Agent (без учета
+    регистра), иначе берется default. При загрузке правила разворачиваются
+    в плоские кортежи (подстрока, значение), и классификация - это один
+    lower() и проверки `in`, которые выполняются на уровне C. Регулярное
+    выражение на поле (альтернатива его подстрок) в CPython медленнее
+    примерно вдвое (см. benchmarks/bench_user_agent_rules.py).
+    """
+
+    FIELDS = ('device_type', 'browser', 'os', 'is_bot')
+
+    def __init__(self, rules):
+        self._plan = []
+        for field in self.FIELDS:
+            spec = rules[field]
+            checks = tuple(
+                (token.lower(), rule['value'])
+                for rule in spec['rules']
+                for token in rule['match']
+            )
+            self._plan.append((spec['default'], checks))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as rules_file:
+            return cls(json.load(rules_file))
+
+    def classify(self, user_agent_string):
+        """Возвращает UserAgentInfo"""
+        user_agent = user_agent_string.lower()
+        values = []
+        for default, checks in self._plan:
+            for token, value in checks:
+                if token in user_agent:
+                    values.append(value)
+                    break
+            else:
+                values.append(default)
+        return UserAgentInfo._make(values)
+
+referral_rules = UserAgentRules.from_file(USER_AGENT_RULES_PATH)
+
+def _parse_analytics(user_agent_string):
+    """Полный разбор через user_agents (с версиями браузера и ОС)"""
+    user_agent = parse(user_agent_string)
+    device_type = 'mobile' if user_agent.is_mobile else 'tablet' if user_agent.is_tablet else 'desktop'
+    return UserAgentInfo(
+        device_type=device_type,
+        browser=f"{user_agent.browser.family} {user_agent.browser.version_string}",
+        os=f"{user_agent.os.family} {user_agent.os.version_string}",
+        is_bot=user_agent.is_bot
+    )
+
+def _parse_referral(user_agent_string):
+    """Упрощенная классификация для реферальных кликов (без версий)"""
+    return referral_rules.classify(user_agent_string)
+
+_PARSERS = {
+    'analytics': _parse_analytics,
+    'referral': _parse_referral
+}
+
+@lru_cache(maxsize=USER_AGENT_CACHE_SIZE)
+def _classify_cached(parser, user_agent_string):
+    return _PARSERS[parser](user_agent_string)
+
+def classify_user_agent(user_agent_string, parser='analytics'):
+    """Классифицирует User-Agent с использованием общего LRU-кеша
+
+    parser='analytics' - полный разбор для событий аналитики,
+    parser='referral' - упрощенная классификация для реферальных кликов.
+    Возвращает UserAgentInfo(device_type, browser, os, is_bot).
+    """
+    if parser not in _PARSERS:
+        raise ValueError(f"Unknown user agent parser: {parser}")
+
+    user_agent_string = user_agent_string or ''
+    if len(user_agent_string) > USER_AGENT_CACHE_MAX_LENGTH:
+        return _PARSERS[parser](user_agent_string)
+
+    return _classify_cached(parser, user_agent_string)
+
+def is_bot_user_agent(user_agent_string):
+    """Бот ли это по правилам реферальной классификации"""
+    return classify_user_agent(user_agent_string, parser='referral').is_bot
+
+def get_cache_stats():
+    """Статистика попаданий в кеш User-Agent"""
+    info = _classify_cached.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': round(info.hits / lookups, 4) if lookups else 0,
+        'size': info.currsize,
+        'max_size': info.maxsize
+    }
+
+def clear_cache():
+    """Очищает кеш User-Agent"""
+    _classify_cached.cache_clear()
@@ -0,0 +1,157 @@
+"""
+Параллельный пересчет исторических аналитических агрегатов
+
+Диапазон дат разбивается на задания по одному дню, которые выполняются
+пулом процессов. Завершенные дни записываются в файл контрольных точек
+(JSON Lines), поэтому прерванный запуск продолжается с того же места.
+
+Запуск из каталога backend:
+    python -m src.tasks.analytics_backfill --start 2025-01-01 --end 2025-12-31 --workers 8
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+import argparse
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = 'analytics_backfill.checkpoint.jsonl'
+
+# Приложение Flask создается один раз в каждом процессе пула
+_worker_app = None
+
+def _init_worker():
+    """Инициализация процесса пула: собственное приложение и пул соединений"""
+    global _worker_app
+    from src.main import app
+    _worker_app = app
+
+def _process_day(day_iso):
+    """Пересчет всех агрегатов за один день (выполняется в процессе пула)"""
+    from src.tasks.analytics_tasks import run_manual_analytics
+
+    started = time.perf_counter()
+    with _worker_app.app_context():
+        run_manual_analytics(date.fromisoformat(day_iso))
+    return day_iso, time.perf_counter() - started
+
+def iter_days(start_date, end_date):
+    """Дни диапазона [start_date, end_date] включительно"""
+    current = start_date
+    while current <= end_date:
+        yield current
+        current += timedelta(days=1)
+
+def load_checkpoint(path):
+    """Множество уже обработанных дней из файла контрольных точек"""
+    if not path or not os.path.exists(path):
+        return set()
+
+    completed = set()
+    with open(path, encoding='utf-8') as checkpoint_file:
+        for line in checkpoint_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                completed.add(json.loads(line)['date'])
+            except (ValueError, KeyError):
+                # Недописанная строка после аварийного завершения
+                continue
+    return completed
+
+def append_checkpoint(path, day_iso, duration):
+    """Фиксирует завершенный день в файле контрольных точек"""
+    if not path:
+        return
+
+    line = json.dumps({'date': day_iso, 'duration': round(duration, 3)}) + '\n'
+    with open(path, 'ab+') as checkpoint_file:
+        # Недописанная строка после аварийного завершения не должна склеиться с новой
+        if checkpoint_file.seek(0, os.SEEK_END) > 0:
+            checkpoint_file.seek(-1, os.SEEK_END)
+            if checkpoint_file.read(1) != b'\n':
+                line = '\n' + line
+        checkpoint_file.write(line.encode('utf-8'))
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+def run_backfill(start_date, end_date, workers=4, checkpoint_path=DEFAULT_CHECKPOINT_PATH):
+    """Запускает пересчет диапазона дат и возвращает сводку"""
+    completed = load_checkpoint(checkpoint_path)
+    pending = [day.isoformat() for day in iter_days(start_date, end_date) if day.isoformat() not in completed]
+
+    logger.info(
+        f"Backfill {start_date}..{end_date}: {len(pending)} days pending, "
+        f"{len(completed)} already done, {workers} workers"
+    )
+
+    processed = []
+    failed = []
+    started = time.perf_counter()
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(_process_day, day_iso): day_iso for day_iso in pending}
+
+            for future in as_completed(futures):
+                day_iso = futures[future]
+                try:
+                    _, duration = future.result()
+                except Exception as e:
+                    failed.append(day_iso)
+                    logger.error(f"Backfill failed for {day_iso}: {str(e)}")
+                    continue
+
+                append_checkpoint(checkpoint_path, day_iso, duration)
+                processed.append(day_iso)
+
+                elapsed = time.perf_counter() - started
+                logger.info(
+                    f"Backfilled {day_iso} in {duration:.1f}s "
+                    f"({len(processed)}/{len(pending)}, {len(processed) / elapsed * 60:.1f} days/min)"
+                )
+
+    elapsed = time.perf_counter() - started
+    return {
+        'processed': len(processed),
+        'skipped': len(completed),
+        'failed': sorted(failed),
+        'elapsed_seconds': round(elapsed, 1),
+        'days_per_minute': round(len(processed) / elapsed * 60, 2) if elapsed > 0 else 0
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пересчет аналитических агрегатов за диапазон дат')
+    parser.add_argument('--start', required=True, type=date.fromisoformat, help='Первый день (YYYY-MM-DD)')
+    parser.add_argument('--end', required=True, type=date.fromisoformat, help='Последний день включительно (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Количество процессов')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH, help='Файл контрольных точек')
+    parser.add_argument('--restart', action='store_true', help='Игнорировать контрольные точки и пересчитать все дни')
+    args = parser.parse_args(argv)
+
+    if args.end < args.start:
+        parser.error('--end must not be earlier than --start')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    summary = run_backfill(args.start, args.end, args.workers, args.checkpoint)
+
+    print(
+        f"Обработано дней: {summary['processed']}, пропущено: {summary['skipped']}, "
+        f"ошибок: {len(summary['failed'])}, время: {summary['elapsed_seconds']} с, "
+        f"скорость: {summary['days_per_minute']} дней/мин"
+    )
+    if summary['failed']:
+        print(f"Не удалось пересчитать: {', '.join(summary['failed'])}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
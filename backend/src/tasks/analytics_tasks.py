@@ -1,9 +1,14 @@
 from datetime import datetime, timedelta
-from ..services.analytics_service import AnalyticsService
+from ..services.analytics_service import AnalyticsService, PROJECT_METRICS_JOB_NAME
 from ..models.user import User
 from ..models.project import Project
-from ..database import get_db
+from ..models.analytics_event import AnalyticsEvent, UserSession
+from ..database import get_db, db
+from ..services.job_lock_service import job_lock_service
+from ..services.referral_analytics_service import ReferralAnalyticsService, ROLLUP_JOB_NAME
+from flask import current_app
 import logging
+import os
 import schedule
 import time
 import threading
@@ -11,24 +16,36 @@ import threading
 logger = logging.getLogger(__name__)
 
 class AnalyticsTasks:
-    """Класс для выполнения аналитических задач по расписанию"""
+    """Класс для выполнения аналитических задач по расписанию
+    
+    Планировщик может работать в каждом веб-воркере: задачу выполняет только
+    процесс, получивший аренду в таблице job_locks, а период, уже успешно
+    обработанный другим процессом (см. job_runs), пропускается. Для запуска
+    отдельным процессом используйте python -m src.tasks.scheduler_worker и
+    ANALYTICS_SCHEDULER_IN_WEB=false в веб-воркерах.
+    """
     
     def __init__(self):
         self.running = False
         self.thread = None
+        self.app = None
+    
+    def _configure_schedule(self):
+        """Настройка расписания"""
+        schedule.every().day.at("01:00").do(self.run_job, 'daily_metrics', self.calculate_daily_metrics, self._yesterday)
+        schedule.every().day.at("01:30").do(self.run_job, ROLLUP_JOB_NAME, self.calculate_referral_rollups, self._yesterday)
+        schedule.every().day.at("02:00").do(self.run_job, PROJECT_METRICS_JOB_NAME, self.calculate_all_project_metrics, self._yesterday)
+        schedule.every().day.at("03:00").do(self.run_job, 'user_metrics', self.calculate_all_user_metrics, self._yesterday)
+        schedule.every().hour.do(self.run_job, 'session_durations', self.update_session_durations, self._current_hour)
     
-    def start_scheduler(self):
-        """Запуск планировщика задач"""
+    def start_scheduler(self, app=None):
+        """Запуск планировщика задач в фоновом потоке"""
         if self.running:
             return
         
+        self.app = app or current_app._get_current_object()
         self.running = True
-        
-        # Настройка расписания
-        schedule.every().day.at("01:00").do(self.calculate_daily_metrics)
-        schedule.every().day.at("02:00").do(self.calculate_all_project_metrics)
-        schedule.every().day.at("03:00").do(self.calculate_all_user_metrics)
-        schedule.every().hour.do(self.update_session_durations)
+        self._configure_schedule()
         
         # Запуск в отдельном потоке
         self.thread = threading.Thread(target=self._run_scheduler)
@@ -37,6 +54,15 @@ class AnalyticsTasks:
         
         logger.info("Analytics scheduler started")
     
+    def run_forever(self, app):
+        """Запуск планировщика в текущем потоке (отдельный процесс-воркер)"""
+        self.app = app
+        self.running = True
+        self._configure_schedule()
+        
+        logger.info("Analytics scheduler worker started")
+        self._run_scheduler()
+    
     def stop_scheduler(self):
         """Остановка планировщика задач"""
         self.running = False
@@ -49,79 +75,117 @@ class AnalyticsTasks:
             schedule.run_pending()
             time.sleep(60)  # Проверка каждую минуту
     
-    def calculate_daily_metrics(self):
-        """Расчет ежедневных метрик за вчерашний день"""
-        try:
-            yesterday = (datetime.utcnow() - timedelta(days=1)).date()
-            AnalyticsService.calculate_daily_metrics(yesterday)
-            logger.info(f"Daily metrics calculated for {yesterday}")
-        except Exception as e:
-            logger.error(f"Error in daily metrics calculation: {str(e)}")
+    @staticmethod
+    def _yesterday():
+        return (datetime.utcnow() - timedelta(days=1)).date()
+    
+    @staticmethod
+    def _current_hour():
+        return datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    
+    def run_job(self, job_name, job_func, period_func):
+        """Выполняет задачу, если текущий процесс получил ее аренду
+        
+        job_func(period) возвращает количество обработанных строк. Запуск
+        фиксируется в job_runs вместе с обработанным периодом.
+        """
+        period = period_func()
+        checkpoint = period.isoformat()
+        
+        with self.app.app_context():
+            if job_lock_service.is_completed(job_name, checkpoint):
+                logger.info(f"Job {job_name} already completed for {checkpoint}, skipping")
+                return
+            
+            if not job_lock_service.acquire(job_name):
+                logger.info(f"Job {job_name} is running in another process, skipping")
+                return
+            
+            try:
+                # Повторная проверка: другой процесс мог завершить задачу до нашей аренды
+                if job_lock_service.is_completed(job_name, checkpoint):
+                    return
+                
+                run = job_lock_service.start_run(job_name, checkpoint)
+                try:
+                    # Аренда продлевается, пока задача выполняется
+                    with job_lock_service.heartbeat(job_name, self.app) as lease_lost:
+                        rows_processed = job_func(period)
+                    if lease_lost.is_set():
+                        raise RuntimeError(f"Job lock {job_name} was lost during the run")
+                    job_lock_service.finish_run(run, 'success', rows_processed, checkpoint)
+                    logger.info(f"Job {job_name} finished for {checkpoint}: {rows_processed} rows")
+                except Exception as e:
+                    db.session.rollback()
+                    job_lock_service.finish_run(run, 'failed', error=str(e))
+                    logger.error(f"Error in job {job_name}: {str(e)}")
+            finally:
+                job_lock_service.release(job_name)
     
-    def calculate_all_project_metrics(self):
+    def calculate_daily_metrics(self, date=None):
+        """Расчет ежедневных метрик (по умолчанию за вчерашний день)"""
+        date = date or self._yesterday()
+        # Счетчики пересобираются первыми: из них берется разбивка по устройствам
+        AnalyticsService.rebuild_hourly_counters(date)
+        events_count = AnalyticsService.calculate_daily_metrics(date)
+        AnalyticsService.rebuild_unique_sketches(date)
+        AnalyticsService.rebuild_topk_sketches(date)
+        logger.info(f"Daily metrics calculated for {date}")
+        return events_count
+    
+    def calculate_referral_rollups(self, date=None):
+        """Дневные агрегаты реферальных событий (по умолчанию за вчерашний день)"""
+        date = date or self._yesterday()
+        rows_count = ReferralAnalyticsService.calculate_daily_rollups(date)
+        logger.info(f"Referral rollups calculated for {date}: {rows_count} rows")
+        return rows_count
+    
+    def calculate_all_project_metrics(self, date=None):
         """Расчет метрик для всех проектов"""
-        try:
-            db = get_db()
-            yesterday = (datetime.utcnow() - timedelta(days=1)).date()
-            
-            # Получаем все проекты, которые имели активность вчера
-            active_projects = db.query(Project.id).join(
-                AnalyticsEvent, Project.id == AnalyticsEvent.project_id
-            ).filter(
-                AnalyticsEvent.created_at >= datetime.combine(yesterday, datetime.min.time()),
-                AnalyticsEvent.created_at < datetime.combine(yesterday, datetime.min.time()) + timedelta(days=1)
-            ).distinct().all()
-            
-            for project in active_projects:
-                AnalyticsService.calculate_project_metrics(project.id, yesterday)
-            
-            logger.info(f"Project metrics calculated for {len(active_projects)} projects")
-            
-        except Exception as e:
-            logger.error(f"Error in project metrics calculation: {str(e)}")
+        date = date or self._yesterday()
+        
+        # Один сгруппированный запрос по всем проектам, активным за день
+        projects_count = AnalyticsService.calculate_all_project_metrics(date)
+        
+        logger.info(f"Project metrics calculated for {projects_count} projects")
+        return projects_count
     
-    def calculate_all_user_metrics(self):
+    def calculate_all_user_metrics(self, date=None):
         """Расчет метрик для всех активных пользователей"""
-        try:
-            db = get_db()
-            yesterday = (datetime.utcnow() - timedelta(days=1)).date()
-            
-            # Получаем всех пользователей, которые были активны вчера
-            active_users = db.query(User.id).join(
-                AnalyticsEvent, User.id == AnalyticsEvent.user_id
-            ).filter(
-                AnalyticsEvent.created_at >= datetime.combine(yesterday, datetime.min.time()),
-                AnalyticsEvent.created_at < datetime.combine(yesterday, datetime.min.time()) + timedelta(days=1)
-            ).distinct().all()
-            
-            for user in active_users:
-                AnalyticsService.calculate_user_metrics(user.id, yesterday)
-            
-            logger.info(f"User metrics calculated for {len(active_users)} users")
-            
-        except Exception as e:
-            logger.error(f"Error in user metrics calculation: {str(e)}")
+        date = date or self._yesterday()
+        
+        # Один потоковый GROUP BY по всем пользователям, активным за день
+        users_count = AnalyticsService.calculate_all_user_metrics(date)
+        
+        logger.info(f"User metrics calculated for {users_count} users")
+        return users_count
     
-    def update_session_durations(self):
+    def update_session_durations(self, period=None):
         """Обновление длительности сессий"""
+        # Получаем сессии без установленной длительности, которые старше 1 часа
+        cutoff_time = datetime.utcnow() - timedelta(hours=1)
+        
+        # Пакетное обновление частями вместо запроса и коммита на каждую сессию
+        sessions_count = AnalyticsService.finalize_stale_sessions(cutoff_time)
+        
+        logger.info(f"Updated duration for {sessions_count} sessions")
+        return sessions_count
+    
+    def _run_recorded(self, job_name, job_func, date):
+        """Выполняет задачу за день без аренды и фиксирует запуск в job_runs
+        
+        Успешный запуск отмечает день агрегированным для чтения дашбордом и
+        пропускается ночным расписанием.
+        """
+        checkpoint = date.isoformat()
+        run = job_lock_service.start_run(job_name, checkpoint)
         try:
-            db = get_db()
-            
-            # Получаем сессии без установленной длительности, которые старше 1 часа
-            cutoff_time = datetime.utcnow() - timedelta(hours=1)
-            
-            inactive_sessions = db.query(UserSession.session_id).filter(
-                UserSession.end_time.is_(None),
-                UserSession.updated_at < cutoff_time
-            ).all()
-            
-            for session in inactive_sessions:
-                AnalyticsService.update_session_duration(session.session_id)
-            
-            logger.info(f"Updated duration for {len(inactive_sessions)} sessions")
-            
+            rows_processed = job_func(date)
         except Exception as e:
-            logger.error(f"Error updating session durations: {str(e)}")
+            db.session.rollback()
+            job_lock_service.finish_run(run, 'failed', error=str(e))
+            raise
+        job_lock_service.finish_run(run, 'success', rows_processed, checkpoint)
     
     def run_manual_calculation(self, date=None):
         """Ручной запуск расчета метрик за определенную дату"""
@@ -131,34 +195,17 @@ class AnalyticsTasks:
         try:
             logger.info(f"Starting manual metrics calculation for {date}")
             
-            # Расчет общих метрик
-            AnalyticsService.calculate_daily_metrics(date)
+            # Расчет общих метрик (с пересборкой почасовых счетчиков и скетчей)
+            self._run_recorded('daily_metrics', self.calculate_daily_metrics, date)
             
-            # Расчет метрик проектов
-            db = get_db()
-            start_date = datetime.combine(date, datetime.min.time())
-            end_date = start_date + timedelta(days=1)
-            
-            active_projects = db.query(Project.id).join(
-                AnalyticsEvent, Project.id == AnalyticsEvent.project_id
-            ).filter(
-                AnalyticsEvent.created_at >= start_date,
-                AnalyticsEvent.created_at < end_date
-            ).distinct().all()
+            # Дневные агрегаты реферальных событий
+            self._run_recorded(ROLLUP_JOB_NAME, self.calculate_referral_rollups, date)
             
-            for project in active_projects:
-                AnalyticsService.calculate_project_metrics(project.id, date)
+            # Расчет метрик проектов
+            self._run_recorded(PROJECT_METRICS_JOB_NAME, self.calculate_all_project_metrics, date)
             
             # Расчет метрик пользователей
-            active_users = db.query(User.id).join(
-                AnalyticsEvent, User.id == AnalyticsEvent.user_id
-            ).filter(
-                AnalyticsEvent.created_at >= start_date,
-                AnalyticsEvent.created_at < end_date
-            ).distinct().all()
-            
-            for user in active_users:
-                AnalyticsService.calculate_user_metrics(user.id, date)
+            self._run_recorded('user_metrics', self.calculate_all_user_metrics, date)
             
             logger.info(f"Manual metrics calculation completed for {date}")
             
@@ -169,9 +216,16 @@ class AnalyticsTasks:
 # Глобальный экземпляр планировщика
 analytics_scheduler = AnalyticsTasks()
 
-def start_analytics_scheduler():
-    """Функция для запуска планировщика аналитики"""
-    analytics_scheduler.start_scheduler()
+def start_analytics_scheduler(app=None):
+    """Функция для запуска планировщика аналитики в веб-процессе
+    
+    При ANALYTICS_SCHEDULER_IN_WEB=false планировщик в веб-воркерах не
+    запускается - задачи выполняет отдельный процесс scheduler_worker.
+    """
+    if os.getenv('ANALYTICS_SCHEDULER_IN_WEB', 'true').lower() != 'true':
+        logger.info("Analytics scheduler disabled in web process")
+        return
+    analytics_scheduler.start_scheduler(app)
 
 def stop_analytics_scheduler():
     """Функция для остановки планировщика аналитики"""
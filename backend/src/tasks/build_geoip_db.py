@@ -0,0 +1,34 @@
+"""
+Сборка локальной базы GeoIP из CSV
+
+CSV содержит строки start_ip,end_ip,country,city (адреса IPv4 строками или
+числами, например выгрузка GeoLite2/DB-IP, приведенная к диапазонам).
+Результат читается geoip_service через mmap, путь задается GEOIP_DB_PATH.
+
+Запуск из каталога backend:
+    python -m src.tasks.build_geoip_db ip_ranges.csv data/geoip.bin
+"""
+import argparse
+import os
+import time
+
+from src.services.geoip_service import compile_geoip_csv
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Компиляция CSV с диапазонами IP в базу GeoIP')
+    parser.add_argument('csv_path', help='CSV: start_ip,end_ip,country,city')
+    parser.add_argument('output_path', nargs='?', default=os.getenv('GEOIP_DB_PATH', 'data/geoip.bin'),
+                        help='Файл базы (по умолчанию GEOIP_DB_PATH)')
+    args = parser.parse_args(argv)
+
+    output_dir = os.path.dirname(args.output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    ranges_count = compile_geoip_csv(args.csv_path, args.output_path)
+    print(f"Диапазонов: {ranges_count}, файл: {args.output_path}, время: {time.perf_counter() - started:.1f} с")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,135 @@
+"""
+Воркер очереди приема событий
+
+Забирает сырые события из локальной очереди (src.services.ingest_queue),
+обогащает их (User-Agent, GeoIP, уникальность кликов) и записывает в
+основную базу пакетами. Веб-воркеры при INGEST_QUEUE_ENABLED=true только
+кладут события в очередь.
+
+Запуск из каталога backend:
+    python -m src.tasks.ingest_worker
+"""
+from datetime import datetime
+from src.services.ingest_queue import ingest_queue
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class IngestWorker:
+    """Цикл обработки очереди приема"""
+
+    def __init__(self, queue=None):
+        self.queue = queue or ingest_queue
+        self.batch_size = int(os.getenv('INGEST_WORKER_BATCH_SIZE', '1000'))
+        self.poll_interval = float(os.getenv('INGEST_WORKER_POLL_INTERVAL', '0.5'))
+        self.running = False
+
+        self.stats = {
+            'processed': 0,
+            'failed': 0,
+            'batches': 0
+        }
+
+    def _handle_analytics(self, payloads):
+        from src.services.analytics_service import AnalyticsService
+        return AnalyticsService.ingest_events([AnalyticsService.enrich_event(payload) for payload in payloads])
+
+    def _handle_referral_clicks(self, payloads):
+        from src.services.referral_click_service import ReferralClickService
+        for payload in payloads:
+            if isinstance(payload.get('created_at'), str):
+                payload['created_at'] = datetime.fromisoformat(payload['created_at'])
+        return ReferralClickService.process_clicks(payloads)
+
+    def _process(self, kind, handler, items):
+        """Обрабатывает события одного типа. Возвращает число записанных
+
+        Пакет с ошибкой повторяется половинами, поэтому в очередь
+        возвращаются (и после max_attempts остаются в ней для разбора)
+        только события, которые не удается записать даже поодиночке.
+        """
+        ids = [item_id for item_id, _ in items]
+        try:
+            handler([payload for _, payload in items])
+        except Exception as e:
+            if len(items) == 1:
+                self.stats['failed'] += 1
+                logger.error(f"Error processing '{kind}' event {ids[0]}: {str(e)}; payload: {items[0][1]!r}")
+                self.queue.release(ids)
+                return 0
+            middle = len(items) // 2
+            return self._process(kind, handler, items[:middle]) + self._process(kind, handler, items[middle:])
+
+        self.queue.ack(ids)
+        return len(ids)
+
+    def run_once(self):
+        """Обрабатывает один пакет. Возвращает число обработанных событий"""
+        claimed = self.queue.claim(self.batch_size)
+        if not claimed:
+            return 0
+
+        handlers = {
+            'analytics': self._handle_analytics,
+            'referral_click': self._handle_referral_clicks
+        }
+
+        by_kind = {}
+        for item_id, kind, payload, _ in claimed:
+            by_kind.setdefault(kind, []).append((item_id, payload))
+
+        processed = 0
+        for kind, items in by_kind.items():
+            handler = handlers.get(kind)
+            if handler is None:
+                # Неизвестный тип остается в очереди и после max_attempts перестает выдаваться
+                logger.error(f"Unknown ingest event kind: {kind}")
+                self.queue.release([item_id for item_id, _ in items])
+                continue
+
+            processed += self._process(kind, handler, items)
+
+        self.stats['processed'] += processed
+        self.stats['batches'] += 1
+        return processed
+
+    def run_forever(self, app):
+        """Обрабатывает очередь, пока процесс не остановлен"""
+        self.running = True
+        logger.info(f"Ingest worker started: queue {self.queue.path}, batch {self.batch_size}")
+
+        with app.app_context():
+            # Фильтры уникальности кликов строятся заранее, а не на первых кликах
+            from src.services.click_uniqueness import click_uniqueness
+            click_uniqueness.warm_up()
+
+            while self.running:
+                try:
+                    processed = self.run_once()
+                except Exception as e:
+                    logger.error(f"Ingest worker error: {str(e)}")
+                    processed = 0
+
+                # Пока очередь не пуста, пакеты забираются без паузы
+                if processed < self.batch_size:
+                    time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.running = False
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    from src.main import app
+
+    worker = IngestWorker()
+    try:
+        worker.run_forever(app)
+    except KeyboardInterrupt:
+        worker.stop()
+        logger.info(f"Ingest worker stopped: {worker.stats}")
+
+if __name__ == '__main__':
+    main()
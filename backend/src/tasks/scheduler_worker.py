@@ -0,0 +1,25 @@
+"""
+Отдельный процесс планировщика аналитических задач
+
+Запуск из каталога backend:
+    python -m src.tasks.scheduler_worker
+
+В веб-воркерах при этом следует выставить ANALYTICS_SCHEDULER_IN_WEB=false.
+Аренда задач в базе данных гарантирует, что даже при нескольких запущенных
+воркерах каждая задача выполняется один раз за период.
+"""
+import logging
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    
+    from src.main import app
+    from src.tasks.analytics_tasks import analytics_scheduler
+    
+    try:
+        analytics_scheduler.run_forever(app)
+    except KeyboardInterrupt:
+        analytics_scheduler.stop_scheduler()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.database import db
+
+@pytest.fixture
+def app(tmp_path):
+    """Приложение с файловой SQLite: блокировки записи как в рабочей базе"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 1}}
+    db.init_app(app)
+
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import json
+
+import pytest
+
+from src.tasks import analytics_backfill, analytics_tasks
+
+@pytest.fixture
+def processed_days(app, monkeypatch):
+    """Пул потоков вместо процессов; пересчет дня только запоминается"""
+    days = []
+
+    def run_manual_analytics(day):
+        if day == date(2025, 1, 3):
+            raise RuntimeError('broken day')
+        days.append(day)
+
+    monkeypatch.setattr(analytics_backfill, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(analytics_backfill, '_init_worker', lambda: None)
+    monkeypatch.setattr(analytics_backfill, '_worker_app', app)
+    monkeypatch.setattr(analytics_tasks, 'run_manual_analytics', run_manual_analytics)
+    return days
+
+def test_backfill_resumes_from_checkpoint(processed_days, tmp_path):
+    checkpoint = tmp_path / 'checkpoint.jsonl'
+    checkpoint.write_text(
+        json.dumps({'date': '2025-01-01', 'duration': 1.0}) + '\n' + '{"date": "2025-01-0',
+        encoding='utf-8'
+    )
+
+    summary = analytics_backfill.run_backfill(date(2025, 1, 1), date(2025, 1, 4), 2, str(checkpoint))
+
+    assert sorted(processed_days) == [date(2025, 1, 2), date(2025, 1, 4)]
+    assert (summary['processed'], summary['skipped'], summary['failed']) == (2, 1, ['2025-01-03'])
+    assert analytics_backfill.load_checkpoint(str(checkpoint)) == {'2025-01-01', '2025-01-02', '2025-01-04'}
+
+    # Повторный запуск пересчитывает только день с ошибкой
+    processed_days.clear()
+    summary = analytics_backfill.run_backfill(date(2025, 1, 1), date(2025, 1, 4), 2, str(checkpoint))
+    assert processed_days == []
+    assert (summary['processed'], summary['skipped'], summary['failed']) == (0, 3, ['2025-01-03'])
+
+def test_cli(processed_days, tmp_path, capsys):
+    checkpoint = tmp_path / 'checkpoint.jsonl'
+    checkpoint.write_text(json.dumps({'date': '2025-01-01', 'duration': 1.0}) + '\n', encoding='utf-8')
+
+    assert analytics_backfill.main([
+        '--start', '2025-01-01', '--end', '2025-01-02', '--workers', '1',
+        '--checkpoint', str(checkpoint), '--restart'
+    ]) == 0
+    assert sorted(processed_days) == [date(2025, 1, 1), date(2025, 1, 2)]
+    assert 'Обработано дней: 2' in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        analytics_backfill.main(['--start', '2025-01-02', '--end', '2025-01-01'])
@@ -0,0 +1,82 @@
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsEvent
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.routes import analytics as analytics_routes
+from src.routes.analytics import analytics_bp
+from src.services.analytics_buffer import AnalyticsWriteBuffer
+from src.services.analytics_service import AnalyticsService
+from src.services.ingest_queue import ingest_queue
+
+@pytest.fixture
+def client(app, monkeypatch):
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    db.create_all()
+    monkeypatch.setattr(ingest_queue, 'enabled', False)
+    return app.test_client()
+
+@pytest.fixture
+def buffer(app):
+    buffer = AnalyticsWriteBuffer()
+    buffer.enabled = True
+    yield buffer
+    buffer.shutdown()
+
+def event(name, session_id='s1'):
+    return {'session_id': session_id, 'event_type': 'custom', 'event_name': name}
+
+def test_sync_track_returns_event_id(client, monkeypatch):
+    monkeypatch.setattr(analytics_routes.analytics_buffer, 'enabled', False)
+
+    response = client.post('/api/analytics/track', json=event('signup'))
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert db.session.get(AnalyticsEvent, body['event_id']).event_name == 'signup'
+    assert 'queued' not in body
+
+def test_buffered_track_is_accepted_and_written(client, buffer, monkeypatch):
+    monkeypatch.setattr(analytics_routes, 'analytics_buffer', buffer)
+
+    response = client.post('/api/analytics/track', json=event('signup'))
+
+    assert response.status_code == 202
+    assert response.get_json() == {'success': True, 'session_id': 's1', 'queued': True}
+    buffer.shutdown()
+    assert AnalyticsEvent.query.filter_by(event_name='signup').count() == 1
+
+def test_full_buffer_rejects_with_retry_after(client, monkeypatch):
+    buffer = AnalyticsWriteBuffer()
+    buffer.enabled = True
+    monkeypatch.setattr(buffer, 'submit', lambda event: False)
+    monkeypatch.setattr(analytics_routes, 'analytics_buffer', buffer)
+
+    response = client.post('/api/analytics/track', json=event('signup'))
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_flush_counts_only_written_events(app, monkeypatch):
+    """Сбойное событие отбрасывается, flush возвращает число записанных"""
+    ingest_events = AnalyticsService.ingest_events
+
+    def failing_ingest(events):
+        if any(item['event_name'] == 'broken' for item in events):
+            raise ValueError('broken event')
+        return ingest_events(events)
+
+    db.create_all()
+    monkeypatch.setattr(AnalyticsService, 'ingest_events', staticmethod(failing_ingest))
+    buffer = AnalyticsWriteBuffer()
+    buffer.flush_size = 4
+    buffer._app = app
+    for name in ['a', 'b', 'broken', 'c', 'd']:
+        buffer._queue.put(event(name))
+
+    assert buffer.flush() == 4
+    assert buffer.stats['written'] == 4
+    assert buffer.stats['failed'] == 1
+    assert sorted(row.event_name for row in AnalyticsEvent.query) == ['a', 'b', 'c', 'd']
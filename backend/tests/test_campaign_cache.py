@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import event
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel
+from src.models.referral_link import ReferralLink  # noqa: F401
+from src.models.referral_step import ReferralStep
+from src.models.referral_tracking import ReferralTracking  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.services.campaign_cache import public_campaign_cache
+from src.services.code_allocator import code_allocator
+
+@pytest.fixture
+def tables(app):
+    db.create_all()
+    code_allocator._blocks.clear()
+    code_allocator._pending.clear()
+    public_campaign_cache.cache.clear()
+
+def create_campaign(title, channels_count):
+    campaign = ReferralCampaign(user_id=1, title=title, campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.flush()
+    for i in range(channels_count):
+        channel = ReferralChannel(
+            campaign_id=campaign.id, channel_type='telegram', channel_name=f'Channel {i}'
+        )
+        db.session.add(channel)
+        db.session.flush()
+        for order in (1, 2):
+            db.session.add(ReferralStep(
+                channel_id=channel.id, step_type='registration',
+                step_name=f'Step {order}', step_order=order
+            ))
+    db.session.commit()
+    return campaign.public_slug
+
+def count_statements(func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return result, len(statements)
+
+def test_public_page_query_count_does_not_depend_on_channels(tables):
+    """Страница кампании с 1 и с N каналами загружается одним числом запросов"""
+    small_slug = create_campaign('Small', 1)
+    large_slug = create_campaign('Large', 8)
+    db.session.expire_all()
+
+    small, small_queries = count_statements(lambda: public_campaign_cache._load(small_slug))
+    large, large_queries = count_statements(lambda: public_campaign_cache._load(large_slug))
+
+    assert len(small['channels']) == 1
+    assert len(large['channels']) == 8
+    assert all(channel['steps_count'] == 2 for channel in large['channels'])
+    assert small_queries == large_queries == 3
+
+def test_load_interleaved_with_update_is_not_cached(tables, monkeypatch):
+    """Данные, прочитанные до коммита изменения кампании, не остаются в кеше"""
+    slug = create_campaign('Campaign', 1)
+    campaign = ReferralCampaign.query.filter_by(public_slug=slug).one()
+    load = public_campaign_cache._load
+
+    def interleaved_load(key):
+        stale = load(key)
+        campaign.title = 'Renamed'
+        db.session.flush()
+        db.session.commit()
+        return stale
+
+    monkeypatch.setattr(public_campaign_cache, '_load', interleaved_load)
+    assert public_campaign_cache.get(slug)['title'] == 'Campaign'
+    monkeypatch.setattr(public_campaign_cache, '_load', load)
+
+    assert public_campaign_cache.get(slug)['title'] == 'Renamed'
+
+def test_step_change_resets_campaign_after_commit(tables):
+    """Изменение шага сбрасывает страницу кампании только после коммита"""
+    slug = create_campaign('Campaign', 1)
+    assert public_campaign_cache.get(slug)['channels'][0]['steps_count'] == 2
+
+    step = ReferralStep.query.filter_by(step_order=2).one()
+    step.is_active = False
+    db.session.flush()
+    assert public_campaign_cache.get(slug)['channels'][0]['steps_count'] == 2
+
+    db.session.commit()
+    assert public_campaign_cache.get(slug)['channels'][0]['steps_count'] == 1
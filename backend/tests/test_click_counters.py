@@ -0,0 +1,154 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.referral_tracking import ReferralTracking  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.services.click_counters import ClickCounterAggregator
+
+@pytest.fixture
+def rows(app):
+    db.create_all()
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.flush()
+    channel = ReferralChannel(campaign_id=campaign.id, channel_name='Channel', channel_type='website')
+    db.session.add(channel)
+    db.session.flush()
+    links = [
+        ReferralLink(campaign_id=campaign.id, channel_id=channel.id, user_id=1, link_name=f'Link {index}')
+        for index in range(2)
+    ]
+    db.session.add_all(links)
+    db.session.commit()
+    return campaign.id, channel.id, [link.id for link in links]
+
+@pytest.fixture
+def counters():
+    counters = ClickCounterAggregator()
+    counters.enabled = True
+    counters.flush_interval = 60
+    yield counters
+    counters._stopping.set()
+    counters._flush_requested.set()
+    if counters._thread is not None:
+        counters._thread.join(5)
+
+def totals(rows):
+    campaign_id, channel_id, link_ids = rows
+    db.session.expire_all()
+    links = [db.session.get(ReferralLink, link_id) for link_id in link_ids]
+    return (
+        [(link.total_clicks or 0, link.unique_clicks or 0) for link in links],
+        db.session.get(ReferralChannel, channel_id).total_clicks or 0,
+        db.session.get(ReferralCampaign, campaign_id).total_clicks or 0
+    )
+
+def test_concurrent_clicks_are_coalesced(app, rows, counters):
+    campaign_id, channel_id, link_ids = rows
+
+    def click(link_id):
+        with app.app_context():
+            for _ in range(100):
+                counters.add(link_id, campaign_id, channel_id, unique=1, last_clicked_at=datetime.utcnow())
+
+    threads = [threading.Thread(target=click, args=(link_ids[index % 2],)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert totals(rows) == ([(0, 0), (0, 0)], 0, 0)
+    assert counters.pending_total(link_ids[0]) == 200
+    assert counters.get_stats()['pending_clicks'] == 400
+
+    updates = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.startswith('UPDATE'):
+            updates.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        assert counters.flush() == 4
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    # Один UPDATE на таблицу независимо от числа кликов и ссылок
+    assert len(updates) == 3
+    assert totals(rows) == ([(200, 200), (200, 200)], 400, 400)
+    assert counters.pending_total(link_ids[0]) == 0
+    assert counters.flush() == 0
+
+def test_increments_are_added_to_stored_counters(rows, counters):
+    campaign_id, channel_id, link_ids = rows
+    later = datetime.utcnow()
+    link = db.session.get(ReferralLink, link_ids[0])
+    link.total_clicks, link.last_clicked_at = 10, later
+    db.session.commit()
+
+    counters.add(link_ids[0], campaign_id, channel_id, total=3, unique=2, last_clicked_at=later - timedelta(hours=1))
+    counters.flush()
+
+    db.session.expire_all()
+    link = db.session.get(ReferralLink, link_ids[0])
+    assert (link.total_clicks, link.unique_clicks) == (13, 2)
+    # Время последнего клика не уменьшается
+    assert link.last_clicked_at == later
+
+def test_failed_flush_keeps_increments(rows, counters, monkeypatch):
+    campaign_id, channel_id, link_ids = rows
+    counters.add(link_ids[0], campaign_id, channel_id, total=2)
+
+    def failing_write(*args):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(counters, '_write', failing_write)
+    assert counters.flush() == 0
+    assert counters.stats['failed'] == 1
+    assert counters.pending_total(link_ids[0]) == 2
+
+    monkeypatch.undo()
+    counters.add(link_ids[0], campaign_id, channel_id)
+    counters.flush()
+    assert totals(rows) == ([(3, 0), (0, 0)], 3, 3)
+
+def test_disabled_coalescing_writes_immediately(rows, counters):
+    campaign_id, channel_id, link_ids = rows
+    counters.enabled = False
+
+    counters.add(link_ids[1], campaign_id, total=2, unique=1)
+
+    assert counters._thread is None
+    assert totals(rows) == ([(0, 0), (2, 1)], 0, 2)
+
+def test_click_threshold_wakes_flush_thread(app, rows, counters):
+    campaign_id, channel_id, link_ids = rows
+    counters.flush_clicks = 5
+
+    for _ in range(5):
+        counters.add(link_ids[0], campaign_id, channel_id)
+
+    deadline = time.monotonic() + 5
+    while counters.stats['flushes'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert totals(rows) == ([(5, 0), (0, 0)], 5, 5)
+
+def test_shutdown_writes_pending_clicks(rows, counters):
+    campaign_id, channel_id, link_ids = rows
+    counters.add(link_ids[0], campaign_id, channel_id)
+
+    counters.shutdown(timeout=5)
+
+    assert not counters._thread.is_alive()
+    assert totals(rows) == ([(1, 0), (0, 0)], 1, 1)
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.referral_tracking import ReferralTracking
+from src.models.user import User  # noqa: F401
+from src.services.bloom_filter import BloomFilter
+from src.services.click_uniqueness import ClickUniquenessIndex
+from src.services.code_allocator import code_allocator
+
+@pytest.fixture
+def link(app):
+    db.create_all()
+    code_allocator._blocks.clear()
+    code_allocator._pending.clear()
+
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.flush()
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link')
+    db.session.add(link)
+    db.session.commit()
+    return link
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setenv('CLICK_BLOOM_SYNC_INTERVAL', '0')
+    return ClickUniquenessIndex()
+
+def insert_click(link, click_hash, **values):
+    db.session.execute(ReferralTracking.__table__.insert().values(
+        campaign_id=link.campaign_id, link_id=link.id, event_type='click',
+        click_hash=click_hash, created_at=datetime.utcnow(), **values
+    ))
+    db.session.commit()
+
+def test_existing_clicks_are_found(link, index):
+    insert_click(link, 'a' * 64)
+    existing = index.find_existing([(link.id, 'a' * 64), (link.id, 'b' * 64)])
+    assert existing == {(link.id, 'a' * 64)}
+    assert index.stats['negatives'] == 1
+
+def test_false_positive_is_checked_in_database(link, index, monkeypatch):
+    """Положительный ответ фильтра подтверждается запросом к базе"""
+    monkeypatch.setattr(BloomFilter, '__contains__', lambda self, digest: True)
+
+    assert index.find_existing([(link.id, 'c' * 64)]) == set()
+    assert index.stats['possible_positives'] == 1
+    assert index.stats['false_positives'] == 1
+
+def test_sync_picks_up_clicks_from_other_processes(link, index):
+    insert_click(link, 'a' * 64)
+    assert index.find_existing([(link.id, 'b' * 64)]) == set()
+
+    insert_click(link, 'b' * 64)  # записан другим процессом
+    assert index.find_existing([(link.id, 'b' * 64)]) == {(link.id, 'b' * 64)}
+
+def test_sync_picks_up_late_commit_with_lower_id(link, index):
+    """Строка с меньшим id, закоммиченная после большего, не теряется"""
+    insert_click(link, 'a' * 64, id=10)
+    assert index.find_existing([(link.id, 'b' * 64)]) == set()
+    assert index._high_water_mark == 10
+
+    insert_click(link, 'b' * 64, id=5)
+    index._filters[link.id].count = 0
+    assert index.find_existing([(link.id, 'b' * 64)]) == {(link.id, 'b' * 64)}
+    assert index.stats['negatives'] == 1
+
+    # Повторно прочитанные клики из окна перекрытия фильтр не дублирует
+    index.find_existing([(link.id, 'c' * 64)])
+    assert index._filters[link.id].count == 1
+
+def test_sync_window_bounds_rescan(link, index):
+    """Строки ниже отметки id старше окна перекрытия повторно не читаются
+
+    Это граница погрешности из описания ClickUniquenessIndex: транзакция,
+    закоммиченная позже CLICK_BLOOM_SYNC_OVERLAP секунд после created_at.
+    """
+    insert_click(link, 'a' * 64, id=10)
+    index.find_existing([(link.id, 'b' * 64)])
+
+    old = datetime.utcnow() - timedelta(seconds=index.sync_overlap + 60)
+    db.session.execute(ReferralTracking.__table__.insert().values(
+        id=5, campaign_id=link.campaign_id, link_id=link.id, event_type='click',
+        click_hash='b' * 64, created_at=old
+    ))
+    db.session.commit()
+
+    assert index.find_existing([(link.id, 'b' * 64)]) == set()
+    assert 'b' * 64 not in index._filters[link.id]
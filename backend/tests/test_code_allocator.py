@@ -0,0 +1,70 @@
+import pytest
+
+from src.database import db
+from src.models.code_sequence import CodeSequence
+from src.models.project import Project
+from src.models.reference import Reference
+from src.models.user import User
+from src.services.code_allocator import code_allocator
+
+@pytest.fixture(autouse=True)
+def tables(app):
+    db.metadata.create_all(db.engine, tables=[
+        User.__table__, Project.__table__, Reference.__table__, CodeSequence.__table__
+    ])
+    # Блоки процесса от предыдущих тестов относятся к другой базе
+    code_allocator._blocks.clear()
+    code_allocator._pending.clear()
+
+def test_allocate_with_pending_update(app):
+    """Код выдается, когда сессия уже держит блокировку записи"""
+    project = Project(title='Project', user_id=1)
+    db.session.add(project)
+    db.session.commit()
+
+    project.is_public = True
+    project.generate_public_slug()  # autoflush UPDATE берет блокировку записи
+    project.generate_short_code()
+    db.session.commit()
+
+    assert db.session.get(Project, project.id).short_code == project.short_code
+
+def test_rolled_back_codes_are_not_reused(app):
+    """Блок резервируется своей транзакцией: откат сессии номера не возвращает"""
+    rolled_back = set(code_allocator.allocate('project', 3))
+    db.session.rollback()
+    first = set(code_allocator.allocate('project', 3))
+    db.session.commit()
+    second = set(code_allocator.allocate('project', code_allocator.block_size))
+    db.session.commit()
+
+    assert not rolled_back & first
+    assert not (rolled_back | first) & second
+    assert db.session.get(CodeSequence, 'project').next_value == 2 * code_allocator.block_size
+
+def test_savepoint_rollback_discards_block(app):
+    """Блок из отката до SAVEPOINT не выдается: его номера вернулись в счетчик"""
+    db.session.add(User(email='user@example.com', password_hash='x', first_name='A', last_name='B'))
+    db.session.flush()  # транзакция записи SQLite: блок резервируется в ней
+
+    savepoint = db.session.begin_nested()
+    code_allocator.allocate('project')
+    savepoint.rollback()
+
+    codes = code_allocator.allocate('project', 2 * code_allocator.block_size)
+    db.session.commit()
+
+    assert len(set(codes)) == len(codes)
+    assert db.session.get(CodeSequence, 'project').next_value == 2 * code_allocator.block_size
+
+def test_block_reserved_outside_savepoint_survives_release(app):
+    """Коммит SAVEPOINT не делает блок общим до коммита всей транзакции"""
+    db.session.add(User(email='user@example.com', password_hash='x', first_name='A', last_name='B'))
+    db.session.flush()
+
+    with db.session.begin_nested():
+        code_allocator.allocate('project')
+    assert 'project' not in code_allocator._blocks
+
+    db.session.commit()
+    assert code_allocator._blocks['project'] == [1, code_allocator.block_size]
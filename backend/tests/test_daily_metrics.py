@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsMetric
+from src.models.project import Project
+from src.models.reference import Reference
+from src.models.user import User
+from src.services.analytics_service import AnalyticsService
+
+MOBILE = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) Mobile/15E148 Safari/604.1'
+DESKTOP = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/126.0.0.0 Safari/537.36'
+
+@pytest.fixture
+def day(app):
+    db.create_all()
+    day = datetime.utcnow().date() - timedelta(days=1)
+    noon = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+
+    old = noon - timedelta(days=10)
+    db.session.add_all([
+        User(id=1, email='old@example.com', password_hash='x', first_name='A', last_name='A', created_at=old),
+        User(id=2, email='new@example.com', password_hash='x', first_name='B', last_name='B', created_at=noon),
+        User(id=3, email='late@example.com', password_hash='x', first_name='C', last_name='C',
+             created_at=noon + timedelta(days=1)),
+        Project(id=1, title='Old', user_id=1, created_at=old),
+        Project(id=2, title='New', user_id=2, created_at=noon),
+        Reference(title='Ref', project_id=1, created_at=noon),
+    ])
+    db.session.commit()
+
+    events = [
+        (1, 'page_view', MOBILE, noon),
+        (1, 'page_view', MOBILE, noon),
+        (2, 'project_view', DESKTOP, noon),
+        (None, 'signup_click', DESKTOP, noon),
+        (2, 'page_view', DESKTOP, noon + timedelta(days=1)),  # следующий день
+    ]
+    AnalyticsService.ingest_events([
+        AnalyticsService.enrich_event({
+            'user_id': user_id, 'session_id': f's{index}', 'event_type': name, 'event_name': name,
+            'project_id': 1 if name == 'project_view' else None,
+            'user_agent': user_agent, 'created_at': created_at
+        })
+        for index, (user_id, name, user_agent, created_at) in enumerate(events)
+    ])
+    return day
+
+def daily_metrics(day):
+    rows = AnalyticsMetric.query.filter_by(
+        metric_type='daily', date=datetime.combine(day, datetime.min.time())
+    ).all()
+    return {row.metric_name: row for row in rows}
+
+def test_daily_metrics(day):
+    assert AnalyticsService.calculate_daily_metrics(day) == 4
+
+    metrics = daily_metrics(day)
+    assert {name: row.value for name, row in metrics.items() if name != 'events_by_device'} == {
+        'total_events': 4, 'unique_users': 2, 'page_views': 2, 'project_views': 1,
+        'new_users': 1, 'new_projects': 1,
+        'total_users': 2, 'total_projects': 2, 'total_references': 1,
+    }
+    assert metrics['events_by_device'].extra_data == {'mobile': 2, 'desktop': 2}
+
+def test_recalculation_updates_rows_in_place(day):
+    AnalyticsService.calculate_daily_metrics(day)
+    rows_before = AnalyticsMetric.query.count()
+
+    db.session.add(User(id=4, email='x@example.com', password_hash='x', first_name='D', last_name='D',
+                        created_at=datetime.combine(day, datetime.min.time())))
+    db.session.commit()
+    AnalyticsService.calculate_daily_metrics(day)
+
+    assert AnalyticsMetric.query.count() == rows_before
+    assert daily_metrics(day)['new_users'].value == 2
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask_jwt_extended import JWTManager, create_access_token
+
+from src.database import db
+from src.models.analytics_event import AnalyticsEvent, AnalyticsHourlyCounter
+from src.models.project import Project
+from src.models.reference import Reference
+from src.models.referral_campaign import ReferralCampaign  # noqa: F401
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink  # noqa: F401
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.user import User
+from src.routes.analytics import analytics_bp, dashboard_cache
+from src.services.analytics_service import AnalyticsService, PROJECT_METRICS_JOB_NAME
+from src.tasks.analytics_tasks import AnalyticsTasks
+
+MOBILE = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) Mobile/15E148 Safari/604.1'
+DESKTOP = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/126.0.0.0 Safari/537.36'
+
+@pytest.fixture
+def yesterday(app):
+    db.create_all()
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    yesterday = today - timedelta(days=1)
+    old = today - timedelta(days=20)
+
+    db.session.add_all([
+        User(id=1, email='admin@example.com', password_hash='x', first_name='A', last_name='A',
+             is_admin=True, created_at=old),
+        User(id=2, email='new@example.com', password_hash='x', first_name='B', last_name='B',
+             created_at=yesterday + timedelta(hours=9)),
+        Project(id=1, title='Old', user_id=1, created_at=old),
+        Project(id=2, title='New', user_id=2, created_at=yesterday + timedelta(hours=10)),
+        Reference(title='Ref', project_id=1, created_at=old),
+    ])
+    db.session.commit()
+
+    events = [
+        (1, 'page_view', None, MOBILE, yesterday + timedelta(hours=8)),
+        (2, 'project_view', 2, DESKTOP, yesterday + timedelta(hours=11)),
+        (2, 'project_view', 2, DESKTOP, yesterday + timedelta(hours=12)),
+        (1, 'project_view', 1, DESKTOP, yesterday + timedelta(hours=13)),
+        (1, 'project_view', 1, MOBILE, today + timedelta(minutes=1)),
+        (1, 'project_view', 1, MOBILE, today + timedelta(minutes=2)),
+        (None, 'signup_click', None, DESKTOP, today + timedelta(minutes=3)),
+    ]
+    AnalyticsService.ingest_events([
+        AnalyticsService.enrich_event({
+            'user_id': user_id, 'session_id': f's{index}', 'event_type': name, 'event_name': name,
+            'project_id': project_id, 'user_agent': user_agent, 'created_at': created_at
+        })
+        for index, (user_id, name, project_id, user_agent, created_at) in enumerate(events)
+    ])
+    return yesterday.date()
+
+def test_rollups_give_the_same_summary_as_live_counters(yesterday):
+    live = AnalyticsService.get_dashboard_summary(1)
+
+    AnalyticsTasks().run_manual_calculation(yesterday)
+    rolled_up = AnalyticsService.get_dashboard_summary(1)
+
+    assert rolled_up == live
+    assert live['overview'] == {
+        'total_users': 2, 'total_projects': 2, 'total_references': 1,
+        'active_users': 2, 'new_users': 1, 'new_projects': 1
+    }
+    assert [(day['events'], day['users']) for day in live['daily_activity']] == [(4, 2), (3, 1)]
+    assert [(project['id'], project['views']) for project in live['top_projects']] == [(1, 3), (2, 2)]
+    assert {device['type']: device['count'] for device in live['devices']} == {'mobile': 3, 'desktop': 4}
+
+def test_completed_days_are_read_from_rollups(yesterday):
+    # Окно в один день: агрегаты есть за все его завершенные дни
+    AnalyticsTasks().run_manual_calculation(yesterday)
+    expected = AnalyticsService.get_dashboard_summary(1)
+
+    # Сырые данные завершенного дня больше не нужны для дашборда
+    day_start = datetime.combine(yesterday, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    AnalyticsHourlyCounter.query.filter(
+        AnalyticsHourlyCounter.hour >= day_start, AnalyticsHourlyCounter.hour < day_end
+    ).delete()
+    AnalyticsEvent.query.filter(
+        AnalyticsEvent.created_at >= day_start, AnalyticsEvent.created_at < day_end
+    ).delete()
+    db.session.commit()
+
+    assert AnalyticsService.get_dashboard_summary(1) == expected
+
+def test_totals_add_rows_created_after_the_snapshot(yesterday):
+    AnalyticsTasks().run_manual_calculation(yesterday)
+    db.session.add(User(id=3, email='today@example.com', password_hash='x', first_name='C', last_name='C'))
+    db.session.add(Project(id=3, title='Today', user_id=3))
+    db.session.commit()
+
+    overview = AnalyticsService.get_dashboard_summary(1)['overview']
+
+    assert (overview['total_users'], overview['new_users']) == (3, 2)
+    assert (overview['total_projects'], overview['new_projects']) == (3, 2)
+
+def test_project_views_stay_live_until_project_metrics_run(yesterday):
+    tasks = AnalyticsTasks()
+    tasks._run_recorded('daily_metrics', tasks.calculate_daily_metrics, yesterday)
+
+    top_projects = AnalyticsService.get_dashboard_summary(1)['top_projects']
+    assert [(project['id'], project['views']) for project in top_projects] == [(1, 3), (2, 2)]
+
+    tasks._run_recorded(PROJECT_METRICS_JOB_NAME, tasks.calculate_all_project_metrics, yesterday)
+    assert AnalyticsService.get_dashboard_summary(1)['top_projects'] == top_projects
+
+def test_dashboard_route_is_cached_per_days(app, yesterday, monkeypatch):
+    app.config['JWT_SECRET_KEY'] = 'test-jwt-secret-key-with-32-bytes!'
+    JWTManager(app)
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    dashboard_cache.clear()
+
+    calls = []
+    summary = AnalyticsService.get_dashboard_summary
+
+    def counting_summary(days):
+        calls.append(days)
+        return summary(days)
+
+    monkeypatch.setattr(AnalyticsService, 'get_dashboard_summary', staticmethod(counting_summary))
+    client = app.test_client()
+    headers = {'Authorization': f"Bearer {create_access_token(identity='1')}"}
+
+    first = client.get('/api/analytics/dashboard?days=7', headers=headers)
+    second = client.get('/api/analytics/dashboard?days=7', headers=headers)
+    client.get('/api/analytics/dashboard?days=30', headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.get_json() == second.get_json()
+    assert calls == [7, 30]
+
+    denied = client.get('/api/analytics/dashboard', headers={
+        'Authorization': f"Bearer {create_access_token(identity='2')}"
+    })
+    assert denied.status_code == 403
+    dashboard_cache.clear()
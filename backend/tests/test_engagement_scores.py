@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsEvent, AnalyticsMetric
+from src.models.project import Project
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User
+from src.services.analytics_service import AnalyticsService
+
+@pytest.fixture
+def activity(app):
+    db.create_all()
+    now = datetime.utcnow()
+    old = now - timedelta(days=60)
+
+    db.session.add_all([
+        User(id=user_id, email=f'u{user_id}@example.com', password_hash='x', first_name='U', last_name='U')
+        for user_id in range(1, 6)
+    ])
+    # 1: 10 событий в 2 сессиях и проект -> 1 + 4 + 10
+    db.session.add_all([
+        AnalyticsEvent(user_id=1, session_id=f's1-{index % 2}', event_type='page_view',
+                       event_name='page_view', created_at=now - timedelta(hours=1))
+        for index in range(10)
+    ])
+    db.session.add(Project(title='One', user_id=1, created_at=now))
+    # 2: много проектов -> показатель ограничен 100
+    db.session.add_all([Project(title=f'Two {index}', user_id=2, created_at=now) for index in range(11)])
+    # 3: активность только за пределами окна
+    db.session.add(AnalyticsEvent(user_id=3, session_id='s3', event_type='page_view',
+                                  event_name='page_view', created_at=old))
+    db.session.add(Project(title='Three', user_id=3, created_at=old))
+    # 4: только проект
+    db.session.add(Project(title='Four', user_id=4, created_at=now))
+    db.session.commit()
+
+def engagement_metrics():
+    return {
+        metric.user_id: metric.value
+        for metric in AnalyticsMetric.query.filter_by(metric_type='engagement', metric_name='engagement_score')
+    }
+
+def test_scores_for_active_users(activity):
+    ids, scores = AnalyticsService.calculate_engagement_scores(persist=False)
+
+    assert dict(zip(ids.tolist(), scores.tolist())) == {1: 15.0, 2: 100.0, 4: 10.0}
+    assert engagement_metrics() == {}
+
+def test_explicit_users_get_zero_without_activity(activity):
+    ids, scores = AnalyticsService.calculate_engagement_scores([4, 3, 1, 5], persist=False)
+
+    assert ids.tolist() == [1, 3, 4, 5]
+    assert scores.tolist() == [15.0, 0.0, 10.0, 0.0]
+
+def test_chunking_does_not_change_scores(activity):
+    _, whole = AnalyticsService.calculate_engagement_scores([1, 2, 3, 4], persist=False)
+    _, chunked = AnalyticsService.calculate_engagement_scores([1, 2, 3, 4], persist=False, chunk_size=1)
+
+    assert chunked.tolist() == whole.tolist()
+
+def test_scores_are_persisted_once_per_day(activity):
+    AnalyticsService.calculate_engagement_scores(chunk_size=2)
+    db.session.add(Project(title='One more', user_id=1, created_at=datetime.utcnow()))
+    db.session.commit()
+    AnalyticsService.calculate_engagement_scores(chunk_size=2)
+
+    assert engagement_metrics() == {1: 25.0, 2: 100.0, 4: 10.0}
+
+def test_single_user_score(activity):
+    assert AnalyticsService.get_user_engagement_score(1) == 15.0
+    assert AnalyticsService.get_user_engagement_score(5) == 0.0
+    assert AnalyticsService.get_user_engagement_score(3, days=90) == 12.1
@@ -0,0 +1,134 @@
+import random
+
+import pytest
+
+from src.services import geoip_service
+from src.services.geoip_service import GeoIPDatabase, GeoLocation, compile_geoip_csv, ip_to_int
+from src.tasks import build_geoip_db
+
+CSV = """start_ip,end_ip,country,city
+# комментарий
+10.0.0.0,10.0.0.255,DE,Berlin
+10.0.2.0,10.0.3.255,FR,Paris
+167772416,167772671,DE,Berlin
+192.168.0.0,192.168.255.255,US,
+2001:db8::,2001:db8::ffff,NL,Amsterdam
+"""
+
+@pytest.fixture
+def database_path(tmp_path):
+    csv_path = tmp_path / 'ranges.csv'
+    csv_path.write_text(CSV, encoding='utf-8')
+    path = tmp_path / 'geoip.bin'
+    assert compile_geoip_csv(csv_path, path) == 4
+    return path
+
+@pytest.fixture
+def service(database_path, monkeypatch):
+    monkeypatch.setattr(geoip_service, 'GEOIP_DB_PATH', str(database_path))
+    geoip_service.reload_database()
+    yield geoip_service
+    monkeypatch.undo()
+    geoip_service.reload_database()
+
+def test_lookup_range_boundaries(database_path):
+    database = GeoIPDatabase(database_path)
+
+    def lookup(ip):
+        return database.lookup(ip_to_int(ip))
+
+    try:
+        berlin = GeoLocation('DE', 'Berlin')
+
+        assert database.ranges_count == 4
+        assert lookup('9.255.255.255') is None
+        assert lookup('10.0.0.0') == lookup('10.0.0.255') == berlin
+        # Диапазон из числовых адресов - 10.0.1.0-10.0.1.255, место хранится один раз
+        assert lookup('10.0.1.7') == berlin
+        assert len(database.locations) == 3
+        assert lookup('10.0.3.255') == GeoLocation('FR', 'Paris')
+        assert lookup('10.0.4.0') is None
+        assert lookup('192.168.10.1') == GeoLocation('US', None)
+        assert lookup('255.255.255.255') is None
+    finally:
+        database.close()
+
+def test_bisect_matches_linear_scan(tmp_path):
+    rng = random.Random(3)
+    bounds = sorted(rng.sample(range(2 ** 32), 2000))
+    ranges = [(start, end, f'C{index % 7}') for index, (start, end) in enumerate(zip(bounds[::2], bounds[1::2]))]
+    csv_path = tmp_path / 'random.csv'
+    csv_path.write_text(''.join(f'{start},{end},{country},\n' for start, end, country in ranges))
+    compile_geoip_csv(csv_path, tmp_path / 'random.bin')
+
+    probes = [rng.randrange(2 ** 32) for _ in range(2000)]
+    probes += [value for start, end, _ in ranges[:100] for value in (start - 1, start, end, end + 1)]
+
+    database = GeoIPDatabase(tmp_path / 'random.bin')
+    try:
+        for ip in probes:
+            expected = next((country for start, end, country in ranges if start <= ip <= end), None)
+            location = database.lookup(ip)
+            assert (location.country if location else None) == expected
+    finally:
+        database.close()
+
+def test_overlapping_ranges_are_rejected(tmp_path):
+    csv_path = tmp_path / 'overlap.csv'
+    csv_path.write_text('10.0.0.0,10.0.0.255,DE,\n10.0.0.128,10.0.1.0,FR,\n')
+
+    with pytest.raises(ValueError):
+        compile_geoip_csv(csv_path, tmp_path / 'overlap.bin')
+    assert not (tmp_path / 'overlap.bin').exists()
+
+def test_invalid_file_is_rejected(tmp_path):
+    path = tmp_path / 'broken.bin'
+    path.write_bytes(b'\0' * 64)
+
+    with pytest.raises(ValueError):
+        GeoIPDatabase(path)
+
+def test_lookup_ip_is_cached(service):
+    assert service.lookup_ip('10.0.2.1') == GeoLocation('FR', 'Paris')
+    assert service.lookup_ip('10.0.2.1') == GeoLocation('FR', 'Paris')
+    assert service.lookup_ip('2001:db8::1') is None
+    assert service.lookup_ip('not an ip') is None
+    assert service.lookup_ip(None) is None
+
+    stats = service.get_cache_stats()
+    assert (stats['hits'], stats['misses']) == (1, 3)
+    assert stats['database_loaded']
+
+def test_reload_picks_up_rebuilt_database(service, database_path, tmp_path):
+    assert service.lookup_ip('10.0.0.1') == GeoLocation('DE', 'Berlin')
+
+    csv_path = tmp_path / 'updated.csv'
+    csv_path.write_text('10.0.0.0,10.0.0.255,AT,Vienna\n')
+    compile_geoip_csv(csv_path, database_path)
+    service.reload_database()
+
+    assert service.lookup_ip('10.0.0.1') == GeoLocation('AT', 'Vienna')
+
+def test_missing_database_disables_lookup(tmp_path, monkeypatch):
+    monkeypatch.setattr(geoip_service, 'GEOIP_DB_PATH', str(tmp_path / 'missing.bin'))
+    geoip_service.reload_database()
+    try:
+        assert geoip_service.lookup_ip('10.0.0.1') is None
+        assert not geoip_service.get_cache_stats()['database_loaded']
+    finally:
+        monkeypatch.undo()
+        geoip_service.reload_database()
+
+def test_build_command(tmp_path, capsys):
+    csv_path = tmp_path / 'ranges.csv'
+    csv_path.write_text(CSV, encoding='utf-8')
+    output_path = tmp_path / 'data' / 'geoip.bin'
+
+    assert build_geoip_db.main([str(csv_path), str(output_path)]) == 0
+
+    assert 'Диапазонов: 4' in capsys.readouterr().out
+    database = GeoIPDatabase(output_path)
+    try:
+        assert database.lookup(ip_to_int('10.0.3.0')) == GeoLocation('FR', 'Paris')
+    finally:
+        database.close()
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsHourlyCounter
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.services.analytics_service import AnalyticsService
+
+@pytest.fixture
+def day(app):
+    db.create_all()
+    return datetime.combine(datetime.utcnow().date() - timedelta(days=1), datetime.min.time())
+
+def event(name, created_at, **values):
+    return dict({'session_id': 's', 'event_type': 'custom', 'event_name': name, 'created_at': created_at}, **values)
+
+def counters():
+    return {
+        (row.hour, row.event_name, row.project_id, row.device_type): row.count
+        for row in AnalyticsHourlyCounter.query
+    }
+
+def test_counters_accumulate_across_batches(day):
+    ten, eleven = day + timedelta(hours=10, minutes=5), day + timedelta(hours=11, minutes=59)
+    AnalyticsService.ingest_events([
+        event('page_view', ten, device_type='mobile'),
+        event('page_view', ten + timedelta(minutes=30), device_type='mobile'),
+        event('project_view', eleven, project_id=3, device_type='desktop'),
+    ])
+    AnalyticsService.ingest_events([event('page_view', ten, device_type='mobile')])
+
+    assert counters() == {
+        (day + timedelta(hours=10), 'page_view', 0, 'mobile'): 3,
+        (day + timedelta(hours=11), 'project_view', 3, 'desktop'): 1,
+    }
+
+def test_rebuild_matches_raw_events(day):
+    AnalyticsService.ingest_events([
+        event('page_view', day + timedelta(hours=hour), device_type='mobile') for hour in (1, 1, 2)
+    ])
+    expected = counters()
+
+    # Счетчик разошелся с событиями (например, потерянное обновление)
+    AnalyticsHourlyCounter.query.update({'count': 100})
+    db.session.add(AnalyticsHourlyCounter(hour=day + timedelta(hours=5), event_name='stale', count=1))
+    db.session.commit()
+
+    assert AnalyticsService.rebuild_hourly_counters(day.date()) == 2
+    assert counters() == expected
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask_jwt_extended import JWTManager, create_access_token
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User
+from src.routes.analytics import analytics_bp
+from src.services.analytics_service import AnalyticsService
+from src.services.hyperloglog import HyperLogLog
+
+def test_estimate_is_within_error():
+    sketch = HyperLogLog(precision=12).update(range(50000))
+    assert abs(sketch.count() - 50000) <= 3 * sketch.relative_error * 50000
+
+def test_small_cardinality_is_exact():
+    assert HyperLogLog().update(['a', 'b', 'c', 'a']).count() == 3
+
+def test_merge_equals_union():
+    first = HyperLogLog(precision=12).update(range(0, 30000))
+    second = HyperLogLog(precision=12).update(range(20000, 50000))
+    union = HyperLogLog(precision=12).update(range(50000))
+
+    assert first.merge(second).registers == union.registers
+
+def test_merge_requires_same_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=12).merge(HyperLogLog(precision=14))
+
+def test_serialization_roundtrip():
+    sketch = HyperLogLog(precision=11).update(range(1000))
+    restored = HyperLogLog.from_bytes(sketch.to_bytes(), 11)
+    assert restored.registers == sketch.registers
+
+@pytest.fixture
+def tables(app):
+    db.create_all()
+
+def ingest(user_ids, created_at):
+    AnalyticsService.ingest_events([
+        {'user_id': user_id, 'session_id': f's{user_id}', 'event_type': 'custom',
+         'event_name': 'open', 'created_at': created_at}
+        for user_id in user_ids
+    ])
+
+def test_unique_counts_merge_daily_sketches(tables):
+    today = datetime.utcnow().replace(hour=12)
+    yesterday = today - timedelta(days=1)
+    ingest(range(1, 11), yesterday)
+    ingest(range(6, 21), today)
+    ingest(range(6, 11), today)  # повтор тех же пользователей
+
+    total, daily = AnalyticsService.get_unique_counts('active_users', yesterday)
+
+    assert total == 20
+    assert daily == {yesterday.date(): 10, today.date(): 15}
+
+def test_user_analytics_route(app, tables):
+    app.config['JWT_SECRET_KEY'] = 'test-jwt-secret-key-with-32-bytes!'
+    JWTManager(app)
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    admin = User(email='admin@example.com', password_hash='x', first_name='A', last_name='B', is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    ingest([admin.id, 2, 3], datetime.utcnow())
+
+    token = create_access_token(identity=str(admin.id))
+    response = app.test_client().get('/api/analytics/users', headers={'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['segments']['active_users'] == 3
+    assert body['segments']['new_users'] == 1
+    assert body['daily_registrations'][0]['registrations'] == 1
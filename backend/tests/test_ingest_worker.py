@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytest
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep
+from src.models.referral_tracking import ReferralTracking
+from src.models.user import User
+from src.services.click_counters import click_counters
+from src.services.ingest_queue import IngestQueue
+from src.tasks.ingest_worker import IngestWorker
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = IngestQueue()
+    queue.configure(path=str(tmp_path / 'ingest_queue.db'), enabled=True)
+    queue.max_attempts = 2
+    return queue
+
+@pytest.fixture
+def link(app, monkeypatch):
+    db.create_all()
+    # Счетчики ссылок пишутся сразу, без фонового потока
+    monkeypatch.setattr(click_counters, 'enabled', False)
+
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.commit()
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link')
+    db.session.add(link)
+    db.session.commit()
+    return link
+
+def click(link, index, created_at=None):
+    return {
+        'link_id': link.id,
+        'campaign_id': link.campaign_id,
+        'ip_address': f'10.0.0.{index}',
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0',
+        'created_at': created_at or datetime.utcnow().isoformat()
+    }
+
+def test_bad_payload_does_not_fail_batch(queue, link):
+    """Событие с ошибкой возвращается в очередь одно, остальные записываются"""
+    queue.enqueue_many('referral_click', [click(link, index) for index in range(6)])
+    queue.enqueue('referral_click', click(link, 99, created_at='not a date'))
+    queue.enqueue_many('referral_click', [click(link, index) for index in range(6, 10)])
+
+    worker = IngestWorker(queue)
+    assert worker.run_once() == 10
+    assert worker.stats['failed'] == 1
+    assert ReferralTracking.query.count() == 10
+    assert db.session.get(ReferralLink, link.id).total_clicks == 10
+
+    # После max_attempts событие остается в очереди, но больше не выдается
+    assert worker.run_once() == 0
+    assert worker.run_once() == 0
+    assert queue.get_stats()['pending'] == 0
+    assert queue.get_stats()['dead'] == 1
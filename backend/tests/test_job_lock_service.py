@@ -0,0 +1,131 @@
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign  # noqa: F401
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink  # noqa: F401
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.scheduled_job import JobLock, JobRun
+from src.models.user import User  # noqa: F401
+from src.services import job_lock_service as job_lock_module
+from src.services.job_lock_service import JobLockService
+from src.tasks.analytics_tasks import AnalyticsTasks
+
+PERIOD = date(2024, 3, 1)
+
+def make_service(owner):
+    """Экземпляр сервиса от имени другого процесса"""
+    service = JobLockService()
+    service.owner = owner
+    service._refresh_owner = lambda: None
+    return service
+
+@pytest.fixture
+def locks(app):
+    db.create_all()
+    return make_service('host-a:1'), make_service('host-b:2')
+
+@pytest.fixture
+def tasks(app, monkeypatch):
+    db.create_all()
+    monkeypatch.setattr(job_lock_module.job_lock_service, 'heartbeat_seconds', 0.05)
+    tasks = AnalyticsTasks()
+    tasks.app = app
+    return tasks
+
+def test_acquire_is_exclusive_until_release(locks):
+    first, second = locks
+
+    assert first.acquire('daily_metrics')
+    assert not second.acquire('daily_metrics')
+    # Владелец может взять аренду повторно
+    assert first.acquire('daily_metrics')
+
+    first.release('daily_metrics')
+    assert second.acquire('daily_metrics')
+    assert db.session.get(JobLock, 'daily_metrics').owner == 'host-b:2'
+
+def test_expired_lease_is_taken_over(locks):
+    first, second = locks
+    assert first.acquire('daily_metrics')
+    db.session.execute(JobLock.__table__.update().values(
+        locked_until=datetime.utcnow() - timedelta(seconds=1)
+    ))
+    db.session.commit()
+
+    assert second.acquire('daily_metrics')
+    assert not first.extend('daily_metrics')
+    assert second.extend('daily_metrics')
+
+def test_release_by_non_owner_keeps_lease(locks):
+    first, second = locks
+    assert first.acquire('daily_metrics')
+
+    second.release('daily_metrics')
+
+    assert not second.acquire('daily_metrics')
+
+def test_heartbeat_keeps_lease_alive(locks, app):
+    first, second = locks
+    first.heartbeat_seconds = 0.05
+    assert first.acquire('daily_metrics', lease_seconds=1)
+
+    with first.heartbeat('daily_metrics', app) as lost:
+        time.sleep(1.3)
+        assert not second.acquire('daily_metrics')
+
+    assert not lost.is_set()
+
+def test_heartbeat_reports_stolen_lease(locks, app):
+    first, second = locks
+    first.heartbeat_seconds = 0.05
+    assert first.acquire('daily_metrics')
+
+    with first.heartbeat('daily_metrics', app) as lost:
+        db.session.execute(JobLock.__table__.update().values(owner=second.owner))
+        db.session.commit()
+        assert lost.wait(2)
+
+def test_run_job_records_checkpoint_and_skips_completed_period(tasks):
+    calls = []
+
+    def job(period):
+        calls.append(period)
+        return 7
+
+    tasks.run_job('daily_metrics', job, lambda: PERIOD)
+    tasks.run_job('daily_metrics', job, lambda: PERIOD)
+
+    assert calls == [PERIOD]
+    run = JobRun.query.one()
+    assert (run.status, run.rows_processed, run.last_checkpoint) == ('success', 7, PERIOD.isoformat())
+    # Аренда освобождена после запуска
+    assert make_service('host-b:2').acquire('daily_metrics')
+
+def test_run_job_skips_when_another_process_holds_lease(tasks):
+    assert make_service('host-b:2').acquire('daily_metrics')
+    calls = []
+
+    tasks.run_job('daily_metrics', lambda period: calls.append(period), lambda: PERIOD)
+
+    assert calls == []
+    assert JobRun.query.count() == 0
+
+def test_run_job_fails_when_lease_is_lost(tasks):
+    def job(period):
+        db.session.execute(JobLock.__table__.update().values(owner='host-b:2'))
+        db.session.commit()
+        time.sleep(0.3)
+        return 1
+
+    tasks.run_job('daily_metrics', job, lambda: PERIOD)
+
+    run = JobRun.query.one()
+    assert run.status == 'failed'
+    assert 'lost' in run.error
+    assert not job_lock_module.job_lock_service.is_completed('daily_metrics', PERIOD.isoformat())
@@ -0,0 +1,104 @@
+import pytest
+
+from src.database import db
+from src.models.code_sequence import CodeSequence
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.referral_tracking import ReferralTracking  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.services.click_counters import click_counters
+from src.services.code_allocator import SEQUENCES, code_allocator, encode
+from src.services.link_resolver import LinkSnapshot, link_resolver
+from src.services.referral_link_bulk_service import ReferralLinkBulkService
+
+@pytest.fixture
+def campaign(app, monkeypatch):
+    db.create_all()
+    code_allocator._blocks.clear()
+    code_allocator._pending.clear()
+    link_resolver.cache.clear()
+    monkeypatch.setattr(click_counters, 'enabled', False)
+
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.commit()
+    return campaign
+
+def test_bulk_insert_resets_cached_miss(campaign, monkeypatch):
+    """Код, закешированный как неизвестный, находится после массового создания"""
+    # Следующий блок начнется с текущего значения счетчика
+    code_allocator._blocks.clear()
+    sequence = db.session.get(CodeSequence, 'referral_link')
+    alphabet, length = SEQUENCES['referral_link']
+    next_code = encode(
+        code_allocator._permutations['referral_link'].permute(sequence.next_value if sequence else 0),
+        alphabet, length
+    )
+    assert link_resolver.resolve(next_code) is None
+
+    template, _, count = ReferralLinkBulkService.parse_template({'count': 1})
+    csv_text = ''.join(ReferralLinkBulkService.generate_links(campaign.id, 1, template, count))
+
+    assert next_code in csv_text
+    snapshot = link_resolver.resolve(next_code)
+    assert snapshot is not None and snapshot.campaign_id == campaign.id
+
+def test_counter_updates_need_no_invalidation(campaign):
+    """Снимок не содержит счетчиков: лимит кликов виден после Core UPDATE"""
+    assert not set(LinkSnapshot._fields) & {'total_clicks', 'unique_clicks', 'last_clicked_at'}
+
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link', max_clicks=2)
+    db.session.add(link)
+    db.session.commit()
+
+    snapshot = link_resolver.resolve(link.short_code)
+    assert link_resolver.can_be_clicked(snapshot)
+
+    click_counters.add(link.id, campaign.id, total=2)
+    assert link_resolver.resolve(link.short_code) is snapshot
+    assert not link_resolver.can_be_clicked(snapshot)
+
+def test_load_interleaved_with_update_is_not_cached(campaign, monkeypatch):
+    """Снимок, прочитанный до коммита изменения, не остается в кеше"""
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link')
+    db.session.add(link)
+    db.session.commit()
+    short_code = link.short_code
+    load = link_resolver._load
+
+    def interleaved_load(code):
+        stale = load(code)
+        # Параллельный запрос деактивирует ссылку, пока загрузка не завершилась
+        link.is_active = False
+        db.session.flush()
+        assert link_resolver.cache.get(code) is None
+        db.session.commit()
+        return stale
+
+    monkeypatch.setattr(link_resolver, '_load', interleaved_load)
+    assert link_resolver.resolve(short_code).is_active
+    monkeypatch.setattr(link_resolver, '_load', load)
+
+    assert link_resolver.cache.get(short_code) is None
+    assert not link_resolver.resolve(short_code).is_active
+
+def test_rolled_back_update_keeps_cache(campaign):
+    """Откаченное изменение не сбрасывает кеш, закоммиченное - сбрасывает"""
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link')
+    db.session.add(link)
+    db.session.commit()
+    snapshot = link_resolver.resolve(link.short_code)
+
+    link.is_active = False
+    db.session.flush()
+    assert link_resolver.resolve(link.short_code) is snapshot
+    db.session.rollback()
+    assert link_resolver.resolve(link.short_code) is snapshot
+
+    link.is_active = False
+    db.session.commit()
+    assert not link_resolver.resolve(link.short_code).is_active
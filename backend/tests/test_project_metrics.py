@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsMetric, UserSession
+from src.models.project import Project
+from src.models.reference import Reference  # noqa: F401 - связи Project
+from src.models.user import User  # noqa: F401
+from src.services.analytics_service import AnalyticsService
+
+@pytest.fixture
+def day(app):
+    db.create_all()
+    day = datetime.utcnow().date() - timedelta(days=1)
+    noon = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+    db.session.add_all([Project(id=1, title='One', user_id=1), Project(id=2, title='Two', user_id=1)])
+    db.session.commit()
+
+    events = [
+        (1, 'a', 'project_view', 1, noon),
+        (1, 'a', 'project_view', 1, noon),
+        (2, 'b', 'project_view', 1, noon),
+        (2, 'b', 'like', 1, noon),
+        (None, 'c', 'project_view', 2, noon),
+        (3, 'd', 'project_view', 99, noon),  # проекта нет
+        (3, 'd', 'project_view', 1, noon + timedelta(days=1)),  # другой день
+    ]
+    AnalyticsService.ingest_events([
+        {'user_id': user_id, 'session_id': session_id, 'event_type': name, 'event_name': name,
+         'project_id': project_id, 'created_at': created_at}
+        for user_id, session_id, name, project_id, created_at in events
+    ])
+    UserSession.query.filter_by(session_id='a').update({'duration': 60})
+    UserSession.query.filter_by(session_id='b').update({'duration': 120})
+    db.session.commit()
+    return day
+
+def project_metrics(day):
+    return {
+        (row.project_id, row.metric_name): row.value
+        for row in AnalyticsMetric.query.filter_by(
+            metric_type='daily', date=datetime.combine(day, datetime.min.time())
+        )
+    }
+
+def test_all_projects_in_one_pass(day):
+    assert AnalyticsService.calculate_all_project_metrics(day, chunk_size=1) == 2
+
+    assert project_metrics(day) == {
+        (1, 'project_views'): 3, (1, 'unique_viewers'): 2, (1, 'avg_session_duration'): 90,
+        (2, 'project_views'): 1, (2, 'unique_viewers'): 0, (2, 'avg_session_duration'): 0,
+    }
+
+def test_recalculation_is_idempotent(day):
+    AnalyticsService.calculate_all_project_metrics(day)
+    AnalyticsService.calculate_all_project_metrics(day)
+
+    assert AnalyticsMetric.query.count() == 6
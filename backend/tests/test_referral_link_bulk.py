@@ -0,0 +1,80 @@
+import csv
+import io
+
+import pytest
+from flask_jwt_extended import JWTManager, create_access_token
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.referral_tracking import ReferralTracking  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.routes.referrals import referrals_bp
+from src.services.code_allocator import code_allocator
+from src.services.link_resolver import link_resolver
+
+@pytest.fixture
+def client(app):
+    app.config['JWT_SECRET_KEY'] = 'test-jwt-secret-key-with-32-bytes!'
+    JWTManager(app)
+    app.register_blueprint(referrals_bp, url_prefix='/api/referrals')
+    db.create_all()
+    code_allocator._blocks.clear()
+    code_allocator._pending.clear()
+    link_resolver.cache.clear()
+    return app.test_client()
+
+@pytest.fixture
+def campaign(client):
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.commit()
+    return campaign
+
+def post_bulk(client, campaign_id, payload):
+    token = create_access_token(identity='1')
+    return client.post(
+        f'/api/referrals/campaigns/{campaign_id}/links/bulk',
+        json=payload,
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+def test_bulk_links_are_streamed_as_csv(client, campaign, monkeypatch):
+    monkeypatch.setattr('src.services.referral_link_bulk_service.BULK_LINKS_CHUNK_SIZE', 2)
+    response = post_bulk(client, campaign.id, {'count': 5, 'template': {'link_name': 'Promo', 'utm_source': 'mail'}})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['link_name'] for row in rows] == [f'Promo #{i}' for i in range(1, 6)]
+    assert all('utm_source=mail' in row['full_url'] for row in rows)
+
+    links = ReferralLink.query.filter_by(campaign_id=campaign.id).all()
+    assert sorted(link.short_code for link in links) == sorted(row['short_code'] for row in rows)
+
+def test_bulk_links_for_recipients(client, campaign):
+    response = post_bulk(client, campaign.id, {'recipients': ['anna', 'boris'], 'template': {'link_name': 'Invite'}})
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(row['link_name'], row['recipient']) for row in rows] == [
+        ('Invite - anna', 'anna'), ('Invite - boris', 'boris')
+    ]
+    assert all('utm_content=' + row['recipient'] in row['full_url'] for row in rows)
+
+@pytest.mark.parametrize('template, field', [
+    ({'link_name': 5}, 'link_name'),
+    ({'utm_source': ['mail']}, 'utm_source'),
+    ({'description': {}}, 'description'),
+    ({'channel_id': '1'}, 'channel_id'),
+    ({'expires_at': 'tomorrow'}, 'expires_at'),
+])
+def test_invalid_template_field_is_rejected(client, campaign, template, field):
+    response = post_bulk(client, campaign.id, {'count': 1, 'template': template})
+
+    assert response.status_code == 400
+    assert f'template.{field}' in response.get_json()['error']
+    assert ReferralLink.query.count() == 0
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.referral_tracking import ReferralDailyStat, ReferralTracking
+from src.models.user import User  # noqa: F401
+from src.services.job_lock_service import job_lock_service
+from src.services.referral_analytics_service import ROLLUP_JOB_NAME, ReferralAnalyticsService
+from src.tasks.analytics_tasks import AnalyticsTasks
+
+@pytest.fixture
+def tracking(app):
+    db.create_all()
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    other = ReferralCampaign(user_id=1, title='Other', campaign_type='promotion')
+    db.session.add_all([campaign, other])
+    db.session.flush()
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link')
+    db.session.add(link)
+    db.session.flush()
+
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    rows = [
+        # (дней назад, тип, устройство, страна, уникальный, конверсия)
+        (2, 'click', 'mobile', 'DE', True, False),
+        (2, 'click', 'mobile', 'DE', False, False),
+        (2, 'conversion', 'desktop', None, False, True),
+        (1, 'click', 'desktop', 'FR', True, False),
+        (1, 'click', None, 'DE', True, False),
+        (0, 'click', 'mobile', 'DE', True, False),
+    ]
+    db.session.execute(ReferralTracking.__table__.insert(), [
+        {
+            'campaign_id': campaign.id, 'link_id': link.id, 'event_type': event_type,
+            'device_type': device_type, 'country': country, 'is_unique': is_unique,
+            'is_conversion': is_conversion, 'created_at': today - timedelta(days=days_ago, hours=-12)
+        }
+        for days_ago, event_type, device_type, country, is_unique, is_conversion in rows
+    ])
+    # События другой кампании не попадают в аналитику
+    db.session.execute(ReferralTracking.__table__.insert().values(
+        campaign_id=other.id, event_type='click', created_at=today - timedelta(hours=12)
+    ))
+    db.session.commit()
+    return campaign.id, link.id, today.date()
+
+def rollup(day):
+    """Агрегаты за день с отметкой в job_runs, как у ночной задачи"""
+    tasks = AnalyticsTasks()
+    tasks._run_recorded(ROLLUP_JOB_NAME, tasks.calculate_referral_rollups, day)
+
+def analytics(campaign_id, link_id):
+    return (
+        ReferralAnalyticsService.get_campaign_analytics(campaign_id, days=2),
+        ReferralAnalyticsService.get_link_daily_clicks(link_id, days=2)
+    )
+
+def test_live_analytics(tracking):
+    campaign_id, link_id, today = tracking
+
+    campaign, daily = analytics(campaign_id, link_id)
+
+    assert (campaign['total_events'], campaign['unique_events'], campaign['conversions']) == (6, 4, 1)
+    assert campaign['conversion_rate'] == 16.67
+    assert campaign['event_types'] == [{'type': 'click', 'count': 5}, {'type': 'conversion', 'count': 1}]
+    assert campaign['devices'][0] == {'type': 'mobile', 'count': 3}
+    assert {'type': None, 'count': 1} in campaign['devices']
+    assert campaign['countries'] == [{'country': 'DE', 'count': 4}, {'country': 'FR', 'count': 1}]
+    assert daily == [
+        (today - timedelta(days=2), 3, 1),
+        (today - timedelta(days=1), 2, 2),
+        (today, 1, 1)
+    ]
+
+def test_rollups_give_the_same_analytics(tracking):
+    campaign_id, link_id, today = tracking
+    live = analytics(campaign_id, link_id)
+
+    for days_ago in (2, 1):
+        rollup(today - timedelta(days=days_ago))
+
+    assert analytics(campaign_id, link_id) == live
+
+    # Завершенные дни читаются только из агрегатов
+    ReferralTracking.query.filter(
+        ReferralTracking.created_at < datetime.combine(today, datetime.min.time())
+    ).delete()
+    db.session.commit()
+    assert analytics(campaign_id, link_id) == live
+
+def test_days_after_a_missing_rollup_stay_live(tracking):
+    campaign_id, link_id, today = tracking
+    live = analytics(campaign_id, link_id)
+
+    # Нет отметки за первый день периода - агрегаты второго дня не используются
+    rollup(today - timedelta(days=1))
+    ReferralTracking.query.filter(
+        ReferralTracking.created_at >= datetime.combine(today, datetime.min.time()) - timedelta(days=1)
+    ).filter(ReferralTracking.campaign_id == campaign_id).update({'is_unique': False})
+    db.session.commit()
+
+    campaign, daily = analytics(campaign_id, link_id)
+    assert campaign['total_events'] == live[0]['total_events']
+    assert campaign['unique_events'] == 1
+    assert [unique for _, _, unique in daily] == [1, 0, 0]
+
+def test_rerun_replaces_day_rows(tracking):
+    campaign_id, _, today = tracking
+    day = today - timedelta(days=2)
+
+    written = ReferralAnalyticsService.calculate_daily_rollups(day)
+    assert ReferralAnalyticsService.calculate_daily_rollups(day) == written == 2
+
+    rows = ReferralDailyStat.query.filter_by(campaign_id=campaign_id).all()
+    assert sorted((row.event_type, row.device_type, row.country, row.events, row.unique_events, row.conversions)
+                  for row in rows) == [
+        ('click', 'mobile', 'DE', 2, 1, 0),
+        ('conversion', 'desktop', '', 1, 0, 1)
+    ]
+
+def test_campaign_analytics_is_one_query(tracking):
+    campaign_id, _, today = tracking
+    rollup(today - timedelta(days=2))
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        ReferralAnalyticsService.get_campaign_analytics(campaign_id, days=2)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    # Отметки job_runs и один UNION ALL агрегатов с живым срезом
+    assert len(statements) == 2
+    assert 'UNION ALL' in statements[1]
+
+def test_manual_calculation_fills_rollups(tracking):
+    _, link_id, today = tracking
+    day = today - timedelta(days=1)
+
+    AnalyticsTasks().run_manual_calculation(day)
+
+    assert job_lock_service.is_completed(ROLLUP_JOB_NAME, day.isoformat())
+    assert ReferralDailyStat.query.filter_by(link_id=link_id).count() == 2
+    assert db.session.get(ReferralLink, link_id).get_analytics_data(days=2)['total_period_clicks'] == 6
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from src.database import db
+from src.models.analytics_event import AnalyticsEvent, UserSession
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.services.analytics_service import AnalyticsService
+
+@pytest.fixture
+def sessions(app):
+    db.create_all()
+    now = datetime.utcnow()
+    stale = now - timedelta(hours=3)
+
+    rows = []
+    for index in range(5):
+        start = stale - timedelta(minutes=30)
+        rows.append(UserSession(session_id=f'stale{index}', start_time=start, updated_at=stale))
+        db.session.add_all([
+            AnalyticsEvent(session_id=f'stale{index}', event_type='page_view', event_name='page_view',
+                           created_at=start + timedelta(minutes=minutes))
+            for minutes in (1, 5 + index)
+        ])
+    rows += [
+        # Без событий - длительность неизвестна, сессия остается открытой
+        UserSession(session_id='empty', start_time=stale, updated_at=stale),
+        # Активная сессия не закрывается
+        UserSession(session_id='active', start_time=now, updated_at=now),
+        # Уже закрытая сессия не пересчитывается
+        UserSession(session_id='closed', start_time=stale, end_time=stale, duration=42, updated_at=stale),
+    ]
+    db.session.add_all(rows + [
+        AnalyticsEvent(session_id=session_id, event_type='page_view', event_name='page_view', created_at=now)
+        for session_id in ('active', 'closed')
+    ])
+    db.session.commit()
+    return now - timedelta(hours=1)
+
+def by_session_id():
+    db.session.expire_all()
+    return {session.session_id: session for session in UserSession.query.all()}
+
+def test_finalizes_stale_sessions_from_last_event(sessions):
+    assert AnalyticsService.finalize_stale_sessions(sessions, chunk_size=2) == 5
+
+    rows = by_session_id()
+    for index in range(5):
+        session = rows[f'stale{index}']
+        assert session.end_time == session.start_time + timedelta(minutes=5 + index)
+        assert session.duration == (5 + index) * 60
+    assert rows['empty'].end_time is None
+    assert rows['active'].end_time is None
+    assert rows['closed'].duration == 42
+
+    # Повторный запуск ничего не меняет
+    assert AnalyticsService.finalize_stale_sessions(sessions, chunk_size=2) == 0
+
+def test_statements_per_chunk_do_not_depend_on_sessions(sessions):
+    """На каждую часть - выборка сессий, один GROUP BY и один executemany"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        AnalyticsService.finalize_stale_sessions(sessions, chunk_size=3)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    # Шесть устаревших сессий - две части
+    assert sum('GROUP BY' in statement for statement in statements) == 2
+    assert sum(statement.startswith('UPDATE user_sessions') for statement in statements) == 2
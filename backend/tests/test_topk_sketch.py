@@ -0,0 +1,155 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.project import Project
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User
+from src.services.analytics_service import AnalyticsService
+from src.services.topk_sketch import SpaceSaving
+
+def daily_streams(days=5, seed=7):
+    """Дневные потоки: длинный хвост и несколько частых значений"""
+    rng = random.Random(seed)
+    streams = []
+    for day in range(days):
+        stream = [f'tail{rng.randrange(2000)}' for _ in range(800)]
+        stream += ['steady'] * 50 + ['moderate'] * 30
+        stream += ['burst'] * (260 if day == 0 else 2)
+        rng.shuffle(stream)
+        streams.append(stream)
+    return streams
+
+def build(stream, capacity=50):
+    sketch = SpaceSaving(capacity)
+    for item in stream:
+        sketch.add(item)
+    return sketch
+
+def assert_bounds(sketch, exact):
+    """Оценка завышена не больше чем на error, частые значения не потеряны"""
+    for item, (count, error) in sketch.counters.items():
+        assert count - error <= exact[item] <= count
+    threshold = sum(exact.values()) / sketch.capacity
+    assert {item for item, count in exact.items() if count > threshold} <= set(sketch.counters)
+
+def test_exact_below_capacity():
+    sketch = SpaceSaving(10).update({'a': 5, 'b': 3})
+    sketch.add('c')
+    sketch.add('a', 2)
+
+    assert sketch.top() == [('a', 7), ('b', 3), ('c', 1)]
+    assert all(error == 0 for _, error in sketch.counters.values())
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        SpaceSaving(0)
+
+def test_stream_keeps_heavy_hitters():
+    stream = daily_streams(days=1)[0]
+    sketch = build(stream)
+
+    assert len(sketch.counters) == sketch.capacity
+    assert_bounds(sketch, Counter(stream))
+    assert [item for item, _ in sketch.top(3)] == ['burst', 'steady', 'moderate']
+
+def test_merged_daily_sketches_keep_top_k():
+    """Топ за период по слиянию дневных скетчей совпадает с точным топом"""
+    streams = daily_streams()
+    exact = Counter(item for stream in streams for item in stream)
+
+    merged = SpaceSaving(50)
+    for stream in streams:
+        merged.merge(build(stream))
+
+    assert len(merged.counters) == merged.capacity
+    assert_bounds(merged, exact)
+    # burst частый только в первый день, но за период уступает лишь steady
+    assert [item for item, _ in merged.top(3)] == [item for item, _ in exact.most_common(3)]
+    assert [item for item, _ in merged.top(3)] == ['burst', 'steady', 'moderate']
+
+def test_merge_adds_floor_for_values_missing_from_full_sketch():
+    full = SpaceSaving(2).update({'a': 10, 'b': 4})
+    full.add('c')  # вытесняет b: c = 5 с завышением 4
+    other = SpaceSaving(2).update({'b': 6})
+
+    full.merge(other)
+
+    # b мог встретиться в первом скетче до 5 раз (минимальный счетчик)
+    assert full.counters == {'a': [10, 0], 'b': [11, 5]}
+    assert_bounds(full, {'a': 10, 'b': 10, 'c': 1})
+
+def test_merge_order_does_not_change_top():
+    sketches = [build(stream) for stream in daily_streams()]
+
+    forward = SpaceSaving(50)
+    for sketch in sketches:
+        forward.merge(SpaceSaving.from_bytes(sketch.to_bytes(), 50))
+    backward = SpaceSaving(50)
+    for sketch in reversed(sketches):
+        backward.merge(SpaceSaving.from_bytes(sketch.to_bytes(), 50))
+
+    # Оценки зависят от порядка слияния, состав топа - нет
+    assert [item for item, _ in forward.top(3)] == [item for item, _ in backward.top(3)]
+
+def test_serialization_roundtrip():
+    sketch = build(daily_streams(days=1)[0])
+    restored = SpaceSaving.from_bytes(sketch.to_bytes(), sketch.capacity)
+
+    assert restored.counters == sketch.counters
+
+@pytest.fixture
+def tables(app):
+    db.create_all()
+    db.session.add_all([
+        User(id=1, email='owner@example.com', password_hash='x', first_name='A', last_name='B'),
+        Project(id=1, title='Project', user_id=1),
+    ])
+    db.session.commit()
+
+def ingest(created_at, counts, project_id=None):
+    AnalyticsService.ingest_events([
+        {'session_id': 's', 'event_type': 'custom', 'event_name': name, 'project_id': project_id,
+         'country': 'DE', 'created_at': created_at}
+        for name, count in counts.items() for _ in range(count)
+    ])
+
+def test_top_items_merge_days_and_projects(tables):
+    today = datetime.utcnow().replace(hour=12)
+    yesterday = today - timedelta(days=1)
+    ingest(yesterday, {'open': 5, 'share': 1})
+    ingest(today, {'share': 3, 'close': 2})
+    ingest(today, {'share': 2}, project_id=1)
+
+    assert AnalyticsService.get_top_items('events', yesterday) == [('share', 6), ('open', 5), ('close', 2)]
+    assert AnalyticsService.get_top_items('events', today, limit=1) == [('share', 5)]
+    today_start = datetime.combine(today.date(), datetime.min.time())
+    assert AnalyticsService.get_top_items('events', yesterday, end_date=today_start) == [('open', 5), ('share', 1)]
+    assert AnalyticsService.get_top_items('events', yesterday, project_id=1) == [('share', 2)]
+    assert AnalyticsService.get_top_items('countries', yesterday) == [('DE', 13)]
+
+def test_rebuild_replaces_incremental_sketches(tables):
+    day = datetime.utcnow().replace(hour=12) - timedelta(days=1)
+    for _ in range(3):
+        ingest(day, {'open': 2, 'share': 1})
+
+    AnalyticsService.rebuild_topk_sketches(day.date())
+    AnalyticsService.rebuild_topk_sketches(day.date())
+
+    assert AnalyticsService.get_top_items('events', day) == [('open', 6), ('share', 3)]
+
+def test_incremental_batches_keep_top_k(tables):
+    """Каждый пакет сливается с сохраненным скетчем - частые значения не теряются"""
+    day = datetime.utcnow().replace(hour=12)
+    for batch in range(30):
+        counts = {f'tail{batch}-{index}': 1 for index in range(20)}
+        counts.update({'hot': 3, 'warm': 2})
+        ingest(day, counts)
+
+    top = AnalyticsService.get_top_items('events', day, limit=2)
+
+    assert [name for name, _ in top] == ['hot', 'warm']
+    assert top[0][1] >= 90 and top[1][1] >= 60
@@ -0,0 +1,71 @@
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsEvent, UserSession
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.routes import analytics as analytics_routes
+from src.routes.analytics import MAX_BATCH_EVENTS, analytics_bp
+from src.services.ingest_queue import IngestQueue, ingest_queue
+
+@pytest.fixture
+def client(app, monkeypatch):
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    db.create_all()
+    monkeypatch.setattr(ingest_queue, 'enabled', False)
+    return app.test_client()
+
+def post_batch(client, payload):
+    return client.post('/api/analytics/track/batch', json=payload, headers={'User-Agent': 'curl/8.0'})
+
+def test_batch_is_written_with_session_counters(client):
+    response = post_batch(client, {'session_id': 'batch', 'events': [
+        {'event_name': 'home', 'event_type': 'page_view'},
+        {'event_name': 'project', 'event_type': 'project_view', 'project_id': 7},
+        {'event_name': 'other', 'session_id': 'own'},
+    ]})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['accepted'], body['rejected'], body['session_id']) == (3, 0, 'batch')
+
+    session = UserSession.query.filter_by(session_id='batch').one()
+    assert (session.events_count, session.page_views, session.projects_viewed) == (2, 1, 1)
+    assert UserSession.query.filter_by(session_id='own').one().events_count == 1
+    # User-Agent пакета разобран для каждого события
+    assert all(event.browser and event.device_type for event in AnalyticsEvent.query)
+
+def test_invalid_events_are_rejected_individually(client):
+    response = post_batch(client, {'events': [
+        {'event_name': 'ok'},
+        'not an object',
+        {'event_name': 'bad', 'project_id': 'seven'},
+        {'event_type': 'custom'},
+    ]})
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert [result['status'] for result in body['results']] == ['accepted', 'rejected', 'rejected', 'rejected']
+    assert AnalyticsEvent.query.count() == 1
+
+def test_batch_without_valid_events(client):
+    assert post_batch(client, {'events': []}).status_code == 400
+    assert post_batch(client, {'events': [{'event_type': 'custom'}]}).status_code == 400
+    assert post_batch(client, {'session_id': 5, 'events': [{'event_name': 'ok'}]}).status_code == 400
+
+def test_batch_size_is_limited(client):
+    response = post_batch(client, {'events': [{'event_name': 'ok'}] * (MAX_BATCH_EVENTS + 1)})
+    assert response.status_code == 413
+    assert AnalyticsEvent.query.count() == 0
+
+def test_batch_goes_to_ingest_queue(client, tmp_path, monkeypatch):
+    queue = IngestQueue()
+    queue.configure(path=str(tmp_path / 'ingest_queue.db'), enabled=True)
+    monkeypatch.setattr(analytics_routes, 'ingest_queue', queue)
+
+    response = post_batch(client, {'events': [{'event_name': 'a'}, {'event_name': 'b'}]})
+
+    assert response.status_code == 200
+    assert [payload['event_name'] for _, kind, payload, _ in queue.claim()] == ['a', 'b']
+    assert AnalyticsEvent.query.count() == 0
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from src.database import db
+from src.models.analytics_event import AnalyticsHourlyCounter
+from src.services.trending_service import TrendingService
+
+@pytest.fixture
+def service(app, monkeypatch):
+    db.metadata.create_all(db.engine, tables=[AnalyticsHourlyCounter.__table__])
+    monkeypatch.setenv('TRENDING_REFRESH_INTERVAL', '3600')
+    service = TrendingService()
+    yield service
+    service.stop()
+
+def add_views(project_id, views, hours_ago=1):
+    hour = (datetime.utcnow() - timedelta(hours=hours_ago)).replace(minute=0, second=0, microsecond=0)
+    db.session.execute(AnalyticsHourlyCounter.__table__.insert().values(
+        hour=hour, event_name='project_view', project_id=project_id,
+        device_type='', browser='', country='', count=views
+    ))
+    db.session.commit()
+
+def view(project_id):
+    return {'event_name': 'project_view', 'project_id': project_id, 'created_at': datetime.utcnow()}
+
+def test_first_get_top_waits_for_refresh(service):
+    """После старта процесса первый запрос получает топ, а не пустой список"""
+    add_views(1, 5)
+    add_views(2, 50)
+
+    assert [project_id for project_id, _ in service.get_top(10)] == [2, 1]
+
+def test_recent_views_outrank_old_ones(service):
+    add_views(1, 100, hours_ago=24 * 5)
+    add_views(2, 20, hours_ago=1)
+    service.refresh()
+
+    assert [project_id for project_id, _ in service.get_top(10)] == [2, 1]
+
+def test_views_recorded_during_refresh_are_kept(service):
+    """Просмотр, учтенный между запросом перестроения и заменой счетов, не теряется"""
+    add_views(1, 1)
+    recorded = []
+
+    def record_during_query(conn, cursor, statement, *args):
+        if 'analytics_hourly_counters' in statement and not recorded:
+            recorded.append(True)
+            service.record_views([view(2), view(2)])
+
+    event.listen(db.engine, 'before_cursor_execute', record_during_query)
+    try:
+        service.refresh()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_during_query)
+
+    assert recorded
+    assert [project_id for project_id, _ in service.get_top(10)] == [2, 1]
+
+def test_views_between_refreshes_update_top(service, monkeypatch):
+    monkeypatch.setattr(service, 'top_rebuild_interval', 0)
+    add_views(1, 2)
+    service.refresh()
+
+    service.record_views([view(2)] * 3 + [{'event_name': 'page_view', 'project_id': 1}])
+
+    assert [project_id for project_id, _ in service.get_top(10)] == [2, 1]
+
+def test_trending_projects_honor_days(service, monkeypatch):
+    """Проекты без просмотров за days дней в выдачу не попадают"""
+    from src.models.project import Project
+    from src.models.reference import Reference  # noqa: F401 - связи Project
+    from src.models.user import User  # noqa: F401
+    from src.services.analytics_service import AnalyticsService
+
+    db.create_all()
+    db.session.add_all([Project(id=1, title='Old', user_id=1), Project(id=2, title='Fresh', user_id=1)])
+    db.session.commit()
+    add_views(1, 100, hours_ago=24 * 3)
+    add_views(2, 1, hours_ago=1)
+    monkeypatch.setattr('src.services.analytics_service.trending_service', service)
+
+    assert [p['name'] for p in AnalyticsService.get_trending_projects(days=7)] == ['Old', 'Fresh']
+    projects = AnalyticsService.get_trending_projects(days=1)
+    assert [(p['name'], p['views']) for p in projects] == [('Fresh', 1)]
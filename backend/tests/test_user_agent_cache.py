@@ -0,0 +1,54 @@
+import pytest
+
+from src.services import user_agent_service
+from src.services.user_agent_service import (
+    USER_AGENT_CACHE_MAX_LENGTH, classify_user_agent, clear_cache, get_cache_stats, is_bot_user_agent
+)
+
+IPHONE = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1'
+)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+def test_repeated_user_agent_is_parsed_once():
+    first = classify_user_agent(IPHONE)
+    second = classify_user_agent(IPHONE)
+
+    assert first is second
+    assert first.device_type == 'mobile'
+    stats = get_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+def test_parsers_are_cached_separately():
+    analytics = classify_user_agent(IPHONE)
+    referral = classify_user_agent(IPHONE, parser='referral')
+
+    assert analytics.browser.startswith('Mobile Safari')
+    assert referral.browser == 'Safari'
+    assert get_cache_stats()['size'] == 2
+
+def test_long_user_agent_is_not_cached():
+    long_user_agent = IPHONE + ' x' * USER_AGENT_CACHE_MAX_LENGTH
+    classify_user_agent(long_user_agent, parser='referral')
+    assert get_cache_stats()['size'] == 0
+
+def test_missing_user_agent_and_unknown_parser():
+    assert classify_user_agent(None, parser='referral') == classify_user_agent('', parser='referral')
+    with pytest.raises(ValueError):
+        classify_user_agent(IPHONE, parser='unknown')
+
+def test_bot_detection_uses_referral_rules(monkeypatch):
+    calls = []
+    parse_referral = user_agent_service._PARSERS['referral']
+    monkeypatch.setitem(user_agent_service._PARSERS, 'referral', lambda value: calls.append(value) or parse_referral(value))
+
+    assert is_bot_user_agent('Googlebot/2.1 (+http://www.google.com/bot.html)')
+    assert not is_bot_user_agent(IPHONE)
+    assert is_bot_user_agent('Googlebot/2.1 (+http://www.google.com/bot.html)')
+    assert len(calls) == 2
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from src.database import db
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.referral_campaign import ReferralCampaign
+from src.models.referral_channel import ReferralChannel  # noqa: F401
+from src.models.referral_link import ReferralLink
+from src.models.referral_step import ReferralStep  # noqa: F401
+from src.models.referral_tracking import ReferralTracking
+from src.models.user import User  # noqa: F401
+from src.services import referral_click_service
+from src.services.click_counters import click_counters
+from src.services.click_uniqueness import ClickUniquenessIndex
+from src.services.referral_click_service import ReferralClickService
+from src.services.user_agent_service import USER_AGENT_RULES_PATH, UserAgentInfo, UserAgentRules
+
+CHROME_ANDROID = (
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36'
+)
+GOOGLEBOT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+RULES = {
+    'device_type': {'default': 'desktop', 'rules': [{'value': 'mobile', 'match': ['Mobile']}]},
+    'browser': {'default': 'Other', 'rules': [
+        {'value': 'Edge', 'match': ['edg/']},
+        {'value': 'Chrome', 'match': ['chrome', 'crios']}
+    ]},
+    'os': {'default': 'Other', 'rules': [{'value': 'Android', 'match': ['android']}]},
+    'is_bot': {'default': False, 'rules': [{'value': True, 'match': ['bot', 'curl']}]}
+}
+
+def test_rules_follow_priority_not_position():
+    """Побеждает первое по порядку правило, а не первое вхождение в строке"""
+    rules = UserAgentRules(RULES)
+    info = rules.classify('Mozilla/5.0 Chrome/126.0 Safari/537.36 Edg/126.0')
+    assert info.browser == 'Edge'
+
+def test_rules_are_case_insensitive_with_defaults():
+    rules = UserAgentRules(RULES)
+    assert rules.classify('CURL/8.0') == UserAgentInfo('desktop', 'Other', 'Other', True)
+    assert rules.classify('') == UserAgentInfo('desktop', 'Other', 'Other', False)
+
+def test_rules_file_is_loaded(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(RULES), encoding='utf-8')
+    assert UserAgentRules.from_file(str(path)).classify(CHROME_ANDROID) == (
+        UserAgentInfo('mobile', 'Chrome', 'Android', False)
+    )
+
+def test_bundled_rules():
+    rules = UserAgentRules.from_file(USER_AGENT_RULES_PATH)
+    assert rules.classify(CHROME_ANDROID) == UserAgentInfo('mobile', 'Chrome', 'Android', False)
+    assert rules.classify(GOOGLEBOT).is_bot
+
+@pytest.fixture
+def link(app, monkeypatch):
+    db.create_all()
+    monkeypatch.setattr(click_counters, 'enabled', False)
+    monkeypatch.setattr(referral_click_service, 'click_uniqueness', ClickUniquenessIndex())
+
+    campaign = ReferralCampaign(user_id=1, title='Campaign', campaign_type='promotion')
+    db.session.add(campaign)
+    db.session.flush()
+    link = ReferralLink(campaign_id=campaign.id, user_id=1, link_name='Link')
+    db.session.add(link)
+    db.session.commit()
+    return link
+
+def click(link, user_agent):
+    return {
+        'link_id': link.id, 'campaign_id': link.campaign_id,
+        'ip_address': '203.0.113.7', 'user_agent': user_agent
+    }
+
+def test_bot_clicks_are_dropped(link):
+    written = ReferralClickService.process_clicks([click(link, GOOGLEBOT), click(link, CHROME_ANDROID)])
+
+    assert written == 1
+    tracking = ReferralTracking.query.one()
+    assert tracking.user_agent == CHROME_ANDROID and not tracking.is_bot
+    assert db.session.get(ReferralLink, link.id).total_clicks == 1
+
+def test_bot_clicks_are_kept_when_dropping_disabled(link, monkeypatch):
+    monkeypatch.setattr(referral_click_service, 'DROP_BOT_CLICKS', False)
+
+    assert ReferralClickService.process_clicks([click(link, GOOGLEBOT)]) == 1
+    assert ReferralTracking.query.one().is_bot
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import db
+from src.models.analytics_event import AnalyticsMetric
+from src.models.project import Project  # noqa: F401 - связи User
+from src.models.reference import Reference  # noqa: F401
+from src.models.user import User  # noqa: F401
+from src.services.analytics_service import AnalyticsService
+
+@pytest.fixture
+def day(app):
+    db.create_all()
+    day = datetime.utcnow().date() - timedelta(days=1)
+    noon = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+
+    events = [
+        (1, 'a', 'page_view', None, noon),
+        (1, 'a', 'project_view', 1, noon),
+        (1, 'b', 'project_view', 1, noon),
+        (1, 'b', 'project_view', 2, noon),
+        (1, 'b', 'like', 3, noon),
+        (2, 'c', 'page_view', None, noon),
+        (None, 'd', 'project_view', 1, noon),  # анонимное событие
+        (2, 'c', 'project_view', 1, noon - timedelta(days=1)),  # другой день
+    ]
+    AnalyticsService.ingest_events([
+        {'user_id': user_id, 'session_id': session_id, 'event_type': name, 'event_name': name,
+         'project_id': project_id, 'created_at': created_at}
+        for user_id, session_id, name, project_id, created_at in events
+    ])
+    return day
+
+def user_metrics(day):
+    return {
+        (row.user_id, row.metric_name): row.value
+        for row in AnalyticsMetric.query.filter_by(
+            metric_type='daily', date=datetime.combine(day, datetime.min.time())
+        )
+    }
+
+def test_all_users_in_one_pass(day):
+    assert AnalyticsService.calculate_all_user_metrics(day, chunk_size=1) == 2
+
+    assert user_metrics(day) == {
+        (1, 'user_events'): 5, (1, 'user_sessions'): 2, (1, 'user_projects_viewed'): 2,
+        (2, 'user_events'): 1, (2, 'user_sessions'): 1, (2, 'user_projects_viewed'): 0,
+    }
+
+def test_recalculation_is_idempotent(day):
+    AnalyticsService.calculate_all_user_metrics(day)
+    AnalyticsService.calculate_all_user_metrics(day)
+
+    assert AnalyticsMetric.query.count() == 6